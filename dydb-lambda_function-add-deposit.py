@@ -1,49 +1,68 @@
 import os
 import json
 import datetime
-import asyncio
 import logging
-import boto3
 import botocore
-from solana.rpc.api import Client
-from solana.rpc.async_api import AsyncClient
-from solana.rpc.websocket_api import connect
+from solana.rpc.commitment import Confirmed
 from solders.pubkey import Pubkey
 from solders.signature import Signature
-from anchor.accounts import Universe
+from oridion.registry import get_table
+from oridion.registry import get_rpc_pool
+from oridion.registry import get_event_loop
+from oridion.activity import put_activity
+from oridion.activity import ACTIVITY_TABLE
+from oridion.rpc import RpcPoolError
+from oridion.universe import UniverseCache
+from oridion.planets import PlanetIndex
+from oridion.signatures import SignatureSubscriptions
+from oridion.tracker import SignatureTracker
+from oridion.confirm import ConfirmationEngine
+from oridion.confirm import deadline_from_context
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+#DynamoDB
+depositsDB = get_table("deposits")
+activityDB = get_table(ACTIVITY_TABLE)
+
 #we should get this from environment variables.
 universe_pda = Pubkey.from_string(os.environ['UNIVERSE_ADDRESS'])
 oridion_program_id = Pubkey.from_string(os.environ['ORD_PROGRAM_ADDRESS'])
 
-#Set Client and async client (devnet_env or mainnet_env)
-http_client = Client(os.environ['MAINNET_ENV'])
-async_client = AsyncClient(os.environ['MAINNET_ENV'])
+# Planet PDA index (planets.json next to oridion/planets.py, if deployed)
+planet_index = PlanetIndex.load(oridion_program_id)
 
-# Backup RPC 
-backup_http_client = Client(os.environ['BACKUP_RPC'])
-backup_async_client = AsyncClient(os.environ['BACKUP_RPC'])
+#RPC pool (MAINNET_ENV, BACKUP_RPC and any extra RPC_ENDPOINTS)
+rpc_pool = get_rpc_pool()
 
 #WSS URL
 wss_url = os.environ['WSS_URL']
 
+# Shared signature subscription websocket
+signature_subscriptions = SignatureSubscriptions(wss_url)
+
+# Batched signature status tracker shared by every job in the container
+signature_tracker = SignatureTracker(rpc_pool)
+
+# Confirmation engine (websocket raced against status polling)
+confirm_engine = ConfirmationEngine(signature_tracker, signature_subscriptions)
+
+# Universe cache (kept fresh by accountSubscribe)
+universe_cache = UniverseCache(rpc_pool,universe_pda,wss_url)
+universe_cache.add_listener(planet_index.sync)
+
 def lambda_handler(event, context):
     
     #Datetime Now
     current_datetime = datetime.datetime.now()
     now = int(current_datetime.timestamp())
     
-    dynamodb = boto3.resource('dynamodb')
-    depositsDB = dynamodb.Table("deposits")
-    
     # default error messages array and valid marker
     valid = True
     
     # Setup loop
-    loop = asyncio.get_event_loop()
+    loop = get_event_loop()
     
     # Response body
     response_body = {
@@ -91,30 +110,39 @@ def lambda_handler(event, context):
     logger.info("Connecting to http client.")
     
     sig = Signature.from_string(signature)
-    loop.run_until_complete(listen_transaction(sig))
+    deposit_outcome = loop.run_until_complete(listen_transaction(sig,deadline_from_context(context)))
+    if not deposit_outcome:
+        response_body['message'].append(f"Deposit transaction not confirmed ({deposit_outcome.status})")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
     logger.info("Listen returned!")
     
     # Validate that we can connect to solana
     try:
-        response = http_client.get_transaction(sig,"json","confirmed",0).value
+        response = loop.run_until_complete(rpc_pool.hedged_call("get_transaction",sig,"json",Confirmed,0)).value
         logger.info("Connection responded.")
-    except:
-        logger.info("Helius RPC failed. Trying backup mainnet rpc")
-        try:
-            response = backup_http_client.get_transaction(sig,"json","confirmed",0).value
-        except:
-            logger.info("Backup  Main RPC failed. Ending..")       
-            response_body['message'].append("Signature not found in Solana")
-            print(json.dumps(response_body))
-            return {
-                'statusCode': 200,
-                'body': response_body
-            }
+    except RpcPoolError:
+        logger.info("Every RPC failed getting the transaction. Ending..")       
+        response_body['message'].append("Signature not found in Solana")
+        print(json.dumps(response_body))
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
+    if response is None:
+        logger.info("No RPC has the transaction yet. Ending..")
+        response_body['message'].append("Transaction not found yet, retry")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
         
 
     # Get Universe data to validate if there is a fee
     # Use asyncio loop run until complete to synchronously "await" an async function
-    universe = loop.run_until_complete(get_universe())
+    universe = loop.run_until_complete(universe_cache.get())
     if not universe:
         response_body['message'].append("Universe not found")
         print("Could not get universe")
@@ -124,6 +152,20 @@ def lambda_handler(event, context):
         }
         
         
+    # --------------------------------- #
+    # Make sure the planet is in fact in the universe planets list
+    # (before its PDA is derived from the user supplied name)
+    if(planet_name not in universe_cache.planets):
+        logger.info("Planet not in universe!") 
+        response_body['message'].append("Planet not in universe")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
+    # --------------------------------- #
+    logger.info("planet name found in universe") 
+        
+        
     logger.info("Connection to Solana completed!")   
     # END signature validation
     # We are now connected and transaction went through
@@ -146,8 +188,7 @@ def lambda_handler(event, context):
     user_pk = Pubkey.from_string(user_public_key)
       
     # Planet pubkey
-    planet_pda_seed = [b"_PLA_", planet_name.encode(), b"_NET_"]
-    planet_pda, nonce = Pubkey.find_program_address(planet_pda_seed, oridion_program_id)
+    planet_pda = planet_index.pda(planet_name)
     # print(planet_pda)
     
     logger.info(f"accounts_count: {str(accounts_count)}")
@@ -256,27 +297,15 @@ def lambda_handler(event, context):
     # --------------------------------- #
     logger.info("Obtained universe account") 
     
-    # --------------------------------- #
-    # Final check is to make sure the planet is in fact in the universe planets list
-    if(planet_name not in universe.p):
-        logger.info("Planet not in universe!") 
-        response_body['message'].append("Planet not in universe")
-        return {
-            'statusCode': 200,
-            'body': response_body
-        }
-    # --------------------------------- #
-    logger.info("planet name found in universe") 
     
     
-    activity = [
-        {
-            'action': 'D',
-            'to': planet_name,
-            'time': str(now),
-            'signature' : signature
-        }
-    ]
+    # First entry of the wallet's history
+    new_item = {
+        'action': 'D',
+        'to': planet_name,
+        'time': str(now),
+        'signature' : signature
+    }
     
     
     # --------------------------------- #
@@ -297,7 +326,8 @@ def lambda_handler(event, context):
                 "hops" : 2,
                 "created": now,
                 "last_updated": now,
-                "activity" : json.dumps(activity)
+                "last_signature": signature,
+                "last_action": "D"
             },
             ConditionExpression='attribute_not_exists(wallet)',
         )
@@ -313,6 +343,8 @@ def lambda_handler(event, context):
             'body': response_body
         }
         
+    # Record the deposit in the wallet's history
+    put_activity(activityDB,user_public_key,new_item)
 
     logger.info("Deposit created successfully")    
     logger.info("Done") 
@@ -326,33 +358,8 @@ def lambda_handler(event, context):
     }
     
     
-# fetch universe account
-async def get_universe():
-    try:
-        acc = await Universe.fetch(async_client, universe_pda)
-        logger.info("Helius RPC API succeeded")
-    except:
-        logger.info("Helius RPC Error, trying mainnet api..")
-        try:
-            acc = await Universe.fetch(backup_async_client,universe_pda)
-            logger.info("Main RPC API succeeded")
-        except:
-            logger.info("Both Helius and Main RPC API failed")
-            acc = False
-    return acc
-
-
-async def listen_transaction(signature):
-    async with connect(wss_url) as websocket:
-        #finalized is about 16 seconds
-        #confirmed is about 6 seconds
-        await websocket.signature_subscribe(signature,"confirmed")
-        logger.info("Subscribed to the signature")
-        first_resp = await websocket.recv()
-        subscription_id = first_resp[0].result
-        next_resp = await websocket.recv()
-        logger.info("Received data")
-        # logger.info(subscription_id) //Receiving correctly
-        logger.info(next_resp)
-        await websocket.signature_unsubscribe(subscription_id)
-        return next_resp
\ No newline at end of file
+async def listen_transaction(signature, deadline=None, last_valid_height=None):
+    # Websocket notification raced against status polling, bounded by the deadline
+    outcome = await confirm_engine.confirm(signature, deadline, last_valid_height)
+    logger.info(f"Confirmation: {outcome}")
+    return outcome
\ No newline at end of file
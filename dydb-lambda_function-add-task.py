@@ -1,12 +1,14 @@
 import os
 import datetime
-import asyncio
 import logging
-import boto3
 import botocore
-from solana.rpc.async_api import AsyncClient
 from solders.pubkey import Pubkey
-from anchor.accounts import Universe
+from oridion.registry import get_table
+from oridion.registry import projection
+from oridion.registry import get_sns_client
+from oridion.registry import get_rpc_pool
+from oridion.registry import get_event_loop
+from oridion.universe import UniverseCache
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -14,18 +16,18 @@ logger.setLevel(logging.INFO)
 #we should get this from environment variables.
 universe_pda = Pubkey.from_string(os.environ['UNIVERSE_ADDRESS'])
 
-# Set async client (devnet_env or mainnet_env)
-async_client = AsyncClient(os.environ['MAINNET_ENV'])
+#RPC pool (MAINNET_ENV, BACKUP_RPC and any extra RPC_ENDPOINTS)
+rpc_pool = get_rpc_pool()
 
-# Backup RPC Client
-backup_async_client = AsyncClient(os.environ['BACKUP_RPC'])
+# Universe cache (kept fresh by accountSubscribe when WSS_URL is set)
+universe_cache = UniverseCache(rpc_pool,universe_pda,os.environ.get('WSS_URL'))
 
 #SNS
-snsClient = boto3.client('sns')
+snsClient = get_sns_client()
 
 # Set up DB
-dynamodb = boto3.resource('dynamodb')
-jobsDB = dynamodb.Table("jobs")
+jobsDB = get_table("jobs")
+depositsDB = get_table("deposits")
 
 def lambda_handler(event, context):
     
@@ -37,7 +39,7 @@ def lambda_handler(event, context):
     valid = True
     
     # Setup loop
-    loop = asyncio.get_event_loop()
+    loop = get_event_loop()
     
     # Response body
     response_body = {
@@ -90,7 +92,7 @@ def lambda_handler(event, context):
         # Get Universe data
         # Use asyncio loop run until complete to synchronously "await" an async function
         
-        universe = loop.run_until_complete(get_universe())
+        universe = loop.run_until_complete(universe_cache.get())
         if not universe:
             response_body['message'].append("Universe not found")
             # print(json.dumps(error_status))
@@ -101,7 +103,7 @@ def lambda_handler(event, context):
         logger.info("Obtained universe account") 
         
         # Checking planet is in the universe planets list
-        if(destination not in universe.p):
+        if(destination not in universe_cache.planets):
             logger.info("Planet not in universe!") 
             response_body['message'].append("Planet not in universe")
             return {
@@ -133,15 +135,22 @@ def lambda_handler(event, context):
     ############## ADD JOB TO DB ############
     logger.info("Submitting to DB...")
 
+    job_item = {
+        "wallet": wallet_pk,
+        "type": job_type,
+        "destination": destination,
+        "created": now,
+        "completed": 0
+    }
+    # Planet the job starts from, so a redelivered job record is not applied
+    # from wherever the deposit has moved to since
+    deposit_data = get_deposit(wallet_pk)
+    if deposit_data:
+        job_item["from"] = deposit_data["loc"]
+
     try:
         jobsDB.put_item(
-            Item={
-                "wallet": wallet_pk,
-                "type": job_type,
-                "destination": destination,
-                "created": now,
-                "completed": 0
-            },
+            Item=job_item,
             ConditionExpression='attribute_not_exists(wallet)',
         )
     except botocore.exceptions.ClientError as err:
@@ -169,21 +178,28 @@ def lambda_handler(event, context):
     }
     
     
-# fetch universe account
-async def get_universe():
-    try:
-        acc = await Universe.fetch(async_client, universe_pda)
-        logger.info("Helius RPC API succeeded")
-    except:
-        logger.info("Helius RPC Error, trying mainnet api..")
-        try:
-            acc = await Universe.fetch(backup_async_client,universe_pda)
-            logger.info("Main RPC API succeeded")
-        except:
-            logger.info("Both Helius and Main RPC API failed")
-            acc = False
-    return acc
+def get_deposit(wallet):
+        """
+        Gets deposit data from table 
 
+        :param wallet: Wallet string of user.
+        :return: The deposit data row (loc only)
+        """
+        try:
+            response = depositsDB.get_item(Key={"wallet": wallet}, **projection("loc"))
+        except botocore.exceptions.ClientError as err:
+            logger.error(
+                "Couldn't get deposit. Error: %s: %s",
+                err.response["Error"]["Code"],
+                err.response["Error"]["Message"],
+            )
+            raise
+        else:
+            if "Item" in response:
+                return response["Item"]
+            else:
+                return False
+            
 
 def get_job(wallet):
         """
@@ -193,7 +209,7 @@ def get_job(wallet):
         :return: The deposit data row
         """
         try:
-            response = jobsDB.get_item(Key={"wallet": wallet})
+            response = jobsDB.get_item(Key={"wallet": wallet}, **projection("type"))
         except botocore.exceptions.ClientError as err:
             logger.error(
                 "Couldn't get deposit. Error: %s: %s",
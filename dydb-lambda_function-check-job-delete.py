@@ -1,15 +1,20 @@
-import json
+import time
 import logging
-import boto3
 import botocore
 from solders.pubkey import Pubkey
+from oridion.registry import get_table
+from oridion.registry import get_dynamodb
+from oridion.registry import projection
+from oridion.activity import load_activity
+from oridion.activity import query_activity
+from oridion.activity import ACTIVITY_TABLE
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-depositsDB = dynamodb.Table("deposits")
-jobsDB = dynamodb.Table("jobs")
+depositsDB = get_table("deposits")
+jobsDB = get_table("jobs")
+activityDB = get_table(ACTIVITY_TABLE)
 
 
 # Pass wallet, hop transaction, to planet name 
@@ -43,8 +48,8 @@ def lambda_handler(event, context):
         }
     logger.info("Wallet key valid: " + wallet)
     
-    # Get deposit - (To get the from planet and deposit lamports)
-    deposit_data = get_deposit(wallet)
+    # Get deposit and job in one round trip
+    deposit_data, job_data = get_deposit_and_job(wallet)
     if not deposit_data:
         logger.info("Deposit data was not found. Ending.")
         response_body['message'].append("Deposit data for wallet address not found")
@@ -57,7 +62,6 @@ def lambda_handler(event, context):
     
 
     # Checking Job DB - Get job type here!
-    job_data = get_job(wallet)
     if not job_data:
         response_body['message'].append("Job not found for wallet address")
         return {
@@ -81,9 +85,14 @@ def lambda_handler(event, context):
     # Job is completed! Woot! So now we delete the job and send back and completed message. 
     logger.info("Job is now completed!") 
     
-    # Delete job
-    delete_job_result = delete_job(wallet)
-    if not delete_job_result:
+    # Last signature to return, kept on the deposit by every writer
+    # (read before a withdraw deletes the deposit)
+    last_signature = deposit_data.get('last_signature') or get_last_signature(wallet)
+    print(f"Last signature: {last_signature}")
+    
+    # Delete job, and the deposit too if the job type is withdraw (one transaction)
+    delete_result = delete_job(wallet, job_type == "withdraw")
+    if not delete_result:
         response_body['message'].append("Job was completed but there was an error deleting job from db")
         return {
             'statusCode': 200,
@@ -91,26 +100,8 @@ def lambda_handler(event, context):
         }
 
     logger.info("Job deleted successfully!")    
-
-    # If the job type is withdraw, we delete the deposit here!
     if job_type == "withdraw":
-        delete_result = delete_deposit(wallet)
-        if not delete_result:
-            print("There was an error deleting deposit from db")
-            return
         logger.info("Withdraw job so despoit data deleted!")
-
-    
-    # Get last signature to return 
-    # activity = deposit_data['activity']
-    #act_obj = ast.literal_eval(activity)
-    print(deposit_data['activity'])
-    activity = json.loads(deposit_data['activity'])
-    
-    
-    last_activity = list(activity)[-1]
-    print("Last Activity")
-    print(json.dumps(last_activity))
     
     
     logger.info("This job is officially closed and deleted!") 
@@ -120,89 +111,82 @@ def lambda_handler(event, context):
         'body': {
             'status':'done',
             'message':'Job closed and deleted',
-            'signature': last_activity['signature']
+            'signature': last_signature
         }
     }
     
     
 
-def get_deposit(wallet):
+def get_deposit_and_job(wallet):
         """
-        Gets deposit data from table 
+        Gets deposit and job data with one BatchGetItem
 
         :param wallet: Wallet string of user.
-        :return: The deposit data row
+        :return: Tuple of (deposit data row, job data row), False for a missing row
         """
+        key = {"wallet": wallet}
+        request = {
+            depositsDB.name: {"Keys": [key], **projection("wallet", "last_signature")},
+            jobsDB.name: {"Keys": [key], **projection("type", "completed")},
+        }
+        found = {}
         try:
-            response = depositsDB.get_item(Key={"wallet": wallet})
+            # Keys DynamoDB could not read this time come back as UnprocessedKeys
+            while request:
+                response = get_dynamodb().batch_get_item(RequestItems=request)
+                for table_name, items in response["Responses"].items():
+                    found[table_name] = items[0] if items else False
+                request = response.get("UnprocessedKeys")
+                if request:
+                    time.sleep(0.05)
         except botocore.exceptions.ClientError as err:
             logger.error(
-                "Couldn't get deposit. Error: %s: %s",
+                "Couldn't get deposit and job. Error: %s: %s",
                 err.response["Error"]["Code"],
                 err.response["Error"]["Message"],
             )
             raise
-        else:
-            if "Item" in response:
-                return response["Item"]
-            else:
-                return False
+        return found.get(depositsDB.name, False), found.get(jobsDB.name, False)
     
 
-def get_job(wallet):
+def get_last_signature(wallet):
         """
-        Gets job data from table 
+        Last signature of a deposit written before last_signature existed.
+        Taken from the newest activity entry, else from the old activity attribute.
 
         :param wallet: Wallet string of user.
-        :return: The deposit data row
+        :return: Signature string
         """
-        try:
-            response = jobsDB.get_item(Key={"wallet": wallet})
-        except botocore.exceptions.ClientError as err:
-            logger.error(
-                "Couldn't get deposit. Error: %s: %s",
-                err.response["Error"]["Code"],
-                err.response["Error"]["Message"],
-            )
-            raise
-        else:
-            if "Item" in response:
-                return response["Item"]
-            else:
-                return False
+        entries, _ = query_activity(activityDB, wallet, 1)
+        if entries:
+            return entries[0]['signature']
+        response = depositsDB.get_item(Key={"wallet": wallet}, **projection("activity"))
+        return load_activity(response.get("Item", {}).get("activity"))[-1]['signature']
     
 
-def delete_job(wallet):
-        """
-        Delete job for wallet
-        :param wallet: updating wallet deposit (Key)
-        :return: Boolean of success or failure.
+def delete_job(wallet, with_deposit):
         """
-        
-        try:
-            jobsDB.delete_item(Key={"wallet": wallet})
-        except botocore.exceptions.ClientError as err:
-            logger.error(
-                "Couldn't delete deposit! Here's why: %s: %s",
-                err.response["Error"]["Code"],
-                err.response["Error"]["Message"],
-            )
-            return False
-        else:
-            return True
-            
-def delete_deposit(wallet):
-        """
-        Delete deposit info for wallet
-
-        :param wallet: updating wallet deposit (Key)
+        Delete completed job for wallet, and its deposit, in one transaction
+        :param wallet: wallet of the job (Key)
+        :param with_deposit: Also delete the deposit (withdraw jobs)
         :return: Boolean of success or failure.
         """
+        key = {"wallet": wallet}
+        items = [{
+            "Delete": {
+                "TableName": jobsDB.name,
+                "Key": key,
+                "ConditionExpression": "completed = :completed",
+                "ExpressionAttributeValues": {":completed": 1},
+            }
+        }]
+        if with_deposit:
+            items.append({"Delete": {"TableName": depositsDB.name, "Key": key}})
         try:
-            depositsDB.delete_item(Key={"wallet": wallet})
+            jobsDB.meta.client.transact_write_items(TransactItems=items)
         except botocore.exceptions.ClientError as err:
             logger.error(
-                "Couldn't delete deposit! Here's why: %s: %s",
+                "Couldn't delete job! Here's why: %s: %s",
                 err.response["Error"]["Code"],
                 err.response["Error"]["Message"],
             )
@@ -1,15 +1,19 @@
 import json
 import logging
-import boto3
 import botocore
 from solders.pubkey import Pubkey
+from oridion.registry import get_table
+from oridion.activity import dump_activity
+from oridion.activity import query_activity
+from oridion.activity import ACTIVITY_TABLE
+from oridion.activity import ACTIVITY_PAGE_SIZE
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-db = dynamodb.Table("deposits")
+db = get_table("deposits")
+activityDB = get_table(ACTIVITY_TABLE)
 
 
 # Post variable should be wallet
@@ -57,6 +61,26 @@ def lambda_handler(event, context):
     # Validations complete
     #-------------------------------------------------------------------#
     
+    # --------------------------------- #
+    # History mode: one page of the wallet's activity, newest first.
+    # Pass the returned "next" as "start" to get the following page.
+    if event.get('history'):
+        try:
+            limit = max(1, min(int(event.get('limit', ACTIVITY_PAGE_SIZE)), 100))
+            start = int(event['start']) if event.get('start') is not None else None
+        except (TypeError, ValueError):
+            response_body['message'].append("limit and start must be numbers")
+            return {
+                'statusCode': 400,
+                'body': response_body
+            }
+        entries, cursor = query_activity(activityDB, user_public_key, limit, start)
+        logger.info(f"Returning {len(entries)} activity entries")
+        return {
+            'statusCode' : 200,
+            'body': {'status': 'success', 'activity' : json.loads(dump_activity(entries)), 'next' : cursor }
+        }
+
     # --------------------------------- #
     # DYNAMO DB Connection
     logger.info("Connecting to Dynamodb for: " + user_public_key)
@@ -92,7 +116,15 @@ def get_deposit(wallet):
 
             if "Item" in response:
                 logger.info("Wallet data found in table")
-                return response["Item"]
+                item = response["Item"]
+                # Activity stays a JSON string in the response, oldest first, whichever
+                # format is stored. From the activity table that is the newest
+                # ACTIVITY_PAGE_SIZE entries (history mode pages through the rest)
+                if "activity" not in item:
+                    entries, _ = query_activity(activityDB, wallet)
+                    item["activity"] = list(reversed(entries))
+                item["activity"] = dump_activity(item["activity"])
+                return item
             else:
                 logger.info("Wallet was not found in table")
                 logger.info(response)
@@ -1,37 +1,49 @@
-import ast
-import json
 import datetime
-import asyncio
 import logging
-import boto3
 import botocore
 import os
-from anchorpy import Provider
-from anchorpy import Wallet
-from solana.transaction import Transaction
 from solana.rpc.types import TxOpts
 from solana.rpc.commitment import Confirmed
-from solana.rpc.api import Client
-from solana.rpc.async_api import AsyncClient
 from solders.pubkey import Pubkey
-from solders.keypair import Keypair
 from solders.signature import Signature
-from anchor.accounts import Universe
 from anchor.instructions import planet_hop
+from oridion.registry import get_table
+from oridion.registry import projection
+from oridion.registry import get_manager_keypair
+from oridion.registry import get_rpc_pool
+from oridion.registry import get_event_loop
+from oridion.activity import put_activity
+from oridion.activity import ACTIVITY_TABLE
+from oridion.rpc import RpcPoolError
+from oridion.lookup import LookupTable
+from oridion.lookup import build_v0
+from oridion.blockhash import BlockhashCache
+from oridion.universe import UniverseCache
+from oridion.planets import PlanetIndex
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-db = dynamodb.Table("deposits")
+db = get_table("deposits")
+activityDB = get_table(ACTIVITY_TABLE)
 
 #we should get this from environment variables.
 universe_pda = Pubkey.from_string(os.environ['UNIVERSE_ADDRESS'])
 oridion_program_id = Pubkey.from_string(os.environ['ORD_PROGRAM_ADDRESS'])
 
-#Set Client and async client (devnet_env or mainnet_env)
-http_client = Client(os.environ['DEVNET_ENV'])
-async_client = AsyncClient(os.environ['DEVNET_ENV'])
+# Planet PDA index (planets.json next to oridion/planets.py, if deployed)
+planet_index = PlanetIndex.load(oridion_program_id)
+
+#RPC pool for reads and blockhash cache (refreshed in the background while the loop runs)
+rpc_pool = get_rpc_pool('DEVNET_ENV')
+blockhash_cache = BlockhashCache(rpc_pool)
+
+# Address lookup table with the static Oridion accounts (LOOKUP_TABLE_ADDRESS)
+lookup_table = LookupTable(rpc_pool)
+
+# Universe cache
+universe_cache = UniverseCache(rpc_pool,universe_pda,None)
+universe_cache.add_listener(planet_index.sync)
 
 
 # Pass wallet, hop transaction, to planet name 
@@ -44,11 +56,10 @@ def lambda_handler(event, context):
     } 
     
     # Setup loop
-    loop = asyncio.get_event_loop()
+    loop = get_event_loop()
     
     # Setup manager keypair
-    manager_kp = Keypair.from_base58_string(os.environ['MANAGER_SECRET'])
-    manager_anchor_wallet = Wallet(manager_kp)
+    manager_kp = get_manager_keypair()
     # print(manager_kp.pubkey())
     
     # default error messages array and valid marker
@@ -93,7 +104,6 @@ def lambda_handler(event, context):
     
     from_planet_name = deposit_data['loc']
     deposit_lamports = deposit_data['deposit']
-    activity = deposit_data['activity']
     logger.info("DB | Location: : " + from_planet_name)
     logger.info("DB | Deposit: " +  str(deposit_lamports))
     
@@ -113,7 +123,7 @@ def lambda_handler(event, context):
     # Get Universe data
     # --------------------------------- #
     # Use asyncio loop run until complete to synchronously "await" an async function
-    universe = loop.run_until_complete(get_universe())
+    universe = loop.run_until_complete(universe_cache.get())
     if not universe:
         response_body['message'].append("Universe not found")
         logger.error('Universe not found')
@@ -126,7 +136,7 @@ def lambda_handler(event, context):
     # validate to planet name is in universe planets list.
     # We don't need to do from planet name because it's already been validated 
     # before it was entered into the DB. 
-    if(to_planet_name not in universe.p):
+    if(to_planet_name not in universe_cache.planets):
         logger.error("To planet not in universe!") 
         response_body['message'].append("Planet not in universe")
         return {
@@ -140,12 +150,10 @@ def lambda_handler(event, context):
     
     # Set PDAs
     # To Planet pubkey
-    to_planet_pda_seed = [b"_PLA_", to_planet_name.encode(), b"_NET_"]
-    to_planet_pda, nonce = Pubkey.find_program_address(to_planet_pda_seed, oridion_program_id)
+    to_planet_pda = planet_index.pda(to_planet_name)
     
     # From Planet pubkey
-    from_planet_pda_seed = [b"_PLA_", from_planet_name.encode(), b"_NET_"]
-    from_planet_pda, nonce = Pubkey.find_program_address(from_planet_pda_seed, oridion_program_id)
+    from_planet_pda = planet_index.pda(from_planet_name)
     
     logger.info(from_planet_pda)
     logger.info(to_planet_name)
@@ -167,23 +175,27 @@ def lambda_handler(event, context):
     )
     
     #latest blockhash
-    latest_blockhash = http_client.get_latest_blockhash(Confirmed).value
+    latest_blockhash = loop.run_until_complete(blockhash_cache.get())
+    if not latest_blockhash:
+        response_body['message'].append("Could not get latest blockhash")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
     hash = latest_blockhash.blockhash
     
     logger.info(str(hash))
     
-    # Tx - TODO: SET THE block HASH!!!!
-    tx = Transaction(hash)
-    tx.add(ix)
-    logger.info("Built anchor instruction for transaction") 
-    logger.info("Submitting transaction") 
+    # Static accounts (Universe, planets) are loaded from the lookup table
+    lookup_tables = loop.run_until_complete(lookup_table.get())
     
-    #manager signed transaction
-    signed_tx = manager_anchor_wallet.sign_transaction(tx)
-    logger.info("Manager signed transaction successfully") 
+    # Tx (v0, signed by the manager)
+    serialized_tx, _ = build_v0(manager_kp,[ix],hash,lookup_tables)
+    logger.info("Built and signed transaction") 
+    logger.info("Submitting transaction") 
     
     # Submit transaction
-    signature = loop.run_until_complete(submit_hop_planet(async_client,manager_anchor_wallet,signed_tx,acc))
+    signature = loop.run_until_complete(submit_hop_planet(serialized_tx))
     logger.info("Transaction completed") 
     if signature and type(signature) is dict:
         logger.error('ERROR Processing solana transaction')
@@ -201,21 +213,18 @@ def lambda_handler(event, context):
     current_datetime = datetime.datetime.now()
     now = int(current_datetime.timestamp())
     
-    # Update activity
-    act_obj = ast.literal_eval(activity)
+    # New activity entry
     new_item = {
         "action": "HP", # HP = Hop planet
         "to": to_planet_name,
         "time": now,
         "signature": str(signature)
     }
-    act_obj.append(new_item)
-    updated_activity = json.dumps(act_obj)
     
  
     # --------------------------------- #
     # Update Deposit in DB
-    update_result = update_deposit(wallet,to_planet_name,now,updated_activity)
+    update_result = update_deposit(wallet,to_planet_name,now,new_item)
     if not update_result:
         response_body['message'].append("There was an error updating db")
         return {
@@ -223,6 +232,9 @@ def lambda_handler(event, context):
             'body': response_body
         }
 
+    # Record the entry in the wallet's history
+    put_activity(activityDB,wallet,new_item)
+
 
     logger.info("Data row updated successfully")    
     logger.info("Done") 
@@ -240,10 +252,10 @@ def get_deposit(wallet):
         Gets deposit data from table 
 
         :param wallet: Wallet string of user.
-        :return: The deposit data row
+        :return: The deposit data row (loc and deposit only)
         """
         try:
-            response = db.get_item(Key={"wallet": wallet})
+            response = db.get_item(Key={"wallet": wallet}, **projection("loc", "deposit"))
         except botocore.exceptions.ClientError as err:
             logger.error(
                 "Couldn't get deposit. Error: %s: %s",
@@ -257,41 +269,31 @@ def get_deposit(wallet):
             else:
                 return False
     
-# fetch universe account
-async def get_universe():
-    acc = await Universe.fetch(async_client, universe_pda)
-    if acc is None:
-        # the fetch method returns null when the account is uninitialized
-        raise ValueError("account not found")
-    return acc  
-
 # Submit hop planet transaction (Payer is Manager)
-async def submit_hop_planet(async_client,manager_anchor_wallet,tx,acc):
-    # provider = Provider(async_client,manager_anchor_wallet,opts=TxOpts(skip_confirmation=False, preflight_commitment=Confirmed))
-    provider = Provider(async_client,manager_anchor_wallet)
-    # logger.info(json.dumps(provider))
-    sig = await provider.send(tx,TxOpts(preflight_commitment=Confirmed))
-    # logger.info(sig)
-    return sig
+async def submit_hop_planet(serialized_tx):
+    try:
+        resp = await rpc_pool.call("send_raw_transaction",serialized_tx,TxOpts(preflight_commitment=Confirmed))
+    except RpcPoolError as err:
+        # Same shape the handler already reports
+        return {'errorMessage': {'message': str(err.__cause__ or err)}}
+    return resp.value
     
     
-def update_deposit(wallet, to_planet_name,now,updated_activity):
+def update_deposit(wallet, to_planet_name,now,new_item):
         """
         Updates wallet deposit info
 
         :param wallet: updating wallet deposit (Key)
         :param to_planet_name: Destination planet name
         :param now: timestamp of now
-        :param updated_activity: string of array
+        :param new_item: activity entry, kept as last_signature/last_action
         :return: Boolean of success or failure.
         """
-    
         try:
             db.update_item(
                 Key={"wallet": wallet},
-                UpdateExpression="SET loc=:loc, last_updated=:last_updated, hops=hops + :increment, activity=:activity",
-                ExpressionAttributeValues={":loc": to_planet_name, ":last_updated": now, ":increment" : 1, ":activity" : updated_activity},
-                ReturnValues="UPDATED_NEW",
+                UpdateExpression="SET loc=:loc, last_updated=:last_updated, hops=hops + :increment, last_signature=:last_signature, last_action=:last_action",
+                ExpressionAttributeValues={":loc": to_planet_name, ":last_updated": now, ":increment" : 1, ":last_signature" : new_item["signature"], ":last_action" : new_item["action"]},
             )
         except botocore.exceptions.ClientError as err:
             logger.error(
@@ -1,64 +1,118 @@
-import ast
-import json
 import datetime
-import string
-import random
 import asyncio
 import logging
-import boto3
 import botocore
 import os
-from anchorpy import Provider
-from anchorpy import Wallet
-from solana.transaction import Transaction
-from solana.rpc.types import TxOpts
-from solana.rpc.commitment import Confirmed
-from solana.rpc.api import Client
-from solana.rpc.async_api import AsyncClient
-from solana.rpc.websocket_api import connect
 from solders.pubkey import Pubkey
-from solders.keypair import Keypair
-from solders.compute_budget import set_compute_unit_limit
 from solders.compute_budget import set_compute_unit_price
+from solders.compute_budget import set_compute_unit_limit
 from anchor.accounts import Universe
 from anchor.instructions import star_hop_three_start
 from anchor.instructions import star_hop_two_start
 from anchor.instructions import star_hop_three_end
 from anchor.instructions import star_hop_two_end
+from oridion.registry import get_table
+from oridion.registry import projection
+from oridion.registry import get_sns_client
+from oridion.registry import get_manager_keypair
+from oridion.registry import get_rpc_pool
+from oridion.registry import get_event_loop
+from oridion.activity import ACTIVITY_TABLE
+from oridion.jobs import complete_job
+from oridion.lookup import LookupTable
+from oridion.lookup import build_v0
+from oridion.nonce import NoncePool
+from oridion.nonce import NonceLease
+from oridion.nonce import NONCE_TABLE
+from oridion.nonce import NONCE_ADVANCE_CU
+from oridion.payers import PayerPool
+from oridion.compute import ComputeCalibrator
+from oridion.fees import FeeEstimator
+from oridion.rpc import RpcPoolError
+from oridion.blockhash import BlockhashCache
+from oridion.planets import PlanetIndex
+from oridion.stars import StarPool
+from oridion.signatures import SignatureSubscriptions
+from oridion.tracker import SignatureTracker
+from oridion.confirm import ConfirmationEngine
+from oridion.confirm import deadline_from_context
+from oridion.broadcast import Rebroadcaster
+from oridion.batch import run_batch
+from oridion.batch import batch_response
 
 #Logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 #DynamoDB
-dynamodb = boto3.resource('dynamodb')
-depositsDB = dynamodb.Table("deposits")
-jobsDB = dynamodb.Table("jobs")
+depositsDB = get_table("deposits")
+activityDB = get_table(ACTIVITY_TABLE)
+jobsDB = get_table("jobs")
+noncesDB = get_table(NONCE_TABLE)
 
 #SNS
-snsClient = boto3.client('sns')
+snsClient = get_sns_client()
 
 #we should get this from environment variables.
 universe_pda = Pubkey.from_string(os.environ['UNIVERSE_ADDRESS'])
 oridion_program_id = Pubkey.from_string(os.environ['ORD_PROGRAM_ADDRESS'])
 
-#Set Client and async client (devnet_env or mainnet_env)
-http_client = Client(os.environ['MAINNET_ENV'])
-async_client = AsyncClient(os.environ['MAINNET_ENV'])
+# Planet PDA index (planets.json next to oridion/planets.py, if deployed)
+planet_index = PlanetIndex.load(oridion_program_id)
+
+# Star ID/PDA pool (filled on a background thread)
+star_pool = StarPool(oridion_program_id)
+
+#RPC pool (MAINNET_ENV, BACKUP_RPC and any extra RPC_ENDPOINTS)
+rpc_pool = get_rpc_pool()
+
+# Blockhash cache (refreshed in the background while the loop runs)
+blockhash_cache = BlockhashCache(rpc_pool)
+
+# Priority fee estimator (recent prioritization fees per account set)
+fee_estimator = FeeEstimator(rpc_pool)
+
+# Compute unit limits calibrated by simulation
+compute_calibrator = ComputeCalibrator(rpc_pool, oridion_program_id)
+
+# Address lookup table with the static Oridion accounts (LOOKUP_TABLE_ADDRESS)
+lookup_table = LookupTable(rpc_pool)
 
-# Backup RPC 
-backup_http_client = Client(os.environ['BACKUP_RPC'])
-backup_async_client = AsyncClient(os.environ['BACKUP_RPC'])
+# Durable nonces leased from the nonces table (NONCE_ACCOUNTS, off when unset)
+nonce_pool = NoncePool(rpc_pool, noncesDB, get_manager_keypair())
+
+# Fee payers (FEE_PAYER_SECRETS), the manager pays when there are none
+payer_pool = PayerPool(rpc_pool, get_manager_keypair())
 
 #WSS URL
 wss_url = os.environ['WSS_URL']
 
+# Shared signature subscription websocket
+signature_subscriptions = SignatureSubscriptions(wss_url)
+
+# Batched signature status tracker shared by every job in the container
+signature_tracker = SignatureTracker(rpc_pool)
+signature_tracker.add_height_listener(blockhash_cache.observe_block_height)
+
+# Confirmation engine (websocket raced against status polling)
+confirm_engine = ConfirmationEngine(signature_tracker, signature_subscriptions)
+
+# Resends transactions until they land, fail or expire
+rebroadcaster = Rebroadcaster(rpc_pool, confirm_engine)
+
 def lambda_handler(event, context):
     # print(json.dumps(event, indent=2))
-    for record in event['Records']:
-        process_task(record)
+    # Records run concurrently, one at a time per wallet
+    loop = get_event_loop()
+    try:
+        failed = loop.run_until_complete(run_batch(event['Records'], lambda record: process_task(record, context)))
+    finally:
+        # Finish recycling used nonces before the container is frozen
+        loop.run_until_complete(nonce_pool.drain())
+    # Only the failed records are retried (ReportBatchItemFailures)
+    return batch_response(failed)
 
-def process_task(record):
+async def process_task(record, context):
     
     # print(f"DynamoDB Record: {json.dumps(record['dynamodb'])}")
     
@@ -102,25 +156,28 @@ def process_task(record):
     wallet = dbImage['wallet']['S']
     to_planet_name = dbImage['destination']['S']
     
-    # Setup loop
-    loop = asyncio.get_event_loop()
     
     # Setup manager keypair
-    manager_kp = Keypair.from_base58_string(os.environ['MANAGER_SECRET'])
-    manager_anchor_wallet = Wallet(manager_kp)
-    
-    # setup provider
-    provider = Provider(async_client,manager_anchor_wallet,TxOpts(skip_confirmation=False,skip_preflight=True,preflight_commitment=Confirmed,max_retries=0))
-    
-    # backup provider
-    backup_provider = Provider(backup_async_client,manager_anchor_wallet,TxOpts(skip_confirmation=False,skip_preflight=True,preflight_commitment=Confirmed,max_retries=0))
-
+    manager_kp = get_manager_keypair()
 
     logger.info("POST (wallet): " + wallet)
     logger.info("POST (to planet): " + to_planet_name)
     
+    # DynamoDB and SNS calls run on a worker thread, so other records'
+    # confirmations keep going meanwhile
+
+    # A redelivered record must not send its transactions again. Only run it
+    # while its job is still in the table and not completed
+    job_data = await asyncio.to_thread(get_job,wallet)
+    if not job_data or job_data['completed'] != 0:
+        print("Job already completed or deleted. Skipping record")
+        return
+    if 'created' in dbImage and int(job_data.get('created', -1)) != int(dbImage['created']['N']):
+        print("Record is for an older job of this wallet. Skipping record")
+        return
+    
     # Get deposit - (To get the from planet and deposit lamports)
-    deposit_data = get_deposit(wallet)
+    deposit_data = await asyncio.to_thread(get_deposit,wallet)
     
     # Validate deposit data found
     if not deposit_data:
@@ -130,141 +187,132 @@ def process_task(record):
     
     logger.info("Deposit data found for wallet")
     
-    from_planet_name = deposit_data['loc']
+    # Start planet recorded with the job (older jobs: the deposit's loc). A
+    # deposit no longer there was already moved by an earlier delivery
+    from_planet_name = dbImage['from']['S'] if 'from' in dbImage else deposit_data['loc']
+    if deposit_data['loc'] != from_planet_name:
+        print("Deposit is no longer at the job's start planet. Skipping record")
+        return
     deposit_lamports = deposit_data['deposit']
-    activity = deposit_data['activity']
     logger.info("DB | Location: : " + from_planet_name)
     logger.info("DB | Deposit: " +  str(deposit_lamports))
     
     
     # Set PDAs
     # To Planet pubkey
-    to_planet_pda_seed = [b"_PLA_", to_planet_name.encode(), b"_NET_"]
-    to_planet_pda, nonce = Pubkey.find_program_address(to_planet_pda_seed, oridion_program_id)
+    to_planet_pda = planet_index.pda(to_planet_name)
     
     # From Planet pubkey
-    from_planet_pda_seed = [b"_PLA_", from_planet_name.encode(), b"_NET_"]
-    from_planet_pda, nonce = Pubkey.find_program_address(from_planet_pda_seed, oridion_program_id)
+    from_planet_pda = planet_index.pda(from_planet_name)
     
     # Get instructions
     ix_array = get_hop_instruction(job_type,from_planet_pda,to_planet_pda,manager_kp,deposit_lamports)
     
     #########################################################################
     #TX 1: latest blockhash
-    latest_blockhash = get_latest_blockhash_rpc()
+    latest_blockhash = await blockhash_cache.get()
     if not latest_blockhash:
         logger.info("Error getting latest blockhash")
         return
     
     hash_one = latest_blockhash.blockhash
-    last_valid_height = latest_blockhash.last_valid_block_height
     
     #set up compute unit price 
-    cu_limit_one = get_compute_unit("start",job_type)
-    cu_limit_two = get_compute_unit("end",job_type)
+    # (calibrated by simulation, hand tuned numbers until that succeeds)
+    cu_units_one, cu_units_two = await compute_calibrator.get_limits(
+        job_type,
+        [("start", ix_array[0]), ("end", ix_array[1])],
+        manager_kp.pubkey(),
+        hash_one,
+        {"start": get_compute_unit("start",job_type), "end": get_compute_unit("end",job_type)},
+    )
 
     #set up Priority fee
-    priority_fee = set_compute_unit_price(25000)
-    
-    # TX One 
-    tx1 = Transaction()
-    tx1.recent_blockhash = hash_one
-    
-    # set fee payer
-    tx1.fee_payer = manager_kp.pubkey()
-    
-    # Set compute unit price 
-    tx1.add(cu_limit_one)
-    
-    # Add Priority fee
-    tx1.add(priority_fee)
-    
-    # Add instruction
-    tx1.add(ix_array[0])
-
-    # Manager signed transaction
-    signed_tx1 = manager_anchor_wallet.sign_transaction(tx1)
-    logger.info("Manager signed first transaction successfully") 
-    
-    # Serialize tx
-    serialized_tx1 = signed_tx1.serialize()
-
-    logger.info("Built step 1 instruction. Submitting transaction..") 
-
-    # Submit transaction
-    tx1_status = loop.run_until_complete(submit_tx(provider,backup_provider,serialized_tx1,last_valid_height))
-    if not tx1_status:
-        print("Failed submitting transaction 1! Ending!")
-        return;
-
+    # Priced from recent fees on the planets and manager (25000 if there is no estimate)
+    compute_unit_price = await fee_estimator.price(job_type,[from_planet_pda,to_planet_pda,manager_kp.pubkey()],25000)
+    priority_fee = set_compute_unit_price(compute_unit_price)
     
-    logger.info("Submitting Transaction 1 completed") 
-        
-    signature1 = signed_tx1.signature()
-    logger.info(f"Signature 1: {signature1}")
+    # Static accounts (Universe, planets) are loaded from the lookup table
+    lookup_tables = await lookup_table.get()
 
-    # Now verify first transaction completed before moving the next transaction
-    loop.run_until_complete(listen_transaction(signature1))
-    logger.info("Listen returned for signature 1!")
+    # Durable nonce mode (NONCE_ACCOUNTS): each transaction is signed against
+    # its own nonce, so neither expires and TX Two never has to be rebuilt
+    nonces = await nonce_pool.acquire(2)
 
+    # A nonce transaction also runs the advance instruction
+    extra_cu = NONCE_ADVANCE_CU if nonces else 0
+    cu_limit_one = set_compute_unit_limit(cu_units_one + extra_cu)
+    cu_limit_two = set_compute_unit_limit(cu_units_two + extra_cu)
 
-    # sig1_json = json.loads(sig1_data)
-    # logger.info("JSON 1 LOADED")
-
-    #########################################################################
-    #########################################################################
-    # Continue to second transaction
-    
-    #latest blockhash
-    latest_blockhash_two = get_latest_blockhash_rpc()
-    if not latest_blockhash_two:
-        logger.info("Error getting latest blockhash")
-        return
+    # Fee payer for this job's transactions (the manager still signs)
+    payer = await payer_pool.acquire()
+    try:
+        if nonces:
+            latest_blockhash, latest_blockhash_two = nonces
+
+        # TX One
+        serialized_tx1, signature1 = build_signed_tx(cu_limit_one,priority_fee,ix_array[0],latest_blockhash,payer.keypair,manager_kp,lookup_tables)
+        logger.info("Manager signed first transaction successfully") 
+        logger.info(f"Signature 1: {signature1}")
+
+        #########################################################################
+        # TX Two is built and signed now, while TX One confirms, so it can go out
+        # the moment TX One lands. TX One's blockhash is reused while it still has
+        # a safe margin left.
+        if nonces:
+            logger.info("Signing against durable nonces")
+        elif blockhash_cache.is_valid(latest_blockhash):
+            latest_blockhash_two = latest_blockhash
+        else:
+            latest_blockhash_two = await blockhash_cache.get()
+            if not latest_blockhash_two:
+                logger.info("Error getting latest blockhash")
+                return
 
-    hash_two = latest_blockhash_two.blockhash
-    last_valid_height = latest_blockhash.last_valid_block_height
-    logger.info(f"Last valid height: {last_valid_height}")
-        
-    # TX Two
-    tx2 = Transaction()
-    tx2.recent_blockhash = hash_two
-    
-    # Set fee payer
-    tx2.fee_payer = manager_kp.pubkey()
-    
-    # Add cu limit 
-    tx2.add(cu_limit_two)
-    
-    # Add Priority fee
-    tx2.add(priority_fee)
-    
-    # Add instruction
-    tx2.add(ix_array[1])
-    
-    #manager signed transaction
-    signed_tx2 = manager_anchor_wallet.sign_transaction(tx2)
-    logger.info("Manager signed second transaction successfully") 
-    
-    # Serialize tx
-    serialized_tx2 = signed_tx2.serialize()
-    
-    logger.info("Built step 2 transaction. Submitting transaction..") 
+        serialized_tx2, signature2 = build_signed_tx(cu_limit_two,priority_fee,ix_array[1],latest_blockhash_two,payer.keypair,manager_kp,lookup_tables)
+        logger.info("Manager pre-signed second transaction successfully") 
+        logger.info(f"Signature 2: {signature2}")
 
-    # Submit transaction
-    tx2_status = loop.run_until_complete(submit_tx(provider,backup_provider,serialized_tx2,last_valid_height))
-    if not tx2_status:
-        print("Failed submitting transaction 2! Ending!")
-        return;
-    
-    logger.info("Submitting Transaction 2 completed") 
+        logger.info("Built step 1 and step 2 transactions. Submitting transaction 1..") 
 
-    # Set signature two
-    signature2 = signed_tx2.signature()    
-    logger.info(f"Signature 2: {signature2}")
-    
-    # Now verify first transaction completed before moving the next transaction
-    loop.run_until_complete(listen_transaction(signature2))
-    logger.info("Listen returned for signature 2!")
+        # Resend until transaction 1 lands, fails or its blockhash (or nonce) expires
+        if nonces:
+            tx1_outcome = await nonce_pool.submit(rebroadcaster,nonces[0],serialized_tx1,signature1,context)
+        else:
+            tx1_outcome = await rebroadcaster.submit(serialized_tx1,signature1,latest_blockhash.last_valid_block_height,deadline_from_context(context))
+        if not tx1_outcome:
+            print(f"Transaction 1 not confirmed ({tx1_outcome.status})! Ending!")
+            return
+        logger.info("Transaction 1 landed!")
+
+        #########################################################################
+        # Continue to second transaction
+
+        # Only rebuild TX Two if TX One took so long its blockhash is no longer safe
+        if not nonces and not blockhash_cache.is_valid(latest_blockhash_two):
+            logger.info("Pre-signed transaction 2 blockhash too old. Rebuilding..")
+            latest_blockhash_two = await blockhash_cache.get()
+            if not latest_blockhash_two:
+                logger.info("Error getting latest blockhash")
+                return
+            serialized_tx2, signature2 = build_signed_tx(cu_limit_two,priority_fee,ix_array[1],latest_blockhash_two,payer.keypair,manager_kp,lookup_tables)
+            logger.info(f"Signature 2: {signature2}")
+
+        last_valid_height_two = latest_blockhash_two.last_valid_block_height
+        logger.info(f"Last valid height: {last_valid_height_two}")
+
+        # Resend until transaction 2 lands, fails or its blockhash (or nonce) expires
+        if nonces:
+            tx2_outcome = await nonce_pool.submit(rebroadcaster,nonces[1],serialized_tx2,signature2,context)
+        else:
+            tx2_outcome = await rebroadcaster.submit(serialized_tx2,signature2,last_valid_height_two,deadline_from_context(context))
+        if not tx2_outcome:
+            print(f"Transaction 2 not confirmed ({tx2_outcome.status})! Ending!")
+            return
+        logger.info("Transaction 2 landed!")
+    finally:
+        nonce_pool.release(nonces)
+        payer_pool.release(payer)
 
     # sig2_json = json.loads(sig2_data)
     # logger.info("JSON 2 LOADED")
@@ -277,36 +325,26 @@ def process_task(record):
     current_datetime = datetime.datetime.now()
     now = int(current_datetime.timestamp())
     
-    # Update activity
-    act_obj = ast.literal_eval(activity)
+    # New activity entry
     new_item = {
         "action": "HS3", # HP = Hop planet
         "to": to_planet_name,
         "time": now,
         "signature": str(signature1) + ':' + str(signature2)
     }
-    act_obj.append(new_item)
-    updated_activity = json.dumps(act_obj)
     
  
     # --------------------------------- #
-    # Update Deposit in DB
-    update_result = update_deposit(wallet,to_planet_name,now,updated_activity)
-    if not update_result:
-        # response_body['message'].append("There was an error updating depositsDB")
-        print("There was an error updating depositsDB")
-        return
-        
-
-    # Update job to completed
-    job_updated = update_job_to_completed(wallet)
-    if not job_updated:
+    # Move the deposit, record the activity entry and complete the job (one transaction)
+    job_completed = await asyncio.to_thread(complete_job,depositsDB,jobsDB,activityDB,wallet,from_planet_name,to_planet_name,now,new_item)
+    if not job_completed:
+        print("There was an error completing the job in DB")
         return
     
     logger.info("Job set to completed!")
 
     snsMessage = job_type +  " task has been completed for " + wallet
-    send_sns(snsMessage)
+    await asyncio.to_thread(send_sns,snsMessage)
 
     logger.info("Hop successfully completed!")    
     logger.info("Done!") 
@@ -314,15 +352,38 @@ def process_task(record):
     
     
     
+def get_job(wallet):
+        """
+        Gets job data from table 
+
+        :param wallet: Wallet string of user.
+        :return: The job data row (completed and created only)
+        """
+        try:
+            response = jobsDB.get_item(Key={"wallet": wallet}, **projection("completed", "created"), ConsistentRead=True)
+        except botocore.exceptions.ClientError as err:
+            logger.error(
+                "Couldn't get job. Error: %s: %s",
+                err.response["Error"]["Code"],
+                err.response["Error"]["Message"],
+            )
+            raise
+        else:
+            if "Item" in response:
+                return response["Item"]
+            else:
+                return False
+            
+            
 def get_deposit(wallet):
         """
         Gets deposit data from table 
 
         :param wallet: Wallet string of user.
-        :return: The deposit data row
+        :return: The deposit data row (loc and deposit only)
         """
         try:
-            response = depositsDB.get_item(Key={"wallet": wallet})
+            response = depositsDB.get_item(Key={"wallet": wallet}, **projection("loc", "deposit"))
         except botocore.exceptions.ClientError as err:
             logger.error(
                 "Couldn't get deposit. Error: %s: %s",
@@ -347,94 +408,13 @@ def get_deposit(wallet):
 # fetch universe account
 async def get_universe():
     try:
-        acc = await Universe.fetch(async_client, universe_pda)
-        logger.info("Helius RPC API succeeded")
-    except:
-        logger.info("Helius RPC Error, trying mainnet api..")
-        try:
-            acc = await Universe.fetch(backup_async_client,universe_pda)
-            logger.info("Main RPC API succeeded")
-        except:
-            logger.info("Both Helius and Main RPC API failed")
-            acc = False
+        acc = await rpc_pool.run(lambda client: Universe.fetch(client, universe_pda), "Universe fetch")
+    except RpcPoolError:
+        logger.info("Universe fetch failed on every RPC")
+        acc = False
     return acc
 
 
-def update_deposit(wallet, to_planet_name,now,updated_activity):
-        """
-        Updates wallet deposit info
-
-        :param wallet: updating wallet deposit (Key)
-        :param to_planet_name: Destination planet name
-        :param now: timestamp of now
-        :param updated_activity: string of array
-        :return: Boolean of success or failure.
-        """
-    
-        try:
-            depositsDB.update_item(
-                Key={"wallet": wallet},
-                UpdateExpression="SET loc=:loc, last_updated=:last_updated, hops=hops + :increment, activity=:activity",
-                ExpressionAttributeValues={":loc": to_planet_name, ":last_updated": now, ":increment" : 1, ":activity" : updated_activity},
-                ReturnValues="UPDATED_NEW",
-            )
-        except botocore.exceptions.ClientError as err:
-            logger.error(
-                "Couldn't update deposit! Here's why: %s: %s",
-                err.response["Error"]["Code"],
-                err.response["Error"]["Message"],
-            )
-            return False
-
-        else:
-            return True
-        
-
-def update_job_to_completed(wallet):
-        """
-        Updates wallet job to completed
-        :param wallet: updating wallet deposit (Key)
-        :return: Boolean of success or failure.
-        """
-
-        try:
-            jobsDB.update_item(
-                Key={"wallet": wallet},
-                UpdateExpression="SET completed=:completed",
-                ExpressionAttributeValues={":completed":1},
-                ReturnValues="UPDATED_NEW",
-            )
-        except botocore.exceptions.ClientError as err:
-            logger.error(
-                "Couldn't update job! Here's why: %s: %s",
-                err.response["Error"]["Code"],
-                err.response["Error"]["Message"],
-            )
-            return False
-        else:
-            return True
-
-
-def id_generator(size=8, chars=string.ascii_uppercase + string.digits):
-    return ''.join(random.choice(chars) for _ in range(size))
-
-async def listen_transaction(signature):
-    async with connect(wss_url) as websocket:
-        #finalized is about 16 seconds
-        #confirmed is about 6 seconds
-        await websocket.signature_subscribe(signature,"confirmed")
-        logger.info("Subscribed to the signature")
-
-        first_resp = await websocket.recv()
-        subscription_id = first_resp[0].result
-        next_resp = await websocket.recv()
-        logger.info("Received data")
-        # logger.info(subscription_id) //Receiving correctly
-        logger.info(next_resp)
-        await websocket.signature_unsubscribe(subscription_id)
-        return next_resp
-    
-
 def send_sns(snsMessage):
     snsClient.publish(TopicArn='arn:aws:sns:us-west-1:058264465436:TaskComplete',Message=snsMessage)
     print("Message published")
@@ -444,15 +424,35 @@ def send_sns(snsMessage):
 def get_compute_unit(instruction_type,job_type):
         if job_type == "star_two":
             if instruction_type == "start":
-                return set_compute_unit_limit(33000)
+                return 33000
             else:
-                return set_compute_unit_limit(6300)
+                return 6300
             
         if job_type == "star_three":
             if instruction_type == "start":
-                return set_compute_unit_limit(60000)
+                return 60000
             else:
-                return set_compute_unit_limit(9000)
+                return 9000
+
+
+def build_signed_tx(cu_limit,priority_fee,ix,latest_blockhash,payer_kp,manager_kp,lookup_tables):
+    """
+    Builds and signs one hop transaction (v0).
+
+    :param cu_limit: Compute unit limit instruction
+    :param priority_fee: Compute unit price instruction
+    :param ix: Hop instruction
+    :param latest_blockhash: RpcBlockhash or NonceLease to build with
+    :param payer_kp: Fee payer Keypair
+    :param manager_kp: Manager Keypair (signer)
+    :param lookup_tables: Lookup tables holding the static Oridion accounts
+    :return: Tuple of (serialized transaction, signature)
+    """
+    instructions = [cu_limit,priority_fee,ix]
+    # A durable nonce is advanced by the first instruction
+    if isinstance(latest_blockhash, NonceLease):
+        instructions = latest_blockhash.instructions(instructions)
+    return build_v0(payer_kp,instructions,latest_blockhash.blockhash,lookup_tables,[manager_kp])
 
 
 # Get instruction depending on job type
@@ -461,15 +461,8 @@ def get_hop_instruction(job_type,from_planet_pda,to_planet_pda,manager_kp,deposi
 
     instructions = []
 
-    # Generate two star IDs
-    star_one_id = id_generator()
-    star_two_id = id_generator()
-
-    # Get PDAs for stars
-    s1_pda_seed = [b"_ST_", star_one_id.encode(), b"_AR_"]
-    s2_pda_seed = [b"_ST_", star_two_id.encode(), b"_AR_"]
-    s1_planet_pda, nonce = Pubkey.find_program_address(s1_pda_seed, oridion_program_id)
-    s2_planet_pda, nonce = Pubkey.find_program_address(s2_pda_seed, oridion_program_id)
+    # Take two star IDs and their PDAs from the pool
+    (star_one_id, s1_planet_pda, _), (star_two_id, s2_planet_pda, _) = star_pool.take_many(2)
 
     if job_type == "star_two":
         # Log all PDAs
@@ -506,9 +499,7 @@ def get_hop_instruction(job_type,from_planet_pda,to_planet_pda,manager_kp,deposi
 
     # If job type is star_three we generate one more. 
     if job_type == "star_three":
-        star_three_id = id_generator()
-        s3_pda_seed = [b"_ST_", star_three_id.encode(), b"_AR_"]
-        s3_planet_pda, nonce = Pubkey.find_program_address(s3_pda_seed, oridion_program_id)
+        star_three_id, s3_planet_pda, _ = star_pool.take()
 
         # Log all PDAs
         logger.info(f"from_planet_pda: {from_planet_pda}")
@@ -549,60 +540,3 @@ def get_hop_instruction(job_type,from_planet_pda,to_planet_pda,manager_kp,deposi
     instructions.append(ix1)
     instructions.append(ix2)
     return instructions
-    
-
-# Submit transaction (Payer is Manager)
-async def submit_tx(provider,backup_provider,serialized_tx,last_valid_height):
-    
-    blockheight = await get_block_height(provider,backup_provider)
-    if not blockheight:
-        return False
-    
-    #default sent: 1
-    sent = 1
-    
-    while sent < 6 and blockheight < last_valid_height:
-        logger.info(f"Sending Tx | BH: {blockheight}")
-        # await provider.send(tx)
-        try:
-            await provider.connection.send_raw_transaction(serialized_tx,TxOpts(skip_preflight=True))
-            logger.info(f"Sending Tx | Helius | BH: {blockheight}")
-        except:
-            await backup_provider.connection.send_raw_transaction(serialized_tx,TxOpts(skip_preflight=True))
-            logger.info(f"Sending Tx | BACKUP | BH: {blockheight}")
-        sent+=1
-        await asyncio.sleep(1.5)
-        blockheight = await get_block_height(provider,backup_provider)
-
-    logger.info("submitted serialized tx while loop completed")
-    return True
-
-
-async def get_block_height(provider,backup_provider):
-    try:
-        blockheight = (await provider.connection.get_block_height()).value
-    except:
-        logger.info("Error getting block height from Helius API. Trying backup rpc..")
-        try:
-            blockheight = (await backup_provider.connection.get_block_height()).value
-            logger.info("Blockheight received from backup rpc!")
-        except:
-            logger.info("Failed to get Blockheight from both Helius and Backup API")
-            blockheight = False
-    return blockheight
-
-
-def get_latest_blockhash_rpc():
-    try:
-        blockhash = http_client.get_latest_blockhash(Confirmed).value
-        logger.info("Received Blockhash from Helius API.")
-        return blockhash
-    except:
-        logger.info("Error getting Blockhash from Helius API. Trying backup rpc..")
-        try:
-            blockhash = backup_http_client.get_latest_blockhash(Confirmed).value
-            logger.info("Blockhash received from backup rpc!")
-            return blockhash
-        except:
-            logger.info("Failed to get Blockhash from both Helius and Backup API")
-            return False
\ No newline at end of file
@@ -1,41 +1,71 @@
-import ast
-import json
 import datetime
-import string
-import random
-import asyncio
 import logging
-import boto3
 import botocore
 import os
-from anchorpy import Provider
-from anchorpy import Wallet
-from solana.transaction import Transaction
 from solana.rpc.types import TxOpts
 from solana.rpc.commitment import Confirmed
-from solana.rpc.api import Client
-from solana.rpc.async_api import AsyncClient
-from solana.rpc.websocket_api import connect
 from solders.pubkey import Pubkey
-from solders.keypair import Keypair
 from solders.signature import Signature
-from anchor.accounts import Universe
 from anchor.instructions import star_hop_two_start
 from anchor.instructions import star_hop_two_end
+from oridion.registry import get_table
+from oridion.registry import projection
+from oridion.registry import get_manager_keypair
+from oridion.registry import get_rpc_pool
+from oridion.registry import get_event_loop
+from oridion.activity import put_activity
+from oridion.activity import ACTIVITY_TABLE
+from oridion.rpc import RpcPoolError
+from oridion.lookup import LookupTable
+from oridion.lookup import build_v0
+from oridion.blockhash import BlockhashCache
+from oridion.universe import UniverseCache
+from oridion.planets import PlanetIndex
+from oridion.stars import StarPool
+from oridion.signatures import SignatureSubscriptions
+from oridion.tracker import SignatureTracker
+from oridion.confirm import ConfirmationEngine
+from oridion.confirm import deadline_from_context
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-db = dynamodb.Table("deposits")
+db = get_table("deposits")
+activityDB = get_table(ACTIVITY_TABLE)
 
 #we should get this from environment variables.
 universe_pda = Pubkey.from_string(os.environ['UNIVERSE_ADDRESS'])
 oridion_program_id = Pubkey.from_string(os.environ['ORD_PROGRAM_ADDRESS'])
 
-#Set Client and async client (devnet_env or mainnet_env)
-http_client = Client(os.environ['DEVNET_ENV'])
-async_client = AsyncClient(os.environ['DEVNET_ENV'])
+# Planet PDA index (planets.json next to oridion/planets.py, if deployed)
+planet_index = PlanetIndex.load(oridion_program_id)
+
+# Star ID/PDA pool (filled on a background thread)
+star_pool = StarPool(oridion_program_id)
+
+#RPC pool for reads and blockhash cache (refreshed in the background while the loop runs)
+rpc_pool = get_rpc_pool('DEVNET_ENV')
+blockhash_cache = BlockhashCache(rpc_pool)
+
+# Address lookup table with the static Oridion accounts (LOOKUP_TABLE_ADDRESS)
+lookup_table = LookupTable(rpc_pool)
+
+#WSS URL (devnet)
+wss_url = "wss://api.devnet.solana.com"
+
+# Shared signature subscription websocket
+signature_subscriptions = SignatureSubscriptions(wss_url)
+
+# Batched signature status tracker shared by every job in the container
+signature_tracker = SignatureTracker(rpc_pool)
+signature_tracker.add_height_listener(blockhash_cache.observe_block_height)
+
+# Confirmation engine (websocket raced against status polling)
+confirm_engine = ConfirmationEngine(signature_tracker, signature_subscriptions)
+
+# Universe cache
+universe_cache = UniverseCache(rpc_pool,universe_pda,wss_url)
+universe_cache.add_listener(planet_index.sync)
 
 
 # Pass wallet, hop transaction, to planet name 
@@ -49,11 +79,10 @@ def lambda_handler(event, context):
     } 
     
     # Setup loop
-    loop = asyncio.get_event_loop()
+    loop = get_event_loop()
     
     # Setup manager keypair
-    manager_kp = Keypair.from_base58_string(os.environ['MANAGER_SECRET'])
-    manager_anchor_wallet = Wallet(manager_kp)
+    manager_kp = get_manager_keypair()
     
     # default error messages array and valid marker
     valid = True
@@ -96,7 +125,6 @@ def lambda_handler(event, context):
     
     from_planet_name = deposit_data['loc']
     deposit_lamports = deposit_data['deposit']
-    activity = deposit_data['activity']
     logger.info("DB | Location: : " + from_planet_name)
     logger.info("DB | Deposit: " +  str(deposit_lamports))
     
@@ -116,7 +144,7 @@ def lambda_handler(event, context):
     # Get Universe data
     # --------------------------------- #
     # Use asyncio loop run until complete to synchronously "await" an async function
-    universe = loop.run_until_complete(get_universe())
+    universe = loop.run_until_complete(universe_cache.get())
     if not universe:
         response_body['message'].append("Universe not found")
         logger.error('Universe not found')
@@ -129,7 +157,7 @@ def lambda_handler(event, context):
     # validate to planet name is in universe planets list.
     # We don't need to do from planet name because it's already been validated 
     # before it was entered into the DB. 
-    if(to_planet_name not in universe.p):
+    if(to_planet_name not in universe_cache.planets):
         logger.error("To planet not in universe!") 
         response_body['message'].append("Planet not in universe")
         return {
@@ -143,23 +171,14 @@ def lambda_handler(event, context):
     
     # Set PDAs
     # To Planet pubkey
-    to_planet_pda_seed = [b"_PLA_", to_planet_name.encode(), b"_NET_"]
-    to_planet_pda, nonce = Pubkey.find_program_address(to_planet_pda_seed, oridion_program_id)
+    to_planet_pda = planet_index.pda(to_planet_name)
     
     # From Planet pubkey
-    from_planet_pda_seed = [b"_PLA_", from_planet_name.encode(), b"_NET_"]
-    from_planet_pda, nonce = Pubkey.find_program_address(from_planet_pda_seed, oridion_program_id)
-    
+    from_planet_pda = planet_index.pda(from_planet_name)
     
-    # Generate two star IDs
-    star_one_id = id_generator()
-    star_two_id = id_generator()
     
-    # Get PDAs for stars
-    s1_pda_seed = [b"_ST_", star_one_id.encode(), b"_AR_"]
-    s2_pda_seed = [b"_ST_", star_two_id.encode(), b"_AR_"]
-    s1_planet_pda, nonce = Pubkey.find_program_address(s1_pda_seed, oridion_program_id)
-    s2_planet_pda, nonce = Pubkey.find_program_address(s2_pda_seed, oridion_program_id)
+    # Take two star IDs and their PDAs from the pool
+    (star_one_id, s1_planet_pda, _), (star_two_id, s2_planet_pda, _) = star_pool.take_many(2)
     
     # Log all PDAs
     logger.info(f"from_planet_pda: {from_planet_pda}")
@@ -200,23 +219,27 @@ def lambda_handler(event, context):
     
     #########################################################################
     #latest blockhash
-    latest_blockhash = http_client.get_latest_blockhash(Confirmed).value
+    latest_blockhash = loop.run_until_complete(blockhash_cache.get())
+    if not latest_blockhash:
+        response_body['message'].append("Could not get latest blockhash")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
     hash_one = latest_blockhash.blockhash
     
     # logger.info(str(hash_one))
     
-    # TX One 
-    tx1 = Transaction(hash_one)
-    tx1.add(ix1)
-    logger.info("Built step one anchor instruction for transaction") 
-    logger.info("Submitting hop start transaction") 
+    # Static accounts (Universe, planets) are loaded from the lookup table
+    lookup_tables = loop.run_until_complete(lookup_table.get())
     
-    #manager signed transaction
-    signed_tx1 = manager_anchor_wallet.sign_transaction(tx1)
-    logger.info("Manager signed first transaction successfully") 
+    # TX One (v0, signed by the manager)
+    serialized_tx1, _ = build_v0(manager_kp,[ix1],hash_one,lookup_tables)
+    logger.info("Built and signed step one transaction") 
+    logger.info("Submitting hop start transaction") 
     
     # Submit transaction
-    signature1 = loop.run_until_complete(submit_tx(async_client,manager_anchor_wallet,signed_tx1))
+    signature1 = loop.run_until_complete(submit_tx(serialized_tx1))
     logger.info("Transaction one completed") 
     if signature1 and type(signature1) is dict:
         logger.error('ERROR Processing solana transaction')
@@ -231,28 +254,35 @@ def lambda_handler(event, context):
     
     
     # Now verify first transaction completed before moving the next transaction
-    loop.run_until_complete(listen_transaction(signature1))
+    tx1_outcome = loop.run_until_complete(listen_transaction(signature1,deadline_from_context(context),latest_blockhash.last_valid_block_height))
+    if not tx1_outcome:
+        response_body['message'].append(f"Transaction 1 not confirmed ({tx1_outcome.status})")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
     logger.info("Listen returned for signature 1!")
     #########################################################################
     #########################################################################
     # Continue to second transaction
     
     #latest blockhash
-    latest_blockhash_two = http_client.get_latest_blockhash(Confirmed).value
+    latest_blockhash_two = loop.run_until_complete(blockhash_cache.get())
+    if not latest_blockhash_two:
+        response_body['message'].append("Could not get latest blockhash")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
     hash_two = latest_blockhash_two.blockhash
         
-    # TX Two
-    tx2 = Transaction(hash_two)
-    tx2.add(ix2)
-    logger.info("Built step two anchor instruction for transaction") 
+    # TX Two (v0, signed by the manager)
+    serialized_tx2, _ = build_v0(manager_kp,[ix2],hash_two,lookup_tables)
+    logger.info("Built and signed step two transaction") 
     logger.info("Submitting hop end transaction") 
     
-    #manager signed transaction
-    signed_tx2 = manager_anchor_wallet.sign_transaction(tx2)
-    logger.info("Manager signed second transaction successfully") 
-    
     # Submit transaction
-    signature2 = loop.run_until_complete(submit_tx(async_client,manager_anchor_wallet,signed_tx2))
+    signature2 = loop.run_until_complete(submit_tx(serialized_tx2))
     logger.info("Transaction two completed") 
     if signature2 and type(signature2) is dict:
         logger.error('ERROR Processing solana transaction')
@@ -267,7 +297,13 @@ def lambda_handler(event, context):
     
     
     # Now verify first transaction completed before moving the next transaction
-    loop.run_until_complete(listen_transaction(signature2))
+    tx2_outcome = loop.run_until_complete(listen_transaction(signature2,deadline_from_context(context),latest_blockhash_two.last_valid_block_height))
+    if not tx2_outcome:
+        response_body['message'].append(f"Transaction 2 not confirmed ({tx2_outcome.status})")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
     logger.info("Listen returned for signature 2!")
     #########################################################################
     
@@ -277,21 +313,18 @@ def lambda_handler(event, context):
     current_datetime = datetime.datetime.now()
     now = int(current_datetime.timestamp())
     
-    # Update activity
-    act_obj = ast.literal_eval(activity)
+    # New activity entry
     new_item = {
         "action": "HS2", # HP = Hop planet
         "to": to_planet_name,
         "time": now,
         "signature": str(signature1) + ':' + str(signature2)
     }
-    act_obj.append(new_item)
-    updated_activity = json.dumps(act_obj)
     
  
     # --------------------------------- #
     # Update Deposit in DB
-    update_result = update_deposit(wallet,to_planet_name,now,updated_activity)
+    update_result = update_deposit(wallet,to_planet_name,now,new_item)
     if not update_result:
         response_body['message'].append("There was an error updating db")
         return {
@@ -299,6 +332,9 @@ def lambda_handler(event, context):
             'body': response_body
         }
 
+    # Record the entry in the wallet's history
+    put_activity(activityDB,wallet,new_item)
+
     logger.info("Data row updated successfully")    
     logger.info("Done") 
     
@@ -315,10 +351,10 @@ def get_deposit(wallet):
         Gets deposit data from table 
 
         :param wallet: Wallet string of user.
-        :return: The deposit data row
+        :return: The deposit data row (loc and deposit only)
         """
         try:
-            response = db.get_item(Key={"wallet": wallet})
+            response = db.get_item(Key={"wallet": wallet}, **projection("loc", "deposit"))
         except botocore.exceptions.ClientError as err:
             logger.error(
                 "Couldn't get deposit. Error: %s: %s",
@@ -332,39 +368,31 @@ def get_deposit(wallet):
             else:
                 return False
     
-# fetch universe account
-async def get_universe():
-    acc = await Universe.fetch(async_client, universe_pda)
-    if acc is None:
-        # the fetch method returns null when the account is uninitialized
-        raise ValueError("account not found")
-    return acc  
-
 # Submit transaction (Payer is Manager)
-async def submit_tx(async_client,manager_anchor_wallet,tx):
-    provider = Provider(async_client,manager_anchor_wallet)
-    sig = await provider.send(tx,TxOpts(preflight_commitment=Confirmed))
-    # logger.info(sig)
-    return sig
+async def submit_tx(serialized_tx):
+    try:
+        resp = await rpc_pool.call("send_raw_transaction",serialized_tx,TxOpts(preflight_commitment=Confirmed))
+    except RpcPoolError as err:
+        # Same shape the handler already reports
+        return {'errorMessage': {'message': str(err.__cause__ or err)}}
+    return resp.value
     
     
-def update_deposit(wallet, to_planet_name,now,updated_activity):
+def update_deposit(wallet, to_planet_name,now,new_item):
         """
         Updates wallet deposit info
 
         :param wallet: updating wallet deposit (Key)
         :param to_planet_name: Destination planet name
         :param now: timestamp of now
-        :param updated_activity: string of array
+        :param new_item: activity entry, kept as last_signature/last_action
         :return: Boolean of success or failure.
         """
-    
         try:
             db.update_item(
                 Key={"wallet": wallet},
-                UpdateExpression="SET loc=:loc, last_updated=:last_updated, hops=hops + :increment, activity=:activity",
-                ExpressionAttributeValues={":loc": to_planet_name, ":last_updated": now, ":increment" : 1, ":activity" : updated_activity},
-                ReturnValues="UPDATED_NEW",
+                UpdateExpression="SET loc=:loc, last_updated=:last_updated, hops=hops + :increment, last_signature=:last_signature, last_action=:last_action",
+                ExpressionAttributeValues={":loc": to_planet_name, ":last_updated": now, ":increment" : 1, ":last_signature" : new_item["signature"], ":last_action" : new_item["action"]},
             )
         except botocore.exceptions.ClientError as err:
             logger.error(
@@ -378,21 +406,8 @@ def update_deposit(wallet, to_planet_name,now,updated_activity):
             return True
         
 
-def id_generator(size=8, chars=string.ascii_uppercase + string.digits):
-    return ''.join(random.choice(chars) for _ in range(size))
-
-
-async def listen_transaction(signature):
-    async with connect("wss://api.devnet.solana.com") as websocket:
-        #finalized is about 16 seconds
-        #confirmed is about 6 seconds
-        await websocket.signature_subscribe(signature,"confirmed")
-        logger.info("Subscribed to the signature")
-        first_resp = await websocket.recv()
-        subscription_id = first_resp[0].result
-        next_resp = await websocket.recv()
-        logger.info("Received data")
-        # logger.info(subscription_id) //Receiving correctly
-        logger.info(next_resp)
-        await websocket.signature_unsubscribe(subscription_id)
-        return next_resp
\ No newline at end of file
+async def listen_transaction(signature, deadline=None, last_valid_height=None):
+    # Websocket notification raced against status polling, bounded by the deadline
+    outcome = await confirm_engine.confirm(signature, deadline, last_valid_height)
+    logger.info(f"Confirmation: {outcome}")
+    return outcome
\ No newline at end of file
@@ -1,18 +1,31 @@
-import asyncio
 import logging
 import os
-from solana.rpc.async_api import AsyncClient
-from solana.rpc.websocket_api import connect
+from solders.signature import Signature
+from oridion.registry import get_rpc_pool
+from oridion.registry import get_event_loop
+from oridion.signatures import SignatureSubscriptions
+from oridion.tracker import SignatureTracker
+from oridion.confirm import ConfirmationEngine
+from oridion.confirm import deadline_from_context
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-#Set Client and async client (devnet_env or mainnet_env)
-async_client = AsyncClient(os.environ['MAINNET_ENV'])
+#RPC pool (MAINNET_ENV, BACKUP_RPC and any extra RPC_ENDPOINTS)
+rpc_pool = get_rpc_pool()
 
 #WSS URL
 wss_url = os.environ['WSS_URL']
 
+# Shared signature subscription websocket
+signature_subscriptions = SignatureSubscriptions(wss_url)
+
+# Batched signature status tracker shared by every job in the container
+signature_tracker = SignatureTracker(rpc_pool)
+
+# Confirmation engine (websocket raced against status polling)
+confirm_engine = ConfirmationEngine(signature_tracker, signature_subscriptions)
+
 # Pass wallet, hop transaction, to planet name 
 def lambda_handler(event, context):
     
@@ -23,7 +36,7 @@ def lambda_handler(event, context):
     } 
     
     # Setup loop
-    loop = asyncio.get_event_loop()
+    loop = get_event_loop()
     
 
     # default error messages array and valid marker
@@ -42,12 +55,25 @@ def lambda_handler(event, context):
         }
         
     # POST Variables
-    signature = event['signature']        
+    try:
+        signature = Signature.from_string(event['signature'])
+    except (TypeError, ValueError):
+        response_body['message'].append("Signature not valid")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
     logger.info(f"Signature: {signature}")
     
     #########################################################################
     # Confirm signature 
-    loop.run_until_complete(listen_transaction(signature))
+    outcome = loop.run_until_complete(listen_transaction(signature,deadline_from_context(context)))
+    if not outcome:
+        response_body['message'].append(f"Signature not confirmed ({outcome.status})")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
     logger.info("Signature confirmed successfully!")
     #########################################################################    
     
@@ -58,16 +84,8 @@ def lambda_handler(event, context):
     }
     
 
-async def listen_transaction(signature):
-    async with connect(wss_url) as websocket:
-        #finalized is about 16 seconds
-        #confirmed is about 6 seconds
-        await websocket.signature_subscribe(signature,"confirmed")
-        logger.info("Subscribed to the signature")
-        first_resp = await websocket.recv()
-        subscription_id = first_resp[0].result
-        next_resp = await websocket.recv()
-        logger.info("Received data")
-        logger.info(next_resp)
-        await websocket.signature_unsubscribe(subscription_id)
-        return next_resp
\ No newline at end of file
+async def listen_transaction(signature, deadline=None, last_valid_height=None):
+    # Websocket notification raced against status polling, bounded by the deadline
+    outcome = await confirm_engine.confirm(signature, deadline, last_valid_height)
+    logger.info(f"Confirmation: {outcome}")
+    return outcome
\ No newline at end of file
@@ -1,57 +1,107 @@
-import ast
 import os
-import json
 import datetime
 import asyncio
 import logging
-import boto3
 import botocore
-from anchorpy import Provider
-from anchorpy import Wallet
-from solana.transaction import Transaction
-from solana.rpc.types import TxOpts
-from solana.rpc.commitment import Confirmed
-from solana.rpc.api import Client
-from solana.rpc.async_api import AsyncClient
-from solana.rpc.websocket_api import connect
 from solders.pubkey import Pubkey
-from solders.keypair import Keypair
-from solders.compute_budget import set_compute_unit_limit
 from solders.compute_budget import set_compute_unit_price
+from solders.compute_budget import set_compute_unit_limit
 from anchor.instructions import withdraw
+from oridion.registry import get_table
+from oridion.registry import projection
+from oridion.registry import get_sns_client
+from oridion.registry import get_manager_keypair
+from oridion.registry import get_rpc_pool
+from oridion.registry import get_event_loop
+from oridion.activity import ACTIVITY_TABLE
+from oridion.jobs import complete_job
+from oridion.lookup import LookupTable
+from oridion.lookup import build_v0
+from oridion.nonce import NoncePool
+from oridion.nonce import NONCE_TABLE
+from oridion.nonce import NONCE_ADVANCE_CU
+from oridion.payers import PayerPool
+from oridion.compute import ComputeCalibrator
+from oridion.fees import FeeEstimator
+from oridion.blockhash import BlockhashCache
+from oridion.planets import PlanetIndex
+from oridion.signatures import SignatureSubscriptions
+from oridion.tracker import SignatureTracker
+from oridion.confirm import ConfirmationEngine
+from oridion.confirm import deadline_from_context
+from oridion.broadcast import Rebroadcaster
+from oridion.batch import run_batch
+from oridion.batch import batch_response
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 #DynamoDB
-dynamodb = boto3.resource('dynamodb')
-depositsDB = dynamodb.Table("deposits")
-jobsDB = dynamodb.Table("jobs")
+depositsDB = get_table("deposits")
+activityDB = get_table(ACTIVITY_TABLE)
+jobsDB = get_table("jobs")
+noncesDB = get_table(NONCE_TABLE)
 
 #SNS
-snsClient = boto3.client('sns')
+snsClient = get_sns_client()
 
 #we should get this from environment variables.
 oridion_program_id = Pubkey.from_string(os.environ['ORD_PROGRAM_ADDRESS'])
 
+# Planet PDA index (planets.json next to oridion/planets.py, if deployed)
+planet_index = PlanetIndex.load(oridion_program_id)
+
 #wss url
 wss_url = os.environ['WSS_URL']
 
-#Set Client and async client (devnet_env or mainnet_env)
-http_client = Client(os.environ['MAINNET_ENV'])
-async_client = AsyncClient(os.environ['MAINNET_ENV'])
+# Shared signature subscription websocket
+signature_subscriptions = SignatureSubscriptions(wss_url)
+
+#RPC pool (MAINNET_ENV, BACKUP_RPC and any extra RPC_ENDPOINTS)
+rpc_pool = get_rpc_pool()
+
+# Blockhash cache (refreshed in the background while the loop runs)
+blockhash_cache = BlockhashCache(rpc_pool)
+
+# Priority fee estimator (recent prioritization fees per account set)
+fee_estimator = FeeEstimator(rpc_pool)
+
+# Compute unit limits calibrated by simulation
+compute_calibrator = ComputeCalibrator(rpc_pool, oridion_program_id)
+
+# Address lookup table with the static Oridion accounts (LOOKUP_TABLE_ADDRESS)
+lookup_table = LookupTable(rpc_pool)
 
-# Backup RPC 
-backup_http_client = Client(os.environ['BACKUP_RPC'])
-backup_async_client = AsyncClient(os.environ['BACKUP_RPC'])
+# Durable nonces leased from the nonces table (NONCE_ACCOUNTS, off when unset)
+nonce_pool = NoncePool(rpc_pool, noncesDB, get_manager_keypair())
+
+# Fee payers (FEE_PAYER_SECRETS), the manager pays when there are none
+payer_pool = PayerPool(rpc_pool, get_manager_keypair())
+
+# Batched signature status tracker shared by every job in the container
+signature_tracker = SignatureTracker(rpc_pool)
+signature_tracker.add_height_listener(blockhash_cache.observe_block_height)
+
+# Confirmation engine (websocket raced against status polling)
+confirm_engine = ConfirmationEngine(signature_tracker, signature_subscriptions)
+
+# Resends transactions until they land, fail or expire
+rebroadcaster = Rebroadcaster(rpc_pool, confirm_engine)
 
 # Pass wallet, hop transaction, to planet name 
 def lambda_handler(event, context):
     # print(json.dumps(event, indent=2))
-    for record in event['Records']:
-        process_task(record)
+    # Records run concurrently, one at a time per wallet
+    loop = get_event_loop()
+    try:
+        failed = loop.run_until_complete(run_batch(event['Records'], lambda record: process_task(record, context)))
+    finally:
+        # Finish recycling used nonces before the container is frozen
+        loop.run_until_complete(nonce_pool.drain())
+    # Only the failed records are retried (ReportBatchItemFailures)
+    return batch_response(failed)
 
-def process_task(record):
+async def process_task(record, context):
         
     # print(f"DynamoDB Record: {json.dumps(record['dynamodb'])}")
     
@@ -115,38 +165,45 @@ def process_task(record):
     print("Both from and destination public keys valided")
 
     ############## START PROCESSING ##############
-    # Setup loop
-    loop = asyncio.get_event_loop()
     
     # Setup manager keypair
-    manager_kp = Keypair.from_base58_string(os.environ['MANAGER_SECRET'])
-    manager_anchor_wallet = Wallet(manager_kp)
-    
-    # setup provider
-    provider = Provider(async_client,manager_anchor_wallet,TxOpts(skip_confirmation=False,skip_preflight=True,preflight_commitment=Confirmed,max_retries=0))
+    manager_kp = get_manager_keypair()
     
-    # backup provider
-    backup_provider = Provider(backup_async_client,manager_anchor_wallet,TxOpts(skip_confirmation=False,skip_preflight=True,preflight_commitment=Confirmed,max_retries=0))
+    # DynamoDB and SNS calls run on a worker thread, so other records'
+    # confirmations keep going meanwhile
+
+    # A redelivered record must not send its transactions again. Only run it
+    # while its job is still in the table and not completed
+    job_data = await asyncio.to_thread(get_job,wallet)
+    if not job_data or job_data['completed'] != 0:
+        print("Job already completed or deleted. Skipping record")
+        return
+    if 'created' in dbImage and int(job_data.get('created', -1)) != int(dbImage['created']['N']):
+        print("Record is for an older job of this wallet. Skipping record")
+        return
     
     # Get deposit - (To get the from planet and deposit lamports)
-    deposit_data = get_deposit(wallet)
+    deposit_data = await asyncio.to_thread(get_deposit,wallet)
     if not deposit_data:
         print("Deposit data for wallet address not found")
         return
     logger.info("Deposit data found for wallet")
     
     # Gather necessary data from deposit db
-    from_planet_name = deposit_data['loc']
+    # Start planet recorded with the job (older jobs: the deposit's loc). A
+    # deposit no longer there was already moved by an earlier delivery
+    from_planet_name = dbImage['from']['S'] if 'from' in dbImage else deposit_data['loc']
+    if deposit_data['loc'] != from_planet_name:
+        print("Deposit is no longer at the job's start planet. Skipping record")
+        return
     deposit_lamports = deposit_data['deposit']
-    activity = deposit_data['activity']
   
     logger.info("DB | Location: : " + from_planet_name)
     logger.info("DB | Deposit: " +  str(deposit_lamports))
     
     # Set PDAs
     # From Planet pubkey
-    from_planet_pda_seed = [b"_PLA_", from_planet_name.encode(), b"_NET_"]
-    from_planet_pda, nonce = Pubkey.find_program_address(from_planet_pda_seed, oridion_program_id)
+    from_planet_pda = planet_index.pda(from_planet_name)
     logger.info(f"From Planet PDA: {from_planet_pda}")
 
     # Deposit, Wallet, and both planet names verified.
@@ -165,8 +222,7 @@ def process_task(record):
     )
     
     #latest blockhash
-    # latest_blockhash = http_client.get_latest_blockhash(Confirmed).value
-    latest_blockhash = get_latest_blockhash_rpc()
+    latest_blockhash = await blockhash_cache.get()
     if not latest_blockhash:
         print("Failed to get latest blockhash! Exiting!")
         return;
@@ -176,86 +232,76 @@ def process_task(record):
     last_valid_height = latest_blockhash.last_valid_block_height
     logger.info(f"Last valid height: {last_valid_height}")
     
-    # Tx
-    tx = Transaction()
-    tx.recent_blockhash = hash
-    
-    # set fee payer
-    tx.fee_payer = manager_kp.pubkey()
-    
-    # Add CU limit
-    cu_limit = set_compute_unit_limit(3400)
-    tx.add(cu_limit)
+    # Add CU limit (calibrated by simulation, 3400 until that succeeds)
+    [cu_units] = await compute_calibrator.get_limits("withdraw",[("withdraw", ix)],manager_kp.pubkey(),hash,{"withdraw": 3400})
     
     #add Priority fee
-    priority_fee = set_compute_unit_price(20000)
-    tx.add(priority_fee)
-    
-    # Add transaction
-    tx.add(ix)
+    # Priced from recent fees on the planet and manager (20000 if there is no estimate)
+    compute_unit_price = await fee_estimator.price(job_type,[from_planet_pda,manager_kp.pubkey()],20000)
+    priority_fee = set_compute_unit_price(compute_unit_price)
 
     logger.info("Built anchor instruction for transaction") 
         
-    #manager signed transaction
-    signed_tx = manager_anchor_wallet.sign_transaction(tx)
-    logger.info("Manager signed transaction successfully") 
+    # Manager signed v0 transaction, static accounts loaded from the lookup table
+    lookup_tables = await lookup_table.get()
 
-    # Serialize tx
-    serialized_tx = signed_tx.serialize()
-    
-    # if not signed_tx.verify_signatures():
-    #     print("Transaction signature verification failed! Ending processing")
-    #     return 
-    
-    logger.info("Submitting transaction..") 
-    # Submit transaction
-    loop.run_until_complete(submit_withdraw(provider,backup_provider,serialized_tx,last_valid_height))
-    logger.info("Transaction submitted") 
-    # if signature and type(signature) is dict:
-    #     logger.error('ERROR Processing solana transaction')
-    #     logger.error(f"ERROR MSG: {signature['errorMessage']['message']}")
-    #     print(signature['errorMessage']['message'] + " | Ending transaction!")
-    #     return 
+    # Durable nonce mode (NONCE_ACCOUNTS): sign against a nonce, which does not expire
+    nonces = await nonce_pool.acquire(1)
+
+    # A nonce transaction also runs the advance instruction
+    cu_limit = set_compute_unit_limit(cu_units + (NONCE_ADVANCE_CU if nonces else 0))
+
+    # Fee payer for this job's transactions (the manager still signs)
+    payer = await payer_pool.acquire()
+    try:
+        if nonces:
+            serialized_tx, signature = build_v0(payer.keypair,nonces[0].instructions([cu_limit,priority_fee,ix]),nonces[0].blockhash,lookup_tables,[manager_kp])
+        else:
+            serialized_tx, signature = build_v0(payer.keypair,[cu_limit,priority_fee,ix],hash,lookup_tables,[manager_kp])
+        logger.info("Manager signed transaction successfully") 
+        
+        # if not signed_tx.verify_signatures():
+        #     print("Transaction signature verification failed! Ending processing")
+        #     return 
         
-    signature = signed_tx.signature()
-    logger.info(f"Signature: {signature}")
-    loop.run_until_complete(listen_transaction(signature))
-    logger.info("Listener returned with transaction confirmation! Finishing up...")
+        logger.info("Submitting transaction..") 
+        logger.info(f"Signature: {signature}")
+
+        # Resend until the withdraw lands, fails or its blockhash (or nonce) expires
+        if nonces:
+            withdraw_outcome = await nonce_pool.submit(rebroadcaster,nonces[0],serialized_tx,signature,context)
+        else:
+            withdraw_outcome = await rebroadcaster.submit(serialized_tx,signature,last_valid_height,deadline_from_context(context))
+    finally:
+        nonce_pool.release(nonces)
+        payer_pool.release(payer)
+    if not withdraw_outcome:
+        print(f"Withdraw transaction not confirmed ({withdraw_outcome.status})! Ending!")
+        return
+    logger.info("Withdraw transaction landed! Finishing up...")
     
     # --------------------------------- #
     #Datetime Now
     current_datetime = datetime.datetime.now()
     now = int(current_datetime.timestamp())
     
-    # Update activity
-    act_obj = ast.literal_eval(activity)
+    # New activity entry
     new_item = {
         "action": "W", # HP = Hop planet
         "to": destination,
         "time": now,
         "signature": str(signature)
     }
-    act_obj.append(new_item)
-    updated_activity = json.dumps(act_obj)
     
-    # Update Deposit in DB
-    update_result = update_deposit(wallet,destination,now,updated_activity)
-    if not update_result:
-        # response_body['message'].append("There was an error updating depositsDB")
-        print("There was an error updating depositsDB")
+    # Move the deposit, record the activity entry and complete the job (one transaction)
+    job_completed = await asyncio.to_thread(complete_job,depositsDB,jobsDB,activityDB,wallet,from_planet_name,destination,now,new_item)
+    if not job_completed:
+        print("Job was not completed in DB! Something seriously wrong here!")
         return
-    logger.info("Updated deposit with withdraw activity")
-    
-
-    # Update job to completed
-    job_updated = update_job_to_completed(wallet)
-    if not job_updated:
-        print("Job was not update to completed! Something seriously wrong here!")
-        return
-    logger.info("Job marked completed!")
+    logger.info("Updated deposit with withdraw activity. Job marked completed!")
 
     snsMessage = job_type +  " task has been completed for " + wallet
-    send_sns(snsMessage)
+    await asyncio.to_thread(send_sns,snsMessage)
     print("SNS message sent")
     logger.info("Withdraw process completed!")    
     logger.info("Done") 
@@ -263,18 +309,18 @@ def process_task(record):
     
     
 
-def get_deposit(wallet):
+def get_job(wallet):
         """
-        Gets deposit data from table 
+        Gets job data from table 
 
         :param wallet: Wallet string of user.
-        :return: The deposit data row
+        :return: The job data row (completed and created only)
         """
         try:
-            response = depositsDB.get_item(Key={"wallet": wallet})
+            response = jobsDB.get_item(Key={"wallet": wallet}, **projection("completed", "created"), ConsistentRead=True)
         except botocore.exceptions.ClientError as err:
             logger.error(
-                "Couldn't get deposit. Error: %s: %s",
+                "Couldn't get job. Error: %s: %s",
                 err.response["Error"]["Code"],
                 err.response["Error"]["Message"],
             )
@@ -286,118 +332,29 @@ def get_deposit(wallet):
                 return False
             
             
-def update_deposit(wallet,to_planet_name,now,updated_activity):
+def get_deposit(wallet):
         """
-        Updates wallet deposit info
+        Gets deposit data from table 
 
-        :param wallet: updating wallet deposit (Key)
-        :param to_planet_name: Destination planet name
-        :param now: timestamp of now
-        :param updated_activity: string of array
-        :return: Boolean of success or failure.
+        :param wallet: Wallet string of user.
+        :return: The deposit data row (loc and deposit only)
         """
         try:
-            depositsDB.update_item(
-                Key={"wallet": wallet},
-                UpdateExpression="SET loc=:loc,last_updated=:last_updated, hops=hops + :increment, activity=:activity",
-                ExpressionAttributeValues={":loc": to_planet_name, ":last_updated": now, ":increment" : 1, ":activity" : updated_activity},
-                ReturnValues="UPDATED_NEW",
-            )
+            response = depositsDB.get_item(Key={"wallet": wallet}, **projection("loc", "deposit"))
         except botocore.exceptions.ClientError as err:
             logger.error(
-                "Couldn't update deposit! Here's why: %s: %s",
+                "Couldn't get deposit. Error: %s: %s",
                 err.response["Error"]["Code"],
                 err.response["Error"]["Message"],
             )
-            return False
+            raise
         else:
-            return True
-
+            if "Item" in response:
+                return response["Item"]
+            else:
+                return False
+            
             
-async def listen_transaction(signature):
-    async with connect(wss_url) as websocket:
-        await websocket.signature_subscribe(signature,"confirmed")
-        logger.info("Subscribed to the signature")
-        first_resp = await websocket.recv()
-        subscription_id = first_resp[0].result
-        next_resp = await websocket.recv()
-        logger.info(next_resp)
-        await websocket.signature_unsubscribe(subscription_id)
-        return next_resp
-    
-
-def update_job_to_completed(wallet):
-    """
-    Updates job to completed
-    :param wallet: updating wallet deposit (Key)
-    :return: Boolean of success or failure.
-    """
-    try:
-        jobsDB.update_item(
-            Key={"wallet": wallet},
-            UpdateExpression="SET completed=:completed",
-            ExpressionAttributeValues={":completed":1},
-            ReturnValues="UPDATED_NEW",
-        )
-    except botocore.exceptions.ClientError as err:
-        logger.error(
-            "Couldn't update job! Here's why: %s: %s",
-            err.response["Error"]["Code"],
-            err.response["Error"]["Message"],
-        )
-        return False
-    else:
-        return True
-    
 def send_sns(snsMessage):
     snsClient.publish(TopicArn='arn:aws:sns:us-west-1:058264465436:TaskComplete',Message=snsMessage)
     return
-
-
-# Submit transaction (Payer is Manager)
-async def submit_withdraw(provider,backup_provider,serialized_tx,last_valid_height):
-    blockheight = await get_block_height(provider,backup_provider)
-    sent = 1
-    while sent < 6 and blockheight < last_valid_height:
-        # await provider.send(tx)
-        try:
-            await provider.connection.send_raw_transaction(serialized_tx,TxOpts(skip_preflight=True))
-            logger.info(f"Sending Tx | Helius API | BH: {blockheight}")
-        except:
-            await backup_provider.connection.send_raw_transaction(serialized_tx,TxOpts(skip_preflight=True))
-            logger.info(f"Sending Tx | BACKUP API | BH: {blockheight}")
-        sent+=1
-        await asyncio.sleep(1)
-        blockheight = await get_block_height(provider,backup_provider)
-
-    logger.info("submitted serialized tx while loop completed")
-    return True
-
-def get_latest_blockhash_rpc():
-    try:
-        blockhash = http_client.get_latest_blockhash(Confirmed).value
-        logger.info("Received Blockhash from Helius API.")
-        return blockhash
-    except:
-        logger.info("Error getting Blockhash from Helius API. Trying backup rpc..")
-        try:
-            blockhash = backup_http_client.get_latest_blockhash(Confirmed).value
-            logger.info("Blockhash received from backup rpc!")
-            return blockhash
-        except:
-            logger.info("Failed to get Blockhash from both Helius and Backup API")
-            return False
-        
-        
-async def get_block_height(provider,backup_provider):
-    try:
-        blockheight = (await provider.connection.get_block_height()).value
-    except:
-        logger.info("Error getting block height from Helius API. Trying backup rpc..")
-        try:
-            blockheight = (await backup_provider.connection.get_block_height()).value
-            logger.info("Blockheight received from backup rpc!")
-        except:
-            logger.info("Failed to get Blockheight from both Helius and Backup API")
-            blockheight = False
-    return blockheight
\ No newline at end of file
@@ -1,38 +1,65 @@
 import os
 import json
-import asyncio
 import logging
-import boto3
 import botocore
-from anchorpy import Provider
-from anchorpy import Wallet
-from solana.transaction import Transaction
 from solana.rpc.types import TxOpts
 from solana.rpc.commitment import Confirmed
-from solana.rpc.api import Client
-from solana.rpc.async_api import AsyncClient
-from solana.rpc.websocket_api import connect
 from solders.pubkey import Pubkey
-from solders.keypair import Keypair
-from solders.compute_budget import set_compute_unit_limit
 from solders.compute_budget import set_compute_unit_price
 from anchor.instructions import withdraw
+from oridion.registry import get_table
+from oridion.registry import projection
+from oridion.registry import get_manager_keypair
+from oridion.registry import get_rpc_pool
+from oridion.registry import get_event_loop
+from oridion.rpc import RpcPoolError
+from oridion.lookup import LookupTable
+from oridion.lookup import build_v0
+from oridion.compute import ComputeCalibrator
+from oridion.fees import FeeEstimator
+from oridion.blockhash import BlockhashCache
+from oridion.planets import PlanetIndex
+from oridion.signatures import SignatureSubscriptions
+from oridion.tracker import SignatureTracker
+from oridion.confirm import ConfirmationEngine
+from oridion.confirm import deadline_from_context
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-db = dynamodb.Table("deposits")
+db = get_table("deposits")
 
 #we should get this from environment variables.
 oridion_program_id = Pubkey.from_string(os.environ['ORD_PROGRAM_ADDRESS'])
 
+# Planet PDA index (planets.json next to oridion/planets.py, if deployed)
+planet_index = PlanetIndex.load(oridion_program_id)
+
 #wss url
 wss_url = os.environ['WSS_URL']
 
-#Set Client and async client (devnet_env or mainnet_env)
-http_client = Client(os.environ['MAINNET_ENV'])
-async_client = AsyncClient(os.environ['MAINNET_ENV'])
+# Shared signature subscription websocket
+signature_subscriptions = SignatureSubscriptions(wss_url)
+
+#RPC pool for reads and blockhash cache (refreshed in the background while the loop runs)
+rpc_pool = get_rpc_pool()
+blockhash_cache = BlockhashCache(rpc_pool)
+
+# Address lookup table with the static Oridion accounts (LOOKUP_TABLE_ADDRESS)
+lookup_table = LookupTable(rpc_pool)
+
+# Priority fee estimator (recent prioritization fees per account set)
+fee_estimator = FeeEstimator(rpc_pool)
+
+# Compute unit limits calibrated by simulation
+compute_calibrator = ComputeCalibrator(rpc_pool, oridion_program_id)
+
+# Batched signature status tracker shared by every job in the container
+signature_tracker = SignatureTracker(rpc_pool)
+signature_tracker.add_height_listener(blockhash_cache.observe_block_height)
+
+# Confirmation engine (websocket raced against status polling)
+confirm_engine = ConfirmationEngine(signature_tracker, signature_subscriptions)
 
 
 # Pass wallet, hop transaction, to planet name 
@@ -45,11 +72,10 @@ def lambda_handler(event, context):
     } 
     
     # Setup loop
-    loop = asyncio.get_event_loop()
+    loop = get_event_loop()
     
     # Setup manager keypair
-    manager_kp = Keypair.from_base58_string(os.environ['MANAGER_SECRET'])
-    manager_anchor_wallet = Wallet(manager_kp)
+    manager_kp = get_manager_keypair()
     # print(manager_kp.pubkey())
     
     # default error messages array and valid marker
@@ -119,8 +145,7 @@ def lambda_handler(event, context):
     
     # Set PDAs
     # From Planet pubkey
-    from_planet_pda_seed = [b"_PLA_", from_planet_name.encode(), b"_NET_"]
-    from_planet_pda, nonce = Pubkey.find_program_address(from_planet_pda_seed, oridion_program_id)
+    from_planet_pda = planet_index.pda(from_planet_name)
     logger.info(f"From Planet PDA: {from_planet_pda}")
 
     # Deposit, Wallet, and both planet names verified.
@@ -140,49 +165,35 @@ def lambda_handler(event, context):
     )
     
     #latest blockhash
-    latest_blockhash = http_client.get_latest_blockhash(Confirmed).value
+    latest_blockhash = loop.run_until_complete(blockhash_cache.get())
+    if not latest_blockhash:
+        response_body['message'].append("Could not get latest blockhash")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
     hash = latest_blockhash.blockhash
     # logger.info(str(hash))
     
-    # Tx
-    tx = Transaction(hash)
-    
-    # set fee payer
-    tx.fee_payer = manager_kp.pubkey()
-    
-    
-    # Add CU limit
-    cu_limit = set_compute_unit_limit(3400)
-    tx.add(cu_limit)
+    # Add CU limit (calibrated by simulation, 3400 until that succeeds)
+    [cu_limit] = loop.run_until_complete(compute_calibrator.instructions("withdraw",[("withdraw", ix)],manager_kp.pubkey(),hash,{"withdraw": 3400}))
     
     
     #add Priority fee
-    priority_fee = set_compute_unit_price(9000)
-    tx.add(priority_fee)
+    # Priced from recent fees on the planet and manager (9000 if there is no estimate)
+    compute_unit_price = loop.run_until_complete(fee_estimator.price("withdraw",[from_planet_pda,manager_kp.pubkey()],9000))
+    priority_fee = set_compute_unit_price(compute_unit_price)
     
     
-    # Add transaction
-    tx.add(ix)
-
-    
-    logger.info("Built anchor instruction for transaction") 
+    # Tx (v0, signed by the manager). Static accounts are loaded from the lookup table
+    lookup_tables = loop.run_until_complete(lookup_table.get())
+    serialized_tx, _ = build_v0(manager_kp,[cu_limit,priority_fee,ix],hash,lookup_tables)
+    logger.info("Built and signed transaction") 
     logger.info("Submitting transaction") 
     
     
-    #manager signed transaction
-    signed_tx = manager_anchor_wallet.sign_transaction(tx)
-    logger.info("Manager signed transaction successfully") 
-    
-    if not tx.verify_signatures():
-        response_body['message'].append("Transaction signature verification failed!")
-        return {
-            'statusCode': 200,
-            'body': response_body
-        }
-    
-    
     # Submit transaction
-    signature = loop.run_until_complete(submit_withdraw(async_client,manager_anchor_wallet,tx))
+    signature = loop.run_until_complete(submit_withdraw(serialized_tx))
     logger.info("Transaction completed") 
     if signature and type(signature) is dict:
         logger.error('ERROR Processing solana transaction')
@@ -198,7 +209,13 @@ def lambda_handler(event, context):
         
     logger.info(f"Signature: {signature}")
     
-    return_from_listen = loop.run_until_complete(listen_transaction(signature))
+    return_from_listen = loop.run_until_complete(listen_transaction(signature,deadline_from_context(context),latest_blockhash.last_valid_block_height))
+    if not return_from_listen:
+        response_body['message'].append(f"Transaction not confirmed ({return_from_listen.status})")
+        return {
+            'statusCode': 200,
+            'body': response_body
+        }
     logger.info("Listen returned!")
 
     # --------------------------------- #
@@ -227,10 +244,10 @@ def get_deposit(wallet):
         Gets deposit data from table 
 
         :param wallet: Wallet string of user.
-        :return: The deposit data row
+        :return: The deposit data row (loc and deposit only)
         """
         try:
-            response = db.get_item(Key={"wallet": wallet})
+            response = db.get_item(Key={"wallet": wallet}, **projection("loc", "deposit"))
         except botocore.exceptions.ClientError as err:
             logger.error(
                 "Couldn't get deposit. Error: %s: %s",
@@ -246,10 +263,13 @@ def get_deposit(wallet):
     
 
 # Submit withdraw transaction (Payer is Manager)
-async def submit_withdraw(async_client,manager_anchor_wallet,tx):
-    provider = Provider(async_client,manager_anchor_wallet)
-    sig = await provider.send(tx,TxOpts(skip_confirmation=True,preflight_commitment=Confirmed))
-    return sig
+async def submit_withdraw(serialized_tx):
+    try:
+        resp = await rpc_pool.call("send_raw_transaction",serialized_tx,TxOpts(skip_confirmation=True,preflight_commitment=Confirmed))
+    except RpcPoolError as err:
+        # Same shape the handler already reports
+        return {'errorMessage': {'message': str(err.__cause__ or err)}}
+    return resp.value
     
     
 def delete_deposit(wallet):
@@ -272,17 +292,8 @@ def delete_deposit(wallet):
         else:
             return True
             
-async def listen_transaction(signature):
-    async with connect(wss_url) as websocket:
-        #finalized is about 16 seconds
-        #confirmed is about 6 seconds
-        await websocket.signature_subscribe(signature,"confirmed")
-        logger.info("Subscribed to the signature")
-        first_resp = await websocket.recv()
-        subscription_id = first_resp[0].result
-        next_resp = await websocket.recv()
-        logger.info("Received data")
-        # logger.info(subscription_id) //Receiving correctly
-        logger.info(next_resp)
-        await websocket.signature_unsubscribe(subscription_id)
-        return next_resp
\ No newline at end of file
+async def listen_transaction(signature, deadline=None, last_valid_height=None):
+    # Websocket notification raced against status polling, bounded by the deadline
+    outcome = await confirm_engine.confirm(signature, deadline, last_valid_height)
+    logger.info(f"Confirmation: {outcome}")
+    return outcome
\ No newline at end of file
@@ -0,0 +1,7 @@
+"""
+Shared helpers for the Oridion lambdas.
+
+This package is bundled next to the generated ``anchor`` client in every
+lambda deployment, so anything created at module level here lives for the
+lifetime of the warm container.
+"""
@@ -0,0 +1,152 @@
+"""
+Wallet activity table.
+
+Hop, withdraw and deposit entries are written to their own table (partition
+key wallet, sort key seq), one item per entry, instead of growing a list on
+the deposits item. The deposits item then stays small and its reads cost
+the same however long the history gets. History is read newest first, a
+page at a time, with Query.
+
+Items written before the table existed still carry an activity attribute
+(a list, or a JSON string on older ones), and readers fall back to it. Move
+those histories into the table, and drop the attribute, with:
+
+    python -m oridion.activity
+"""
+import os
+import ast
+import json
+import time
+import logging
+import botocore
+from decimal import Decimal
+from boto3.dynamodb.conditions import Key
+from oridion.registry import get_table
+
+logger = logging.getLogger()
+
+ACTIVITY_TABLE = os.environ.get('ACTIVITY_TABLE', 'activity')
+
+# Entries per history page
+ACTIVITY_PAGE_SIZE = int(os.environ.get('ACTIVITY_PAGE_SIZE', '20'))
+
+
+def load_activity(activity):
+    """
+    :param activity: Old activity attribute of a deposits item (list or string)
+    :return: List of activity entries
+    """
+    if isinstance(activity, str):
+        try:
+            return json.loads(activity)
+        except ValueError:
+            return ast.literal_eval(activity)
+    return list(activity or [])
+
+
+def json_number(value):
+    # DynamoDB numbers come back as Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dump_activity(activity):
+    """
+    :param activity: List of entries, or an old activity attribute
+    :return: JSON string of the entries, the format the frontend reads
+    """
+    return json.dumps(load_activity(activity), default=json_number)
+
+
+def activity_item(wallet, entry, seq=None):
+    """
+    :param wallet: Wallet string
+    :param entry: Activity entry dict (action, to, time, signature)
+    :param seq: Sort key, milliseconds now by default
+    :return: Activity table item
+    """
+    return {"wallet": wallet, "seq": seq if seq is not None else int(time.time() * 1000), **entry}
+
+
+def put_activity(table, wallet, entry):
+    """
+    Adds one entry to a wallet's history.
+
+    :param table: Activity Table
+    :param wallet: Wallet string
+    :param entry: Activity entry dict
+    :return: Boolean of success or failure.
+    """
+    try:
+        table.put_item(Item=activity_item(wallet, entry))
+    except botocore.exceptions.ClientError as err:
+        logger.error(
+            "Couldn't add activity. Error: %s: %s",
+            err.response["Error"]["Code"],
+            err.response["Error"]["Message"],
+        )
+        return False
+    return True
+
+
+def query_activity(table, wallet, limit=ACTIVITY_PAGE_SIZE, start=None):
+    """
+    One page of a wallet's history, newest first.
+
+    :param table: Activity Table
+    :param wallet: Wallet string
+    :param limit: Entries per page
+    :param start: seq to continue after (the cursor of the previous page)
+    :return: Tuple of (entries, cursor for the next page or None)
+    """
+    kwargs = {"KeyConditionExpression": Key("wallet").eq(wallet), "ScanIndexForward": False, "Limit": limit}
+    if start is not None:
+        kwargs["ExclusiveStartKey"] = {"wallet": wallet, "seq": int(start)}
+    response = table.query(**kwargs)
+    cursor = response.get("LastEvaluatedKey", {}).get("seq")
+    return response["Items"], json_number(cursor) if cursor is not None else None
+
+
+def migrate(deposits_table, activity_table):
+    """
+    Moves activity attributes of deposits items into the activity table. The
+    attribute is only removed if it did not change in the meantime.
+
+    :param deposits_table: deposits Table
+    :param activity_table: Activity Table
+    :return: Number of deposits moved
+    """
+    moved = 0
+    kwargs = {"ProjectionExpression": "wallet, activity"}
+    while True:
+        response = deposits_table.scan(**kwargs)
+        for item in response["Items"]:
+            if "activity" not in item:
+                continue
+            entries = load_activity(item["activity"])
+            # seq from the entry time, so the history keeps its order
+            with activity_table.batch_writer(overwrite_by_pkeys=["wallet", "seq"]) as batch:
+                for i, entry in enumerate(entries):
+                    batch.put_item(Item=activity_item(item["wallet"], entry, int(entry.get("time", 0)) * 1000 + i))
+            try:
+                deposits_table.update_item(
+                    Key={"wallet": item["wallet"]},
+                    UpdateExpression="REMOVE activity",
+                    ConditionExpression="activity = :old",
+                    ExpressionAttributeValues={":old": item["activity"]},
+                )
+                moved += 1
+            except botocore.exceptions.ClientError as err:
+                logger.error(
+                    "Couldn't remove activity. Error: %s: %s",
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"],
+                )
+        if "LastEvaluatedKey" not in response:
+            return moved
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+if __name__ == "__main__":
+    print(f"Moved the activity of {migrate(get_table('deposits'), get_table(ACTIVITY_TABLE))} deposits")
@@ -0,0 +1,74 @@
+"""
+Concurrent processing of DynamoDB stream records.
+
+The triggered lambdas spend most of a record waiting on RPC calls and
+confirmations, so the records of one invocation run as concurrent tasks on
+the event loop, up to a concurrency limit. Records for the same wallet still
+run one after another, in stream order. Failed records are reported back as
+batch item failures (ReportBatchItemFailures), so the stream only retries
+from the first failed record instead of redelivering the whole batch.
+"""
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+# Records processed at the same time within one invocation
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '10'))
+
+
+def record_wallet(record):
+    """
+    :param record: DynamoDB stream record
+    :return: Wallet the record belongs to, or its event ID if it has none
+    """
+    dynamodb = record.get('dynamodb', {})
+    for image in ('Keys', 'NewImage', 'OldImage'):
+        wallet = dynamodb.get(image, {}).get('wallet', {}).get('S')
+        if wallet:
+            return wallet
+    return record.get('eventID')
+
+
+def batch_response(failed):
+    """
+    :param failed: Records that were not processed
+    :return: Lambda response for a ReportBatchItemFailures event source mapping
+    """
+    return {"batchItemFailures": [{"itemIdentifier": record['dynamodb']['SequenceNumber']} for record in failed]}
+
+
+async def run_batch(records, handler, key=record_wallet, concurrency=BATCH_CONCURRENCY):
+    """
+    Runs ``await handler(record)`` for every record. Records with the same key
+    run in order, the rest run concurrently. If a record raises, it and the
+    later records for its key are returned as failed, and every other key is
+    still processed.
+
+    :param records: event['Records']
+    :param handler: Coroutine function taking one record
+    :param key: Function giving the serialization key of a record
+    :param concurrency: Max records in flight
+    :return: List of records that failed or were skipped, in stream order
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    groups = OrderedDict()
+    for record in records:
+        groups.setdefault(key(record), []).append(record)
+
+    async def run_group(group):
+        for i, record in enumerate(group):
+            try:
+                async with semaphore:
+                    await handler(record)
+            except Exception as err:
+                logger.error(f"Record {record.get('eventID')} failed ({err!r})")
+                return group[i:]
+        return []
+
+    logger.info(f"Processing {len(records)} records for {len(groups)} wallets")
+    results = await asyncio.gather(*[run_group(group) for group in groups.values()])
+    failed = {id(record) for group in results for record in group}
+    return [record for record in records if id(record) in failed]
@@ -0,0 +1,126 @@
+"""
+Per container blockhash cache.
+
+A background asyncio task keeps a recent blockhash warm so building a
+transaction does not wait on the network. A cached blockhash is handed out
+while its last_valid_block_height is still a safety margin ahead of the
+current block height. That height is estimated from the last one seen:
+the blockhash refresh gives one, and so does the signature tracker while
+transactions confirm (SignatureTracker.add_height_listener).
+"""
+import os
+import time
+import asyncio
+import logging
+from solana.rpc.commitment import Confirmed
+from oridion.rpc import RpcPoolError
+
+logger = logging.getLogger()
+
+# A blockhash stays valid for this many blocks after the one it was fetched at
+BLOCKHASH_VALIDITY = 150
+
+# Average block time used to estimate the block height between reads (seconds)
+BLOCK_TIME = 0.4
+
+# Stop handing out a blockhash once fewer blocks than this are left on it
+BLOCKHASH_SAFETY_MARGIN = int(os.environ.get('BLOCKHASH_SAFETY_MARGIN', '60'))
+
+# How often the background task fetches a new blockhash (seconds)
+BLOCKHASH_REFRESH_INTERVAL = float(os.environ.get('BLOCKHASH_REFRESH_INTERVAL', '10'))
+
+
+class BlockhashCache:
+    """
+    Blockhash cache refreshed in the background.
+
+    :param rpc_pool: RpcPool used for reads
+    :param margin: Safety margin in blocks
+    :param refresh_interval: Seconds between background refreshes
+    """
+
+    def __init__(self, rpc_pool, margin=BLOCKHASH_SAFETY_MARGIN, refresh_interval=BLOCKHASH_REFRESH_INTERVAL):
+        self.rpc_pool = rpc_pool
+        self.margin = margin
+        self.refresh_interval = refresh_interval
+        self.latest = None
+        self.height = None
+        self.height_at = 0.0
+        self.inflight = None
+        self.task = None
+
+    def estimated_height(self):
+        if self.height is None:
+            return None
+        return self.height + int((time.monotonic() - self.height_at) / BLOCK_TIME)
+
+    def observe_block_height(self, height):
+        """
+        Feeds a block height read elsewhere (the signature tracker) into the estimate.
+
+        :param height: Block height
+        """
+        if height:
+            self.height = height
+            self.height_at = time.monotonic()
+
+    def blocks_left(self, blockhash):
+        """
+        :param blockhash: RpcBlockhash (blockhash and last_valid_block_height)
+        :return: Estimated number of blocks the blockhash is still valid for
+        """
+        height = self.estimated_height()
+        if height is None:
+            return 0
+        return blockhash.last_valid_block_height - height
+
+    def is_valid(self, blockhash, margin=None):
+        """
+        :param blockhash: RpcBlockhash or None
+        :param margin: Blocks that must be left, defaults to the cache margin
+        :return: True if the blockhash can still be used safely
+        """
+        if not blockhash:
+            return False
+        return self.blocks_left(blockhash) >= (self.margin if margin is None else margin)
+
+    async def refresh(self):
+        latest = (await self.rpc_pool.hedged_call("get_latest_blockhash", Confirmed)).value
+        self.observe_block_height(latest.last_valid_block_height - BLOCKHASH_VALIDITY)
+        self.latest = latest
+        return latest
+
+    async def fetch(self):
+        # Concurrent callers share one request
+        if self.inflight is None or self.inflight.done():
+            self.inflight = asyncio.ensure_future(self.refresh())
+        return await asyncio.shield(self.inflight)
+
+    def start(self):
+        """Starts the background refresh task on the running loop (once)."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.refresh_loop())
+
+    async def refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.fetch()
+            except Exception as err:
+                logger.info(f"Background blockhash refresh failed ({err!r})")
+
+    async def get(self):
+        """
+        Returns a blockhash that is safe to build a transaction with. Only
+        waits on the network when the cache is cold or the hash is too old.
+
+        :return: RpcBlockhash or False if it could not be fetched
+        """
+        self.start()
+        if self.is_valid(self.latest):
+            return self.latest
+        try:
+            return await self.fetch()
+        except RpcPoolError:
+            logger.info("Failed to get Blockhash from every RPC")
+            return False
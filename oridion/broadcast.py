@@ -0,0 +1,77 @@
+"""
+Confirmation driven rebroadcast.
+
+A signed transaction is resent until it reaches the target commitment,
+fails, or its blockhash expires, instead of a fixed number of sends. Resends
+start fast and back off, and stop as soon as the confirmation engine reports
+an outcome, so nothing is sent after the transaction has landed and a
+transaction is not given up on while it can still land.
+"""
+import os
+import asyncio
+import logging
+from solana.rpc.types import TxOpts
+from oridion.rpc import RpcPoolError
+
+logger = logging.getLogger()
+
+# Seconds before the first resend, the cap between resends and the growth factor
+REBROADCAST_INITIAL_INTERVAL = float(os.environ.get('REBROADCAST_INITIAL_INTERVAL', '0.5'))
+REBROADCAST_MAX_INTERVAL = float(os.environ.get('REBROADCAST_MAX_INTERVAL', '2'))
+REBROADCAST_BACKOFF = float(os.environ.get('REBROADCAST_BACKOFF', '1.5'))
+
+# "all" sends every resend to every RPC endpoint at once, "best" only to the best one
+BROADCAST_MODE = os.environ.get('BROADCAST_MODE', 'all')
+
+# We do the resending, so the RPC node should not queue its own retries
+SEND_OPTS = TxOpts(skip_preflight=True, max_retries=0)
+
+
+class Rebroadcaster:
+    """
+    :param rpc_pool: RpcPool used for sends
+    :param confirm_engine: ConfirmationEngine that decides when to stop
+    """
+
+    def __init__(self, rpc_pool, confirm_engine):
+        self.rpc_pool = rpc_pool
+        self.confirm_engine = confirm_engine
+
+    async def send(self, serialized_tx):
+        if BROADCAST_MODE == "all":
+            return await self.rpc_pool.broadcast_call("send_raw_transaction", serialized_tx, SEND_OPTS)
+        return await self.rpc_pool.call("send_raw_transaction", serialized_tx, SEND_OPTS)
+
+    async def resend_loop(self, serialized_tx, signature):
+        interval = REBROADCAST_INITIAL_INTERVAL
+        sent = 0
+        while True:
+            try:
+                await self.send(serialized_tx)
+                sent += 1
+                logger.info(f"Sent {signature} ({sent})")
+            except RpcPoolError:
+                logger.info(f"Sending {signature} failed on every RPC")
+            await asyncio.sleep(interval)
+            interval = min(interval * REBROADCAST_BACKOFF, REBROADCAST_MAX_INTERVAL)
+
+    async def submit(self, serialized_tx, signature, last_valid_block_height, deadline=None, expired=None):
+        """
+        Sends the transaction and keeps resending it until there is an outcome.
+
+        :param serialized_tx: Signed, serialized transaction
+        :param signature: Transaction Signature
+        :param last_valid_block_height: Last valid block height of the transaction's blockhash (None for a durable nonce)
+        :param deadline: time.monotonic() deadline for the confirmation
+        :param expired: Awaitable that finishes once the transaction can no longer land (nonce advanced)
+        :return: Outcome (CONFIRMED once landed, FAILED, EXPIRED or TIMEOUT)
+        """
+        resending = asyncio.ensure_future(self.resend_loop(serialized_tx, signature))
+        try:
+            outcome = await self.confirm_engine.confirm(signature, deadline, last_valid_block_height, expired)
+        finally:
+            resending.cancel()
+        logger.info(f"Rebroadcast of {signature} finished: {outcome}")
+        if BROADCAST_MODE == "all":
+            logger.info(f"Broadcast stats: {self.rpc_pool.broadcast_stats()}")
+        return outcome
@@ -0,0 +1,146 @@
+"""
+Simulation calibrated compute unit limits.
+
+Instead of hand tuned set_compute_unit_limit numbers, each instruction shape
+(job type + step) is simulated once with simulateTransaction and its
+unitsConsumed, plus a safety margin, is used as the limit from then on. A
+step that only runs after an earlier one (e.g. a hop end after its start) is
+measured by simulating the steps together and subtracting what the earlier
+steps used. The limits are thrown away when the program is redeployed, which
+is noticed from the deploy slot in its ProgramData account. After a failed
+calibration the job type uses its fallback limits for CU_CALIBRATION_BACKOFF
+seconds, so the jobs in between do not simulate on their critical path.
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+from solana.rpc.commitment import Confirmed
+from solana.rpc.types import DataSliceOpts
+from solders.pubkey import Pubkey
+from solders.message import Message
+from solders.transaction import Transaction
+from solders.compute_budget import set_compute_unit_limit
+from solders.compute_budget import set_compute_unit_price
+from oridion.rpc import RpcPoolError
+
+logger = logging.getLogger()
+
+# Limit = unitsConsumed * CU_MARGIN, but at least CU_MIN_HEADROOM units above it
+CU_MARGIN = float(os.environ.get('CU_MARGIN', '1.1'))
+CU_MIN_HEADROOM = int(os.environ.get('CU_MIN_HEADROOM', '500'))
+
+# Seconds between checks of the program deploy slot
+CU_DEPLOY_CHECK_INTERVAL = float(os.environ.get('CU_DEPLOY_CHECK_INTERVAL', '60'))
+
+# Seconds a job type uses its fallback limits after a failed calibration
+CU_CALIBRATION_BACKOFF = float(os.environ.get('CU_CALIBRATION_BACKOFF', '60'))
+
+# Limit used while simulating
+MAX_COMPUTE_UNITS = 1400000
+
+BPF_LOADER_UPGRADEABLE = Pubkey.from_string("BPFLoaderUpgradeab1e11111111111111111111111")
+
+
+class SimulationError(Exception):
+    """Raised when a calibration simulation fails."""
+
+
+def with_margin(units):
+    return max(math.ceil(units * CU_MARGIN), units + CU_MIN_HEADROOM)
+
+
+class ComputeCalibrator:
+    """
+    Compute unit limits per (job type, step), calibrated by simulation.
+
+    :param rpc_pool: RpcPool used for simulations and deploy slot reads
+    :param program_id: Oridion program Pubkey
+    """
+
+    def __init__(self, rpc_pool, program_id):
+        self.rpc_pool = rpc_pool
+        self.program_data = Pubkey.find_program_address([bytes(program_id)], BPF_LOADER_UPGRADEABLE)[0]
+        self.limits = {}
+        self.deploy_slot = None
+        self.checked_at = 0.0
+        self.inflight = {}
+        self.failed_at = {}
+
+    async def read_deploy_slot(self):
+        # ProgramData: u32 account type, then the u64 slot it was deployed at
+        resp = await self.rpc_pool.call(
+            "get_account_info", self.program_data, Confirmed, "base64", DataSliceOpts(offset=4, length=8)
+        )
+        if resp.value is None:
+            return None
+        return int.from_bytes(bytes(resp.value.data), "little")
+
+    async def check_deploy(self):
+        if time.monotonic() - self.checked_at < CU_DEPLOY_CHECK_INTERVAL:
+            return
+        self.checked_at = time.monotonic()
+        try:
+            slot = await self.read_deploy_slot()
+        except RpcPoolError:
+            logger.info("Could not read the program deploy slot")
+            return
+        if slot != self.deploy_slot:
+            if self.deploy_slot is not None:
+                logger.info(f"Program redeployed at slot {slot}. Recalibrating compute units")
+            self.deploy_slot = slot
+            self.limits.clear()
+            self.failed_at.clear()
+
+    async def simulate(self, instructions, payer, blockhash):
+        budget = [set_compute_unit_limit(MAX_COMPUTE_UNITS), set_compute_unit_price(0)]
+        txn = Transaction.new_unsigned(Message.new_with_blockhash(budget + instructions, payer, blockhash))
+        result = (await self.rpc_pool.call("simulate_transaction", txn, False, Confirmed)).value
+        if result.err is not None or result.units_consumed is None:
+            raise SimulationError(f"Simulation failed: {result.err}")
+        return result.units_consumed
+
+    async def calibrate(self, job_type, steps, payer, blockhash):
+        # Units of the compute budget instructions alone, then of each prefix of the steps
+        overhead = await self.simulate([], payer, blockhash)
+        used = overhead
+        for i, (name, ix) in enumerate(steps):
+            total = await self.simulate([ix for _, ix in steps[:i + 1]], payer, blockhash)
+            units = total - used + overhead
+            used = total
+            self.limits[(job_type, name)] = with_margin(units)
+            logger.info(f"Calibrated {job_type} {name}: {units} CU, limit {self.limits[(job_type, name)]}")
+
+    async def get_limits(self, job_type, steps, payer, blockhash, fallback):
+        """
+        Compute unit limits for the steps of a job, simulating them the first time.
+
+        :param job_type: Job type (star_two, star_three, withdraw, ...)
+        :param steps: List of (step name, Instruction) in the order they run
+        :param payer: Fee payer Pubkey
+        :param blockhash: Recent blockhash for the simulation
+        :param fallback: Dict of step name -> limit used if calibration fails
+        :return: List of limits, one per step
+        """
+        await self.check_deploy()
+        backing_off = time.monotonic() - self.failed_at.get(job_type, -CU_CALIBRATION_BACKOFF) < CU_CALIBRATION_BACKOFF
+        if not backing_off and any((job_type, name) not in self.limits for name, _ in steps):
+            # Concurrent jobs of the same type share one calibration
+            task = self.inflight.get(job_type)
+            if task is None or task.done():
+                task = asyncio.ensure_future(self.calibrate(job_type, steps, payer, blockhash))
+                self.inflight[job_type] = task
+            try:
+                await asyncio.shield(task)
+            except (RpcPoolError, SimulationError) as err:
+                logger.info(f"Compute unit calibration for {job_type} failed ({err!r}). Using defaults")
+                self.failed_at[job_type] = time.monotonic()
+        return [self.limits.get((job_type, name), fallback[name]) for name, _ in steps]
+
+    async def instructions(self, job_type, steps, payer, blockhash, fallback):
+        """
+        Same as get_limits() but returns set_compute_unit_limit instructions.
+        """
+        limits = await self.get_limits(job_type, steps, payer, blockhash, fallback)
+        return [set_compute_unit_limit(limit) for limit in limits]
@@ -0,0 +1,153 @@
+"""
+Transaction confirmation engine.
+
+Races the shared websocket notification against getSignatureStatuses
+polling and returns as soon as either one sees the target commitment. A
+dropped notification or a transaction that never lands can no longer hang
+the lambda: waiting stops at a deadline taken from the Lambda context, and
+once the blockhash's last_valid_block_height has passed the transaction is
+reported as expired.
+"""
+import os
+import time
+import asyncio
+import logging
+from solders.commitment_config import CommitmentConfig
+from oridion.rpc import RpcPoolError
+from oridion.signatures import COMMITMENT_LEVELS
+
+logger = logging.getLogger()
+
+# Milliseconds kept back from the Lambda timeout so the handler can still finish up
+CONFIRM_RESERVE_MS = int(os.environ.get('CONFIRM_RESERVE_MS', '3000'))
+
+# Seconds to wait when there is no Lambda context to take a deadline from
+CONFIRM_TIMEOUT = float(os.environ.get('CONFIRM_TIMEOUT', '60'))
+
+# Status reads after an expiry, in case the transaction landed just before it
+EXPIRY_CHECKS = 3
+
+# Outcome statuses
+CONFIRMED = "confirmed"
+FAILED = "failed"
+EXPIRED = "expired"
+TIMEOUT = "timeout"
+
+
+class Outcome:
+    """
+    Result of waiting on a signature. Truthy only when it confirmed.
+
+    :param status: CONFIRMED, FAILED, EXPIRED or TIMEOUT
+    :param err: Transaction error when FAILED
+    """
+
+    def __init__(self, status, err=None):
+        self.status = status
+        self.err = err
+
+    def __bool__(self):
+        return self.status == CONFIRMED
+
+    def __repr__(self):
+        return f"Outcome({self.status}, err={self.err})"
+
+
+def deadline_from_context(context, reserve_ms=CONFIRM_RESERVE_MS):
+    """
+    :param context: Lambda context or None
+    :param reserve_ms: Milliseconds to keep back from the Lambda timeout
+    :return: time.monotonic() deadline
+    """
+    if context is None:
+        return time.monotonic() + CONFIRM_TIMEOUT
+    return time.monotonic() + max(0, context.get_remaining_time_in_millis() - reserve_ms) / 1000
+
+
+class ConfirmationEngine:
+    """
+    :param tracker: SignatureTracker used for polling
+    :param subscriptions: SignatureSubscriptions for the websocket side
+    :param commitment: Commitment to wait for ("confirmed" by default)
+    """
+
+    def __init__(self, tracker, subscriptions, commitment="confirmed"):
+        self.tracker = tracker
+        self.subscriptions = subscriptions
+        self.commitment = CommitmentConfig(COMMITMENT_LEVELS[commitment])
+
+    async def watch_websocket(self, signature):
+        value = await self.subscriptions.wait(signature)
+        if value.err is not None:
+            return Outcome(FAILED, value.err)
+        return Outcome(CONFIRMED)
+
+    async def poll_status(self, signature, last_valid_block_height=None):
+        # One batched status read per tracker tick, shared with every other job
+        while True:
+            try:
+                status = await self.tracker.next_status(signature)
+            except RpcPoolError:
+                logger.info("Signature status poll failed on every RPC")
+                continue
+            if status is not None:
+                if status.err is not None:
+                    return Outcome(FAILED, status.err)
+                if status.satisfies_commitment(self.commitment):
+                    return Outcome(CONFIRMED)
+            elif last_valid_block_height is not None:
+                height = self.tracker.height
+                if height is not None and height > last_valid_block_height:
+                    return Outcome(EXPIRED)
+
+    async def watch_expiry(self, signature, expired):
+        await expired
+        # The transaction can no longer land, unless it already has
+        for _ in range(EXPIRY_CHECKS):
+            try:
+                status = await self.tracker.next_status(signature)
+            except RpcPoolError:
+                continue
+            if status is not None:
+                if status.err is not None:
+                    return Outcome(FAILED, status.err)
+                if status.satisfies_commitment(self.commitment):
+                    return Outcome(CONFIRMED)
+        return Outcome(EXPIRED)
+
+    async def confirm(self, signature, deadline=None, last_valid_block_height=None, expired=None):
+        """
+        Waits until the signature reaches the commitment, fails, expires or the deadline passes.
+
+        :param signature: Transaction Signature
+        :param deadline: time.monotonic() deadline, defaults to CONFIRM_TIMEOUT from now
+        :param last_valid_block_height: Block height after which the transaction can no longer land
+        :param expired: Awaitable that finishes once the transaction can no longer land (durable nonce advanced)
+        :return: Outcome
+        """
+        if deadline is None:
+            deadline = time.monotonic() + CONFIRM_TIMEOUT
+        watchers = [
+            asyncio.ensure_future(self.watch_websocket(signature)),
+            asyncio.ensure_future(self.poll_status(signature, last_valid_block_height)),
+        ]
+        if expired is not None:
+            watchers.append(asyncio.ensure_future(self.watch_expiry(signature, expired)))
+        try:
+            while watchers:
+                done, _ = await asyncio.wait(
+                    watchers, timeout=max(0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    logger.info(f"Confirmation deadline reached for {signature}")
+                    return Outcome(TIMEOUT)
+                for task in done:
+                    watchers.remove(task)
+                    if task.exception() is None:
+                        return task.result()
+                    # The websocket side can fail on its own, polling carries on
+                    logger.info(f"Confirmation watcher failed ({task.exception()!r})")
+            return Outcome(TIMEOUT)
+        finally:
+            for task in watchers:
+                task.cancel()
@@ -0,0 +1,128 @@
+"""
+Priority fee estimator.
+
+Prices each transaction from getRecentPrioritizationFees for the writable
+accounts it touches (planet PDAs, manager), instead of a fixed compute unit
+price per lambda. Samples are cached per account set for a short TTL, so
+concurrent jobs touching the same accounts share one read. Each job type
+picks its own percentile and cap, and the old fixed price is used whenever
+the RPC cannot give an estimate.
+
+Per job type settings, e.g. for star_three jobs:
+
+    FEE_PERCENTILE_STAR_THREE=0.9
+    FEE_CAP_STAR_THREE=150000
+"""
+import os
+import time
+import asyncio
+import logging
+from oridion.rpc import RpcPoolError
+
+logger = logging.getLogger()
+
+# Seconds a fee sample stays fresh
+FEE_TTL = float(os.environ.get('FEE_TTL', '10'))
+
+# Defaults for job types without their own FEE_PERCENTILE_<JOB>/FEE_CAP_<JOB>
+FEE_PERCENTILE = float(os.environ.get('FEE_PERCENTILE', '0.75'))
+FEE_CAP = int(os.environ.get('FEE_CAP', '100000'))
+
+# Never price below this many micro-lamports per compute unit
+FEE_MIN = int(os.environ.get('FEE_MIN', '1000'))
+
+
+def fee_settings(job_type):
+    """
+    :param job_type: Job type (star_two, star_three, withdraw, ...)
+    :return: Tuple of (percentile, cap)
+    """
+    suffix = job_type.upper()
+    percentile = float(os.environ.get(f'FEE_PERCENTILE_{suffix}', FEE_PERCENTILE))
+    cap = int(os.environ.get(f'FEE_CAP_{suffix}', FEE_CAP))
+    return percentile, cap
+
+
+def percentile_of(values, percentile):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+
+async def get_recent_prioritization_fees(client, accounts):
+    """
+    getRecentPrioritizationFees for the given accounts. AsyncClient has no
+    wrapper for this method, so the request is posted on its http session.
+
+    :param client: AsyncClient
+    :param accounts: List of Pubkey
+    :return: List of prioritization fees of recent slots
+    """
+    body = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "getRecentPrioritizationFees",
+        "params": [[str(account) for account in accounts]],
+    }
+    resp = await client._provider.session.post(client._provider.endpoint_uri, json=body)
+    resp.raise_for_status()
+    data = resp.json()
+    if "error" in data:
+        raise ValueError(data["error"])
+    return [item["prioritizationFee"] for item in data["result"]]
+
+
+class FeeEstimator:
+    """
+    :param rpc_pool: RpcPool used for the fee reads
+    :param ttl: Seconds a sample stays fresh
+    """
+
+    def __init__(self, rpc_pool, ttl=FEE_TTL):
+        self.rpc_pool = rpc_pool
+        self.ttl = ttl
+        self.samples = {}
+        self.inflight = {}
+
+    async def read(self, key):
+        fees = await self.rpc_pool.run(
+            lambda client: get_recent_prioritization_fees(client, sorted(key, key=str)), "getRecentPrioritizationFees"
+        )
+        self.samples[key] = (fees, time.monotonic())
+        return fees
+
+    async def fees(self, accounts):
+        """
+        :param accounts: Writable accounts of the transaction
+        :return: Recent prioritization fees for those accounts
+        """
+        key = frozenset(accounts)
+        sample = self.samples.get(key)
+        if sample is not None and time.monotonic() - sample[1] < self.ttl:
+            return sample[0]
+        # Concurrent callers share one request
+        task = self.inflight.get(key)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self.read(key))
+            self.inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def price(self, job_type, accounts, fallback):
+        """
+        Compute unit price for a transaction.
+
+        :param job_type: Job type, selects the percentile and cap
+        :param accounts: Writable accounts of the transaction
+        :param fallback: Price used when there is no estimate
+        :return: Micro-lamports per compute unit
+        """
+        try:
+            fees = await self.fees(accounts)
+        except RpcPoolError as err:
+            logger.info(f"Priority fee estimate failed ({err!r}). Using {fallback}")
+            return fallback
+        if not fees:
+            return fallback
+        percentile, cap = fee_settings(job_type)
+        price = min(cap, max(FEE_MIN, percentile_of(fees, percentile)))
+        logger.info(f"Priority fee for {job_type}: {price} (p{percentile * 100:.0f} of {len(fees)} slots, cap {cap})")
+        return price
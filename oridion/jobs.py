@@ -0,0 +1,95 @@
+"""
+Job completion commit.
+
+Once a triggered job's transaction has landed, the deposit update (loc,
+hops, last_updated, last_signature/last_action), the activity entry and the
+job's completed flag are written in one TransactWriteItems call. Either all
+of them are applied or none are, so a failure can no longer leave a moved
+deposit behind a job that stays pending.
+
+The deposit update is conditioned on the loc the job started from (the
+job's "from", written by add-task) and the job update on completed = 0, so
+the same job is never written twice.
+
+That only guards this final write. So that the on-chain transaction is
+not sent again, the triggered lambdas skip a record unless its job is
+still in the table with completed = 0 and the deposit is still at the
+job's start planet. A window remains: a record redelivered while an
+earlier delivery of it is still in flight, or after its transaction
+landed but before this commit ran (e.g. the Lambda timed out in between),
+passes those checks and sends again. The commit then cancels, but the
+second transaction may already have landed.
+"""
+import logging
+import botocore
+from oridion.activity import activity_item
+
+logger = logging.getLogger()
+
+
+def commit_items(deposits_table, jobs_table, activity_table, wallet, from_loc, to_loc, now, entry):
+    """
+    :param deposits_table: deposits Table
+    :param jobs_table: jobs Table
+    :param activity_table: Activity Table
+    :param wallet: Wallet string (key of all three items)
+    :param from_loc: loc the job started from
+    :param to_loc: New loc (destination planet or wallet)
+    :param now: Timestamp of now
+    :param entry: Activity entry dict (action, to, time, signature)
+    :return: TransactItems list
+    """
+    return [
+        {
+            "Update": {
+                "TableName": deposits_table.name,
+                "Key": {"wallet": wallet},
+                "UpdateExpression": "SET loc=:loc, last_updated=:last_updated, hops=hops + :increment, "
+                                    "last_signature=:last_signature, last_action=:last_action",
+                "ConditionExpression": "loc = :from_loc",
+                "ExpressionAttributeValues": {
+                    ":loc": to_loc,
+                    ":from_loc": from_loc,
+                    ":last_updated": now,
+                    ":increment": 1,
+                    ":last_signature": entry["signature"],
+                    ":last_action": entry["action"],
+                },
+            }
+        },
+        {"Put": {"TableName": activity_table.name, "Item": activity_item(wallet, entry)}},
+        {
+            "Update": {
+                "TableName": jobs_table.name,
+                "Key": {"wallet": wallet},
+                "UpdateExpression": "SET completed=:completed",
+                "ConditionExpression": "completed = :pending",
+                "ExpressionAttributeValues": {":completed": 1, ":pending": 0},
+            }
+        },
+    ]
+
+
+def complete_job(deposits_table, jobs_table, activity_table, wallet, from_loc, to_loc, now, entry):
+    """
+    Moves the deposit, records the activity entry and marks the job completed
+    in one transaction (see commit_items for the parameters).
+
+    :return: Boolean of success or failure. False also when the job was already applied
+    """
+    items = commit_items(deposits_table, jobs_table, activity_table, wallet, from_loc, to_loc, now, entry)
+    try:
+        # The resource client takes plain values, like Table calls do
+        deposits_table.meta.client.transact_write_items(TransactItems=items)
+    except botocore.exceptions.ClientError as err:
+        reasons = [reason.get("Code") for reason in err.response.get("CancellationReasons", [])]
+        if "ConditionalCheckFailed" in reasons:
+            logger.error(f"Job for {wallet} already applied or deposit moved (reasons: {reasons}). Nothing written")
+            return False
+        logger.error(
+            "Couldn't complete job. Error: %s: %s",
+            err.response["Error"]["Code"],
+            err.response["Error"]["Message"],
+        )
+        return False
+    return True
@@ -0,0 +1,168 @@
+"""
+Versioned (v0) transactions and the Oridion address lookup table.
+
+Transactions are compiled to v0 messages, and the static accounts every
+Oridion transaction touches (Universe, planet PDAs, system program) are
+loaded from an address lookup table. Each of them then costs a one byte
+index instead of a 32 byte key. Signers (the manager) and the programs that
+are invoked (Oridion, compute budget) cannot be loaded from a lookup table,
+so they stay in the message.
+
+Without LOOKUP_TABLE_ADDRESS the messages are still v0, just without a
+table. Create or extend the table with the current planet names:
+
+    MAINNET_ENV=... MANAGER_SECRET=... ORD_PROGRAM_ADDRESS=... UNIVERSE_ADDRESS=... \\
+        LOOKUP_TABLE_ADDRESS=<empty to create> python -m oridion.lookup ANDORA ...
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+from solana.rpc.commitment import Confirmed
+from solana.rpc.types import TxOpts
+from solders.pubkey import Pubkey
+from solders.keypair import Keypair
+from solders.message import MessageV0
+from solders.transaction import VersionedTransaction
+from solders.system_program import ID as SYSTEM_PROGRAM_ID
+from solders.system_program import create_lookup_table
+from solders.system_program import extend_lookup_table
+from solders.address_lookup_table_account import AddressLookupTable
+from solders.address_lookup_table_account import AddressLookupTableAccount
+from oridion.rpc import RpcPool
+from oridion.rpc import RpcPoolError
+from oridion.planets import PlanetIndex
+
+logger = logging.getLogger()
+
+LOOKUP_TABLE_ADDRESS = os.environ.get('LOOKUP_TABLE_ADDRESS', '')
+
+# Seconds before the table is read again (it picks up new planets)
+LOOKUP_TABLE_TTL = float(os.environ.get('LOOKUP_TABLE_TTL', '300'))
+
+# Addresses per extend instruction, so the transaction stays under the size limit
+EXTEND_BATCH = 20
+
+
+def build_v0(payer_kp, instructions, blockhash, lookup_tables, signers=()):
+    """
+    Compiles and signs a v0 transaction.
+
+    :param payer_kp: Fee payer Keypair
+    :param instructions: List of Instruction
+    :param blockhash: Recent blockhash Hash
+    :param lookup_tables: List of AddressLookupTableAccount (may be empty)
+    :param signers: Other Keypairs the instructions need (e.g. the manager when another account pays)
+    :return: Tuple of (serialized transaction, signature)
+    """
+    message = MessageV0.try_compile(payer_kp.pubkey(), instructions, lookup_tables, blockhash)
+    keypairs = [payer_kp] + [kp for kp in signers if kp.pubkey() != payer_kp.pubkey()]
+    tx = VersionedTransaction(message, keypairs)
+    return bytes(tx), tx.signatures[0]
+
+
+def static_accounts(universe, planet_pdas):
+    """
+    :param universe: Universe account Pubkey
+    :param planet_pdas: Iterable of planet PDAs
+    :return: Accounts that belong in the lookup table
+    """
+    return [universe, SYSTEM_PROGRAM_ID] + list(planet_pdas)
+
+
+class LookupTable:
+    """
+    Cached lookup table account.
+
+    :param rpc_pool: RpcPool used for reads
+    :param address: Lookup table address string, empty for none
+    :param ttl: Seconds before the table is read again
+    """
+
+    def __init__(self, rpc_pool, address=LOOKUP_TABLE_ADDRESS, ttl=LOOKUP_TABLE_TTL):
+        self.rpc_pool = rpc_pool
+        self.address = Pubkey.from_string(address) if address else None
+        self.ttl = ttl
+        self.account = None
+        self.fetched_at = 0.0
+        self.inflight = None
+
+    async def refresh(self):
+        resp = await self.rpc_pool.call("get_account_info", self.address, Confirmed)
+        if resp.value is None:
+            raise ValueError("Lookup table account not found")
+        table = AddressLookupTable.deserialize(bytes(resp.value.data))
+        self.account = AddressLookupTableAccount(self.address, list(table.addresses))
+        self.fetched_at = time.monotonic()
+        return self.account
+
+    async def fetch(self):
+        # Concurrent callers share one request
+        if self.inflight is None or self.inflight.done():
+            self.inflight = asyncio.ensure_future(self.refresh())
+        return await asyncio.shield(self.inflight)
+
+    async def get(self):
+        """
+        :return: List of AddressLookupTableAccount to compile with (empty without a table)
+        """
+        if self.address is None:
+            return []
+        if self.account is None or time.monotonic() - self.fetched_at > self.ttl:
+            try:
+                await self.fetch()
+            except (RpcPoolError, ValueError) as err:
+                logger.info(f"Lookup table read failed ({err!r})")
+        return [self.account] if self.account is not None else []
+
+
+async def sync_table(rpc_pool, manager_kp, address, accounts):
+    # Creates the table when there is no address, then adds what it is missing
+    instructions = []
+    if address is None:
+        slot = (await rpc_pool.call("get_slot", Confirmed)).value
+        ix, address = create_lookup_table(
+            {"authority_address": manager_kp.pubkey(), "payer_address": manager_kp.pubkey(), "recent_slot": slot}
+        )
+        instructions.append([ix])
+        known = []
+    else:
+        known = (await LookupTable(rpc_pool, str(address)).refresh()).addresses
+    missing = [account for account in dict.fromkeys(accounts) if account not in known]
+    for i in range(0, len(missing), EXTEND_BATCH):
+        ix = extend_lookup_table(
+            {
+                "lookup_table_address": address,
+                "authority_address": manager_kp.pubkey(),
+                "payer_address": manager_kp.pubkey(),
+                "new_addresses": missing[i:i + EXTEND_BATCH],
+            }
+        )
+        instructions.append([ix])
+    for ixs in instructions:
+        blockhash = (await rpc_pool.call("get_latest_blockhash", Confirmed)).value.blockhash
+        serialized_tx, signature = build_v0(manager_kp, ixs, blockhash, [])
+        await rpc_pool.call("send_raw_transaction", serialized_tx, TxOpts(preflight_commitment=Confirmed))
+        print(f"Sent {signature}")
+        # Extends must land in order and after the create
+        await rpc_pool.call("confirm_transaction", signature, Confirmed)
+    print(f"Lookup table {address}: {len(missing)} addresses added")
+
+
+if __name__ == "__main__":
+    program_id = Pubkey.from_string(os.environ['ORD_PROGRAM_ADDRESS'])
+    index = PlanetIndex(program_id)
+    index.sync(sys.argv[1:])
+    accounts = static_accounts(
+        Pubkey.from_string(os.environ['UNIVERSE_ADDRESS']), [pda for pda, _ in index.entries.values()]
+    )
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(
+        sync_table(
+            RpcPool.from_env(),
+            Keypair.from_base58_string(os.environ['MANAGER_SECRET']),
+            Pubkey.from_string(LOOKUP_TABLE_ADDRESS) if LOOKUP_TABLE_ADDRESS else None,
+            accounts,
+        )
+    )
@@ -0,0 +1,410 @@
+"""
+Durable nonce pool.
+
+With NONCE_ACCOUNTS set, the triggered lambdas sign against a durable nonce
+instead of a recent blockhash. The first instruction advances the nonce and
+the value stored in the nonce account is used as the message blockhash, so
+the transaction does not expire after ~150 blocks. It can be built ahead of
+time and resent without signing it again.
+
+Every container uses the same nonce accounts, so each nonce is leased through
+the nonces DynamoDB table (conditional update on lease_until) before it is
+used. Before a transaction is sent its nonce value is written to the lease as
+spent. After use the nonce is recycled in the background. A landed or failed
+transaction has already advanced it, and its new value is read back. If the
+transaction never landed, the manager advances the nonce itself so that the
+old transaction can no longer land. A new lease always reads the nonce from
+the chain, and advances it first when it still holds the spent value (the
+container that sent with it was stopped before recycling it). When no nonce
+is free the job falls back to a recent blockhash.
+
+A nonce transaction has no last valid block height. Its confirmation ends
+once the nonce no longer holds the value it was signed with, after
+NONCE_CONFIRM_SECONDS, or early enough before the Lambda timeout that the
+recycle can still run (NONCE_RESERVE_MS).
+
+The advance instruction costs NONCE_ADVANCE_CU compute units, which the
+lambdas add to the limit of every nonce transaction (calibrated or not).
+Create the nonce accounts (authority = manager) with:
+
+    MAINNET_ENV=... MANAGER_SECRET=... python -m oridion.nonce 20
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import logging
+import botocore
+from solana.rpc.commitment import Confirmed
+from solana.rpc.types import TxOpts
+from solders.hash import Hash
+from solders.pubkey import Pubkey
+from solders.keypair import Keypair
+from solders.message import MessageV0
+from solders.transaction import VersionedTransaction
+from solders.system_program import advance_nonce_account
+from solders.system_program import create_nonce_account
+from oridion.rpc import RpcPool
+from oridion.rpc import RpcPoolError
+from oridion.lookup import build_v0
+from oridion.confirm import Outcome
+from oridion.confirm import FAILED
+from oridion.confirm import CONFIRM_RESERVE_MS
+from oridion.confirm import deadline_from_context
+
+logger = logging.getLogger()
+
+# Comma separated nonce account addresses (authority = manager). Empty disables nonces
+NONCE_ACCOUNTS = [address for address in os.environ.get('NONCE_ACCOUNTS', '').split(',') if address]
+
+# DynamoDB table with the leases (partition key "address")
+NONCE_TABLE = os.environ.get('NONCE_TABLE', 'nonces')
+
+# Seconds a lease is held before another container may take the nonce
+NONCE_LEASE_SECONDS = int(os.environ.get('NONCE_LEASE_SECONDS', '900'))
+
+# Seconds to wait for free nonces before using a recent blockhash
+NONCE_WAIT = float(os.environ.get('NONCE_WAIT', '2'))
+
+# Seconds to wait for a used nonce to advance before advancing it ourselves
+NONCE_SETTLE_SECONDS = float(os.environ.get('NONCE_SETTLE_SECONDS', '10'))
+
+# Longest confirmation of a nonce transaction, in seconds
+NONCE_CONFIRM_SECONDS = float(os.environ.get('NONCE_CONFIRM_SECONDS', '90'))
+
+# Milliseconds kept back from the Lambda timeout: a recycle waits up to twice
+# NONCE_SETTLE_SECONDS (settle, then advance), plus its RPC calls
+NONCE_RESERVE_MS = int(os.environ.get('NONCE_RESERVE_MS', str(CONFIRM_RESERVE_MS + int(2 * NONCE_SETTLE_SECONDS * 1000) + 5000)))
+
+# Seconds between nonce account reads while waiting for it to advance
+NONCE_POLL_INTERVAL = 0.5
+
+# Compute units of the advance instruction (a system program instruction)
+NONCE_ADVANCE_CU = 150
+
+# version u32, state u32, authority, stored blockhash, lamports per signature u64
+NONCE_ACCOUNT_SIZE = 80
+
+
+class NonceError(Exception):
+    """Raised when a nonce account cannot be read or advanced."""
+
+
+def parse_nonce(data):
+    """
+    :param data: Nonce account data
+    :return: Stored nonce Hash, None if the account is not an initialized nonce
+    """
+    if len(data) < NONCE_ACCOUNT_SIZE or int.from_bytes(data[4:8], "little") != 1:
+        return None
+    return Hash.from_bytes(bytes(data[40:72]))
+
+
+def advance_ix(address, authority):
+    return advance_nonce_account({"nonce_pubkey": address, "authorized_pubkey": authority})
+
+
+def nonce_deadline(context):
+    """
+    :param context: Lambda context or None
+    :return: time.monotonic() deadline for confirming a nonce transaction
+    """
+    return min(time.monotonic() + NONCE_CONFIRM_SECONDS, deadline_from_context(context, NONCE_RESERVE_MS))
+
+
+class NonceLease:
+    """
+    One leased nonce. It has the blockhash and last_valid_block_height
+    attributes of a BlockhashCache blockhash, but no last valid height,
+    because a nonce does not expire.
+
+    :param address: Nonce account Pubkey
+    :param blockhash: Current nonce value (Hash)
+    :param authority: Nonce authority Pubkey
+    """
+
+    def __init__(self, address, blockhash, authority):
+        self.address = address
+        self.blockhash = blockhash
+        self.last_valid_block_height = None
+        self.authority = authority
+        self.spent = False
+
+    def instructions(self, instructions):
+        """
+        :param instructions: Instructions of the transaction
+        :return: The same instructions, after the one that advances the nonce
+        """
+        return [advance_ix(self.address, self.authority)] + list(instructions)
+
+
+class NoncePool:
+    """
+    :param rpc_pool: RpcPool used for nonce reads and advances
+    :param table: DynamoDB table holding the leases
+    :param authority_kp: Nonce authority Keypair (the manager)
+    :param addresses: Nonce account address strings
+    """
+
+    def __init__(self, rpc_pool, table, authority_kp, addresses=NONCE_ACCOUNTS):
+        self.rpc_pool = rpc_pool
+        self.table = table
+        self.authority_kp = authority_kp
+        self.addresses = [Pubkey.from_string(address) for address in addresses]
+        self.owner = uuid.uuid4().hex
+        self.held = set()
+        self.recycling = set()
+
+    @property
+    def enabled(self):
+        return bool(self.addresses)
+
+    def claim(self, address):
+        # Conditional update, so only one container holds a nonce at a time
+        now = int(time.time())
+        try:
+            response = self.table.update_item(
+                Key={"address": str(address)},
+                UpdateExpression="SET holder=:holder, lease_until=:until",
+                ConditionExpression="attribute_not_exists(lease_until) OR lease_until < :now",
+                ExpressionAttributeValues={":holder": self.owner, ":until": now + NONCE_LEASE_SECONDS, ":now": now},
+                ReturnValues="ALL_NEW",
+            )
+        except botocore.exceptions.ClientError as err:
+            if err.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                logger.error(
+                    "Couldn't lease nonce. Error: %s: %s",
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"],
+                )
+            return None
+        self.held.add(address)
+        return response["Attributes"]
+
+    def unlease(self, address, value=None, spent=None):
+        """
+        Drops our lease on a nonce.
+
+        :param address: Nonce account Pubkey
+        :param value: Current nonce value, saved for the next holder
+        :param spent: Value a transaction that may still land was signed with
+        """
+        values = {":holder": self.owner}
+        if value is not None:
+            update = "SET nonce=:nonce REMOVE holder, lease_until, spent"
+            values[":nonce"] = str(value)
+        elif spent is not None:
+            update = "SET spent=:spent REMOVE holder, lease_until, nonce"
+            values[":spent"] = str(spent)
+        else:
+            update = "REMOVE holder, lease_until, nonce"
+        self.held.discard(address)
+        try:
+            self.table.update_item(
+                Key={"address": str(address)},
+                UpdateExpression=update,
+                ConditionExpression="holder = :holder",
+                ExpressionAttributeValues=values,
+            )
+        except botocore.exceptions.ClientError as err:
+            logger.error(
+                "Couldn't release nonce. Error: %s: %s",
+                err.response["Error"]["Code"],
+                err.response["Error"]["Message"],
+            )
+
+    def spend(self, lease):
+        """
+        Writes the lease's value to the table as spent, before a transaction
+        signed with it is sent. Whoever leases the nonce next advances it first
+        if it still holds that value.
+
+        :param lease: NonceLease
+        :return: Boolean of success or failure (the lease is no longer ours)
+        """
+        try:
+            self.table.update_item(
+                Key={"address": str(lease.address)},
+                UpdateExpression="SET spent=:spent",
+                ConditionExpression="holder = :holder",
+                ExpressionAttributeValues={":spent": str(lease.blockhash), ":holder": self.owner},
+            )
+        except botocore.exceptions.ClientError as err:
+            logger.error(
+                "Couldn't mark nonce spent. Error: %s: %s",
+                err.response["Error"]["Code"],
+                err.response["Error"]["Message"],
+            )
+            return False
+        lease.spent = True
+        return True
+
+    async def read(self, address):
+        resp = await self.rpc_pool.call("get_account_info", address, Confirmed)
+        value = parse_nonce(bytes(resp.value.data)) if resp.value is not None else None
+        if value is None:
+            raise NonceError(f"{address} is not a nonce account")
+        return value
+
+    async def wait_for_change(self, address, value, timeout):
+        # Landed and failed transactions both advance the nonce
+        give_up = time.monotonic() + timeout
+        while time.monotonic() < give_up:
+            current = await self.read(address)
+            if current != value:
+                return current
+            await asyncio.sleep(NONCE_POLL_INTERVAL)
+        return None
+
+    async def advanced(self, lease):
+        # Returns once the nonce no longer holds the lease's value. A transaction
+        # signed with it can then no longer land, unless it already has
+        while True:
+            try:
+                if await self.read(lease.address) != lease.blockhash:
+                    return
+            except (RpcPoolError, NonceError) as err:
+                logger.info(f"Nonce {lease.address} read failed ({err!r})")
+            await asyncio.sleep(NONCE_POLL_INTERVAL)
+
+    async def submit(self, rebroadcaster, lease, serialized_tx, signature, context):
+        """
+        Marks the lease spent, then sends the transaction and waits for it
+        (Rebroadcaster.submit). Waiting ends when the nonce advances, after
+        NONCE_CONFIRM_SECONDS, or when only NONCE_RESERVE_MS are left.
+
+        :param rebroadcaster: Rebroadcaster
+        :param lease: NonceLease the transaction is signed with
+        :param serialized_tx: Signed, serialized transaction
+        :param signature: Transaction Signature
+        :param context: Lambda context or None
+        :return: Outcome
+        """
+        if not await asyncio.to_thread(self.spend, lease):
+            return Outcome(FAILED, "nonce lease lost")
+        return await rebroadcaster.submit(serialized_tx, signature, None, nonce_deadline(context), self.advanced(lease))
+
+    async def advance(self, address, value):
+        # Plain blockhash transaction, after which nothing signed with value can land
+        latest_blockhash = (await self.rpc_pool.call("get_latest_blockhash", Confirmed)).value
+        serialized_tx, signature = build_v0(
+            self.authority_kp, [advance_ix(address, self.authority_kp.pubkey())], latest_blockhash.blockhash, []
+        )
+        await self.rpc_pool.call("send_raw_transaction", serialized_tx, TxOpts(preflight_commitment=Confirmed))
+        logger.info(f"Advancing nonce {address} ({signature})")
+        current = await self.wait_for_change(address, value, NONCE_SETTLE_SECONDS)
+        if current is None:
+            raise NonceError(f"Nonce {address} did not advance")
+        return current
+
+    async def prepare(self, address, item):
+        # Always the value on the chain. The stored one is stale when the last
+        # holder was stopped before it recycled the nonce
+        try:
+            value = await self.read(address)
+            if "nonce" in item and item["nonce"] != str(value):
+                logger.info(f"Stored value of nonce {address} is stale")
+            if str(value) == item.get("spent"):
+                # The last transaction signed with it never landed. Advance past it first
+                value = await self.advance(address, value)
+        except (RpcPoolError, NonceError) as err:
+            logger.info(f"Nonce {address} not usable ({err!r})")
+            await asyncio.to_thread(self.unlease, address, None, item.get("spent"))
+            return None
+        return NonceLease(address, value, self.authority_kp.pubkey())
+
+    async def acquire(self, count=1):
+        """
+        Leases nonces for one job.
+
+        :param count: Number of nonces (one per transaction)
+        :return: List of NonceLease, empty when nonces are disabled or not enough are free
+        """
+        if not self.enabled:
+            return []
+        leases = []
+        give_up = time.monotonic() + NONCE_WAIT
+        while True:
+            for address in random.sample(self.addresses, len(self.addresses)):
+                if len(leases) == count:
+                    return leases
+                if address in self.held:
+                    continue
+                item = await asyncio.to_thread(self.claim, address)
+                if item is None:
+                    continue
+                lease = await self.prepare(address, item)
+                if lease:
+                    leases.append(lease)
+            if len(leases) == count:
+                return leases
+            if time.monotonic() > give_up:
+                logger.info(f"Fewer than {count} free nonces. Using a recent blockhash")
+                self.release(leases)
+                return []
+            await asyncio.sleep(NONCE_POLL_INTERVAL)
+
+    async def recycle(self, lease):
+        try:
+            value = await self.wait_for_change(lease.address, lease.blockhash, NONCE_SETTLE_SECONDS)
+            if value is None:
+                value = await self.advance(lease.address, lease.blockhash)
+        except (RpcPoolError, NonceError) as err:
+            logger.info(f"Recycling nonce {lease.address} failed ({err!r})")
+            # The next holder advances it before use
+            await asyncio.to_thread(self.unlease, lease.address, None, lease.blockhash)
+            return
+        await asyncio.to_thread(self.unlease, lease.address, value)
+
+    def release(self, leases):
+        """
+        Hands leased nonces back in the background (see drain()). Ones nothing
+        was sent with are just released, spent ones are recycled first. Lease
+        table calls run on a worker thread, so they do not stall the loop.
+
+        :param leases: List of NonceLease
+        """
+        for lease in leases:
+            if not lease.spent:
+                task = asyncio.ensure_future(asyncio.to_thread(self.unlease, lease.address, lease.blockhash))
+            else:
+                task = asyncio.ensure_future(self.recycle(lease))
+            self.recycling.add(task)
+            task.add_done_callback(self.recycling.discard)
+
+    async def drain(self):
+        """
+        Waits for background recycles, so no lease is held while the container is frozen.
+        """
+        if self.recycling:
+            await asyncio.gather(*self.recycling, return_exceptions=True)
+
+
+async def create_nonce_accounts(rpc_pool, manager_kp, count):
+    lamports = (await rpc_pool.call("get_minimum_balance_for_rent_exemption", NONCE_ACCOUNT_SIZE)).value
+    addresses = []
+    for _ in range(count):
+        nonce_kp = Keypair()
+        instructions = create_nonce_account(manager_kp.pubkey(), nonce_kp.pubkey(), manager_kp.pubkey(), lamports)
+        blockhash = (await rpc_pool.call("get_latest_blockhash", Confirmed)).value.blockhash
+        # The new account signs too, so build_v0 (payer only) does not fit
+        message = MessageV0.try_compile(manager_kp.pubkey(), list(instructions), [], blockhash)
+        tx = VersionedTransaction(message, [manager_kp, nonce_kp])
+        await rpc_pool.call("send_raw_transaction", bytes(tx), TxOpts(preflight_commitment=Confirmed))
+        await rpc_pool.call("confirm_transaction", tx.signatures[0], Confirmed)
+        addresses.append(str(nonce_kp.pubkey()))
+        print(f"Created nonce account {nonce_kp.pubkey()}")
+    print("NONCE_ACCOUNTS=" + ",".join(NONCE_ACCOUNTS + addresses))
+
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(
+        create_nonce_accounts(
+            RpcPool.from_env(),
+            Keypair.from_base58_string(os.environ['MANAGER_SECRET']),
+            int(sys.argv[1]),
+        )
+    )
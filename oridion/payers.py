@@ -0,0 +1,129 @@
+"""
+Fee payer pool.
+
+Transactions are paid by one of several fee payer keypairs instead of always
+by the manager. Jobs in the same block then do not all write the same fee
+payer account, and a single drained balance no longer stops every job. The
+manager still signs, because the program requires it. A payer is picked
+round robin or by the fewest jobs in flight. Balances are read in the
+background, and a payer below FEE_PAYER_MIN_BALANCE is skipped until it is
+topped up. Without FEE_PAYER_SECRETS, or when every payer is low, the
+manager pays as before.
+"""
+import os
+import time
+import asyncio
+import logging
+from solana.rpc.commitment import Confirmed
+from solders.keypair import Keypair
+from oridion.rpc import RpcPoolError
+
+logger = logging.getLogger()
+
+# Comma separated base58 fee payer secrets
+FEE_PAYER_SECRETS = [secret for secret in os.environ.get('FEE_PAYER_SECRETS', '').split(',') if secret]
+
+# "round_robin" or "least_inflight"
+FEE_PAYER_STRATEGY = os.environ.get('FEE_PAYER_STRATEGY', 'least_inflight')
+
+# Payers with fewer lamports than this are skipped
+FEE_PAYER_MIN_BALANCE = int(os.environ.get('FEE_PAYER_MIN_BALANCE', '50000000'))
+
+# Seconds between balance reads
+FEE_PAYER_BALANCE_INTERVAL = float(os.environ.get('FEE_PAYER_BALANCE_INTERVAL', '30'))
+
+
+class Payer:
+    """
+    :param keypair: Fee payer Keypair
+    """
+
+    def __init__(self, keypair):
+        self.keypair = keypair
+        self.inflight = 0
+        self.balance = None
+
+    @property
+    def low(self):
+        return self.balance is not None and self.balance < FEE_PAYER_MIN_BALANCE
+
+
+class PayerPool:
+    """
+    :param rpc_pool: RpcPool used for balance reads
+    :param manager_kp: Manager Keypair, pays when no pool payer can
+    :param secrets: Base58 fee payer secrets
+    :param strategy: "round_robin" or "least_inflight"
+    """
+
+    def __init__(self, rpc_pool, manager_kp, secrets=FEE_PAYER_SECRETS, strategy=FEE_PAYER_STRATEGY):
+        self.rpc_pool = rpc_pool
+        self.manager = Payer(manager_kp)
+        self.payers = [Payer(Keypair.from_base58_string(secret)) for secret in secrets]
+        self.strategy = strategy
+        self.next = 0
+        self.checked_at = 0.0
+        self.attempted_at = 0.0
+        self.inflight = None
+        self.first_read = None
+
+    async def check_balances(self):
+        try:
+            resp = await self.rpc_pool.call("get_multiple_accounts", [payer.keypair.pubkey() for payer in self.payers], Confirmed)
+        except RpcPoolError:
+            logger.info("Fee payer balance read failed on every RPC")
+            return
+        for payer, account in zip(self.payers, resp.value):
+            was_low = payer.low
+            payer.balance = account.lamports if account is not None else 0
+            if payer.low and not was_low:
+                logger.error(f"Fee payer {payer.keypair.pubkey()} is low ({payer.balance} lamports). Skipping it")
+            elif was_low and not payer.low:
+                logger.info(f"Fee payer {payer.keypair.pubkey()} topped up ({payer.balance} lamports)")
+        self.checked_at = time.monotonic()
+
+    async def refresh(self):
+        # One read at a time and at most one per interval, failed ones included.
+        # Only the container's first read is waited on, a retry after it failed
+        # runs in the background while payers are picked without balances
+        now = time.monotonic()
+        if now - self.attempted_at >= FEE_PAYER_BALANCE_INTERVAL and (self.inflight is None or self.inflight.done()):
+            self.attempted_at = now
+            self.inflight = asyncio.ensure_future(self.check_balances())
+            if self.first_read is None:
+                self.first_read = self.inflight
+        if self.inflight is self.first_read and not self.inflight.done():
+            await asyncio.shield(self.inflight)
+
+    def choose(self, candidates):
+        if self.strategy == "round_robin":
+            self.next += 1
+            return candidates[self.next % len(candidates)]
+        return min(candidates, key=lambda payer: payer.inflight)
+
+    async def acquire(self):
+        """
+        Picks the fee payer for one job. Hand it back with release().
+
+        :return: Payer (payer.keypair pays the fees)
+        """
+        if not self.payers:
+            return self.manager
+        await self.refresh()
+        candidates = [payer for payer in self.payers if not payer.low]
+        if not candidates:
+            logger.error("Every fee payer is low. The manager pays")
+            payer = self.manager
+        else:
+            payer = self.choose(candidates)
+        payer.inflight += 1
+        return payer
+
+    def release(self, payer):
+        payer.inflight = max(0, payer.inflight - 1)
+
+    def balances(self):
+        """
+        :return: Dict of fee payer address -> last known lamports
+        """
+        return {str(payer.keypair.pubkey()): payer.balance for payer in self.payers}
@@ -0,0 +1,147 @@
+"""
+Planet PDA index.
+
+Maps planet names to their PDA and bump so the [_PLA_, name, _NET_] seed
+search is not repeated on every call. The bumps can be deployed in
+planets.json next to this module (it is not kept in the repo, as it depends
+on the program id) and are turned back into PDAs with a single
+create_program_address each. Without it the index starts empty. The index
+follows the Universe planet list. Names outside it (or seen before a
+lambda without a Universe cache syncs) go to a side cache capped at
+PLANET_UNLISTED_MAX entries, so user supplied names cannot grow it without
+bound.
+
+Build the artifact with the current Universe planet names:
+
+    ORD_PROGRAM_ADDRESS=... python -m oridion.planets ANDORA ...
+"""
+import os
+import sys
+import json
+import logging
+from solders.pubkey import Pubkey
+
+logger = logging.getLogger()
+
+PLANET_INDEX_PATH = os.environ.get(
+    'PLANET_INDEX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'planets.json')
+)
+
+# Names outside the Universe planet list kept at most. The side cache is
+# emptied when it fills up
+PLANET_UNLISTED_MAX = int(os.environ.get('PLANET_UNLISTED_MAX', '256'))
+
+
+def planet_seeds(name):
+    return [b"_PLA_", name.encode(), b"_NET_"]
+
+
+class PlanetIndex:
+    """
+    Planet name -> (PDA, bump) index.
+
+    :param program_id: Oridion program Pubkey
+    :param bumps: Dict of planet name -> known bump
+    """
+
+    def __init__(self, program_id, bumps=None):
+        self.program_id = program_id
+        self.entries = {}
+        self.unlisted = {}
+        for name, bump in (bumps or {}).items():
+            self.add(name, bump)
+
+    @classmethod
+    def load(cls, program_id, path=PLANET_INDEX_PATH):
+        """
+        Loads the deployed index. An artifact built for another program id
+        or a missing file gives an empty index that fills in as it is used.
+
+        :param program_id: Oridion program Pubkey
+        :param path: Path of the json artifact
+        :return: PlanetIndex
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.info("No planet index artifact found. Starting empty")
+            return cls(program_id)
+        if data.get('program_id') != str(program_id):
+            logger.info("Planet index artifact is for another program. Starting empty")
+            return cls(program_id)
+        return cls(program_id, data.get('planets', {}))
+
+    def save(self, path=PLANET_INDEX_PATH):
+        data = {
+            'program_id': str(self.program_id),
+            'planets': {name: bump for name, (pda, bump) in sorted(self.entries.items())},
+        }
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+    def add(self, name, bump):
+        """
+        Derives a planet PDA from a known bump (no search).
+
+        :param name: Planet name
+        :param bump: Bump seed
+        """
+        try:
+            pda = Pubkey.create_program_address(planet_seeds(name) + [bytes([bump])], self.program_id)
+        except Exception:
+            logger.info(f"Bad bump for planet {name} in index. Deriving again..")
+            self.derive(name)
+            return
+        self.entries[name] = (pda, bump)
+
+    def derive(self, name):
+        pda, bump = Pubkey.find_program_address(planet_seeds(name), self.program_id)
+        self.entries[name] = (pda, bump)
+        return pda, bump
+
+    def get(self, name):
+        """
+        :param name: Planet name
+        :return: Tuple of (PDA, bump)
+        """
+        entry = self.entries.get(name) or self.unlisted.get(name)
+        if entry is None:
+            logger.info(f"Planet {name} not in index. Deriving PDA..")
+            entry = Pubkey.find_program_address(planet_seeds(name), self.program_id)
+            if len(self.unlisted) >= PLANET_UNLISTED_MAX:
+                self.unlisted.clear()
+            self.unlisted[name] = entry
+        return entry
+
+    def pda(self, name):
+        """
+        :param name: Planet name
+        :return: Planet PDA
+        """
+        return self.get(name)[0]
+
+    def sync(self, planets):
+        """
+        Brings the index in line with the Universe planet list.
+
+        :param planets: Iterable of planet names (universe.p)
+        :return: True if the index changed
+        """
+        planets = set(planets)
+        known = set(self.entries)
+        if planets == known:
+            return False
+        for name in planets - known:
+            self.derive(name)
+        for name in known - planets:
+            del self.entries[name]
+        logger.info(f"Planet index rebuilt for {len(planets)} planets")
+        return True
+
+
+if __name__ == "__main__":
+    index = PlanetIndex(Pubkey.from_string(os.environ['ORD_PROGRAM_ADDRESS']))
+    index.sync(sys.argv[1:])
+    index.save()
+    print(f"Wrote {len(index.entries)} planets to {PLANET_INDEX_PATH}")
@@ -0,0 +1,89 @@
+"""
+Per container resource registry.
+
+Handlers get their DynamoDB tables, SNS client, manager keypair, RPC pools
+and event loop from here instead of building them per invocation or per
+stream record. Each resource is built the first time it is asked for and
+then reused by every invocation the warm container serves, so warm starts
+do no setup at all. How long each one took to build is logged once and
+kept in init_timings(), which shows what a cold start costs.
+"""
+import os
+import time
+import asyncio
+import logging
+import boto3
+from solders.keypair import Keypair
+from oridion.rpc import RpcPool
+
+logger = logging.getLogger()
+
+resources = {}
+timings = {}
+
+
+def get_resource(name, factory):
+    """
+    :param name: Resource name, one instance per name per container
+    :param factory: Builds the resource the first time it is asked for
+    :return: The resource
+    """
+    if name not in resources:
+        started = time.perf_counter()
+        resources[name] = factory()
+        timings[name] = (time.perf_counter() - started) * 1000
+        logger.info(f"Initialized {name} in {timings[name]:.1f}ms")
+    return resources[name]
+
+
+def init_timings():
+    """
+    :return: Dict of resource name -> milliseconds it took to build
+    """
+    return dict(timings)
+
+
+def get_dynamodb():
+    return get_resource("dynamodb", lambda: boto3.resource('dynamodb'))
+
+
+def get_table(name):
+    """
+    :param name: DynamoDB table name (deposits, jobs, ...)
+    :return: boto3 Table
+    """
+    return get_resource(f"table:{name}", lambda: get_dynamodb().Table(name))
+
+
+def get_sns_client():
+    return get_resource("sns", lambda: boto3.client('sns'))
+
+
+def get_manager_keypair():
+    return get_resource("manager_keypair", lambda: Keypair.from_base58_string(os.environ['MANAGER_SECRET']))
+
+
+def get_rpc_pool(primary='MAINNET_ENV'):
+    """
+    :param primary: Environment variable with the primary RPC url
+    :return: RpcPool (see RpcPool.from_env)
+    """
+    return get_resource(f"rpc_pool:{primary}", lambda: RpcPool.from_env(primary))
+
+
+def get_event_loop():
+    return get_resource("event_loop", asyncio.get_event_loop)
+
+
+def projection(*names):
+    """
+    ProjectionExpression arguments for get_item/query. Names go through
+    ExpressionAttributeNames, so reserved words (type) are fine.
+
+    :param names: Attributes to read
+    :return: Dict of keyword arguments
+    """
+    return {
+        "ProjectionExpression": ", ".join(f"#{name}" for name in names),
+        "ExpressionAttributeNames": {f"#{name}": name for name in names},
+    }
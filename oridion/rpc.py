@@ -0,0 +1,356 @@
+"""
+Pooled RPC layer shared by the lambdas.
+
+Instead of "try Helius, on any exception try BACKUP_RPC" in every helper,
+RpcPool keeps one AsyncClient per configured endpoint and scores each one
+with an EWMA of its latency and error rate. Every call goes to the fastest
+healthy endpoint first and falls through the rest in score order, so once
+an endpoint starts failing the following calls skip it straight away
+instead of paying its timeout again. Only transport errors and timeouts
+count against an endpoint. An error the node answers with (RPCException,
+e.g. a failed preflight) is about the request, so it is raised at once
+without trying the other endpoints.
+
+Latency critical reads can also be hedged: if the first endpoint has not
+answered within a percentile of its recent latencies, the same read is fired
+at the next endpoint and whichever answers first wins.
+
+Sends can be broadcast: the same call goes to every endpoint at once, and
+each endpoint keeps count of how many sends it accepted, how fast, and how
+many it rejected.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from urllib.parse import urlparse
+from solana.rpc.async_api import AsyncClient
+from solana.rpc.core import RPCException
+from solana.rpc.core import RPCNoResultException
+
+logger = logging.getLogger()
+
+# Errors the node answered with. Every endpoint would give the same answer
+ANSWERED_ERRORS = (RPCException, RPCNoResultException)
+
+# Smoothing factor for the latency and error rate EWMAs
+EWMA_ALPHA = float(os.environ.get('RPC_EWMA_ALPHA', '0.3'))
+
+# Hard ceiling for a single attempt against a single endpoint (seconds)
+RPC_TIMEOUT = float(os.environ.get('RPC_TIMEOUT', '10'))
+
+# Once an endpoint has a latency EWMA, attempts are cut off at this multiple
+# of it (but never below RPC_MIN_TIMEOUT)
+RPC_TIMEOUT_FACTOR = float(os.environ.get('RPC_TIMEOUT_FACTOR', '4'))
+RPC_MIN_TIMEOUT = float(os.environ.get('RPC_MIN_TIMEOUT', '1'))
+
+# Endpoints with an error rate EWMA above this are only tried after the
+# healthy ones, until they have gone RPC_COOLDOWN seconds without an error
+RPC_UNHEALTHY_ERROR_RATE = float(os.environ.get('RPC_UNHEALTHY_ERROR_RATE', '0.5'))
+RPC_COOLDOWN = float(os.environ.get('RPC_COOLDOWN', '30'))
+
+# Hedged reads: set RPC_HEDGE=0 to turn them into plain failover calls.
+# The hedge fires once the endpoint has been quiet for RPC_HEDGE_PERCENTILE
+# of its recent latencies, or RPC_HEDGE_DELAY seconds until it has enough samples.
+RPC_HEDGE = os.environ.get('RPC_HEDGE', '1') == '1'
+RPC_HEDGE_PERCENTILE = float(os.environ.get('RPC_HEDGE_PERCENTILE', '0.9'))
+RPC_HEDGE_DELAY = float(os.environ.get('RPC_HEDGE_DELAY', '0.5'))
+RPC_HEDGE_MIN_SAMPLES = 10
+
+# Number of recent latencies kept per endpoint
+RPC_LATENCY_WINDOW = 100
+
+
+class RpcPoolError(Exception):
+    """Raised when a call failed on every endpoint in the pool."""
+
+
+class Endpoint:
+    """
+    One RPC endpoint and its health statistics.
+
+    :param name: Short name used in logs (never the full url, it may hold an api key)
+    :param url: RPC url
+    """
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.client = AsyncClient(url, timeout=RPC_TIMEOUT)
+        self.latency = None
+        self.samples = deque(maxlen=RPC_LATENCY_WINDOW)
+        self.error_rate = 0.0
+        self.last_error = 0.0
+        self.accepted = 0
+        self.rejected = 0
+        self.accept_latency = None
+
+    def healthy(self):
+        if self.error_rate < RPC_UNHEALTHY_ERROR_RATE:
+            return True
+        return time.monotonic() - self.last_error > RPC_COOLDOWN
+
+    def score(self):
+        # Lower is better. Errors inflate the latency the endpoint is judged by.
+        return self.latency * (1 + self.error_rate)
+
+    def timeout(self):
+        if self.latency is None:
+            return RPC_TIMEOUT
+        return min(RPC_TIMEOUT, max(RPC_MIN_TIMEOUT, self.latency * RPC_TIMEOUT_FACTOR))
+
+    def hedge_delay(self):
+        if len(self.samples) < RPC_HEDGE_MIN_SAMPLES:
+            return RPC_HEDGE_DELAY
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(RPC_HEDGE_PERCENTILE * len(ordered)))]
+
+    def record_success(self, elapsed):
+        self.samples.append(elapsed)
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency = EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.latency
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate
+
+    def record_error(self, elapsed):
+        # A failed attempt is never counted as faster than what we already know,
+        # otherwise an endpoint that refuses connections would look quick.
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency = max(self.latency, EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.latency)
+        self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+        self.last_error = time.monotonic()
+
+    def record_accepted(self, elapsed):
+        self.accepted += 1
+        if self.accept_latency is None:
+            self.accept_latency = elapsed
+        else:
+            self.accept_latency = EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.accept_latency
+
+    def record_rejected(self):
+        self.rejected += 1
+
+    def broadcast_stats(self):
+        latency = f"{self.accept_latency * 1000:.0f}ms" if self.accept_latency is not None else "-"
+        return f"{self.name}: accepted={self.accepted} rejected={self.rejected} latency={latency}"
+
+
+class RpcPool:
+    """
+    Health scored pool of RPC endpoints.
+
+    :param endpoints: List of Endpoint, in configured order of preference
+    """
+
+    def __init__(self, endpoints):
+        if not endpoints:
+            raise ValueError("RpcPool needs at least one endpoint")
+        self.endpoints = endpoints
+
+    @classmethod
+    def from_env(cls, primary='MAINNET_ENV'):
+        """
+        Builds the pool from environment variables.
+
+        The primary url comes from ``primary`` (MAINNET_ENV by default). For
+        mainnet it is followed by BACKUP_RPC and any extra urls in the comma
+        separated RPC_ENDPOINTS. Those are mainnet urls, so another cluster
+        only gets the urls in its own <CLUSTER>_ENDPOINTS (e.g. DEVNET_ENDPOINTS
+        for DEVNET_ENV) and never mixes clusters.
+
+        :param primary: Name of the environment variable holding the primary url
+        :return: RpcPool
+        """
+        urls = [os.environ[primary]]
+        if primary == 'MAINNET_ENV':
+            extra = [os.environ.get('BACKUP_RPC', '')] + os.environ.get('RPC_ENDPOINTS', '').split(',')
+        else:
+            extra = os.environ.get(primary.replace('_ENV', '') + '_ENDPOINTS', '').split(',')
+        for url in extra:
+            url = url.strip()
+            if url and url not in urls:
+                urls.append(url)
+
+        endpoints = []
+        for url in urls:
+            name = urlparse(url).hostname or f"rpc{len(endpoints)}"
+            endpoints.append(Endpoint(name, url))
+        return cls(endpoints)
+
+    def ranked(self):
+        """
+        Endpoints in the order they should be tried: healthy before unhealthy,
+        measured before untried, then by score. Ties keep the configured order.
+        """
+        return sorted(
+            self.endpoints,
+            key=lambda e: (not e.healthy(), e.latency is None, e.score() if e.latency is not None else 0),
+        )
+
+    def best(self):
+        return self.ranked()[0]
+
+    async def attempt(self, endpoint, fn):
+        """
+        Runs fn(client) against one endpoint and records the outcome.
+
+        :param endpoint: Endpoint to use
+        :param fn: Callable taking an AsyncClient and returning an awaitable
+        :return: Whatever fn's awaitable returns
+        """
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(endpoint.client), endpoint.timeout())
+        except ANSWERED_ERRORS:
+            # The endpoint did its job
+            endpoint.record_success(time.monotonic() - start)
+            raise
+        except Exception:
+            endpoint.record_error(time.monotonic() - start)
+            raise
+        endpoint.record_success(time.monotonic() - start)
+        return result
+
+    async def run(self, fn, label="RPC call"):
+        """
+        Runs fn(client) on the best endpoint, failing over down the ranking.
+
+        :param fn: Callable taking an AsyncClient and returning an awaitable
+        :param label: Name of the call for logs
+        :return: Whatever fn's awaitable returns
+        """
+        last_err = None
+        for endpoint in self.ranked():
+            try:
+                return await self.attempt(endpoint, fn)
+            except ANSWERED_ERRORS as err:
+                raise RpcPoolError(f"{label} rejected by {endpoint.name}") from err
+            except Exception as err:
+                logger.info(f"{label} failed on {endpoint.name} ({err!r}). Trying next RPC..")
+                last_err = err
+        raise RpcPoolError(f"{label} failed on every RPC endpoint") from last_err
+
+    async def call(self, method, *args, **kwargs):
+        """
+        Calls an AsyncClient method by name through the pool.
+
+        Example: ``await rpc_pool.call("get_block_height")``
+        """
+        return await self.run(lambda client: getattr(client, method)(*args, **kwargs), method)
+
+    async def hedged(self, fn, label="RPC call"):
+        """
+        Runs fn(client) on the best endpoint and hedges it to the next one
+        if the answer is slow. The first successful answer wins and the
+        other attempts are cancelled. An answer whose value is None (e.g. an
+        endpoint a few slots behind) only wins once no other attempt is left.
+        Only use this for reads.
+
+        :param fn: Callable taking an AsyncClient and returning an awaitable
+        :param label: Name of the call for logs
+        :return: Whatever fn's awaitable returns
+        """
+        if not RPC_HEDGE or len(self.endpoints) == 1:
+            return await self.run(fn, label)
+
+        remaining = self.ranked()
+        pending = {}
+        last_err = None
+        empty = None
+
+        def launch():
+            endpoint = remaining.pop(0)
+            pending[asyncio.ensure_future(self.attempt(endpoint, fn))] = endpoint
+            return endpoint
+
+        waiting_on = launch()
+        try:
+            while pending:
+                timeout = waiting_on.hedge_delay() if remaining else None
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"{label} slow on {waiting_on.name}. Hedging to next RPC..")
+                    waiting_on = launch()
+                    continue
+                for task in done:
+                    endpoint = pending.pop(task)
+                    if task.exception() is None:
+                        result = task.result()
+                        if getattr(result, "value", True) is not None:
+                            return result
+                        logger.info(f"{label} found nothing on {endpoint.name}.")
+                        empty = result
+                        continue
+                    last_err = task.exception()
+                    if isinstance(last_err, ANSWERED_ERRORS):
+                        raise RpcPoolError(f"{label} rejected by {endpoint.name}") from last_err
+                    logger.info(f"{label} failed on {endpoint.name} ({last_err!r}).")
+                # Something failed or found nothing, don't wait out the delay before the next try
+                if remaining:
+                    waiting_on = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        if empty is not None:
+            return empty
+        raise RpcPoolError(f"{label} failed on every RPC endpoint") from last_err
+
+    async def hedged_call(self, method, *args, **kwargs):
+        """
+        Hedged version of call().
+
+        Example: ``await rpc_pool.hedged_call("get_latest_blockhash", Confirmed)``
+        """
+        return await self.hedged(lambda client: getattr(client, method)(*args, **kwargs), method)
+
+
+    async def send_to(self, endpoint, fn, label):
+        start = time.monotonic()
+        try:
+            result = await self.attempt(endpoint, fn)
+        except Exception as err:
+            endpoint.record_rejected()
+            logger.info(f"{label} rejected by {endpoint.name} ({err!r})")
+            raise
+        endpoint.record_accepted(time.monotonic() - start)
+        return result
+
+    async def broadcast(self, fn, label="RPC broadcast"):
+        """
+        Runs fn(client) on every endpoint at once and returns the first
+        successful result. The other sends carry on in the background so
+        their accept stats are still recorded. Only use this for sends.
+
+        :param fn: Callable taking an AsyncClient and returning an awaitable
+        :param label: Name of the call for logs
+        :return: Whatever fn's awaitable returns
+        """
+        tasks = [asyncio.ensure_future(self.send_to(endpoint, fn, label)) for endpoint in self.endpoints]
+        for task in tasks:
+            # Errors are already logged and counted in send_to
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        last_err = None
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                return await next_done
+            except Exception as err:
+                last_err = err
+        raise RpcPoolError(f"{label} failed on every RPC endpoint") from last_err
+
+    async def broadcast_call(self, method, *args, **kwargs):
+        """
+        Broadcast version of call().
+
+        Example: ``await rpc_pool.broadcast_call("send_raw_transaction", serialized_tx, opts)``
+        """
+        return await self.broadcast(lambda client: getattr(client, method)(*args, **kwargs), method)
+
+    def broadcast_stats(self):
+        """
+        :return: One line of accept stats per endpoint, for logs
+        """
+        return "; ".join(endpoint.broadcast_stats() for endpoint in self.endpoints)
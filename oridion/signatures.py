@@ -0,0 +1,151 @@
+"""
+Shared websocket for signature confirmations.
+
+Instead of a websocket handshake per transaction, every container keeps one
+websocket open and multiplexes all signatureSubscribe calls over it.
+Notifications are routed to per signature futures by subscription id. If the
+socket drops, it reconnects and resubscribes everything still waiting.
+"""
+import asyncio
+import logging
+import itertools
+from solana.rpc.websocket_api import connect
+from solana.rpc.websocket_api import SubscriptionError
+from solders.commitment_config import CommitmentLevel
+from solders.rpc.config import RpcSignatureSubscribeConfig
+from solders.rpc.requests import SignatureSubscribe
+from solders.rpc.requests import SignatureUnsubscribe
+from solders.rpc.responses import SignatureNotification
+from solders.rpc.responses import SubscriptionResult
+
+logger = logging.getLogger()
+
+COMMITMENT_LEVELS = {
+    "processed": CommitmentLevel.Processed,
+    "confirmed": CommitmentLevel.Confirmed,
+    "finalized": CommitmentLevel.Finalized,
+}
+
+# Seconds to wait before reconnecting a dropped websocket
+RECONNECT_DELAY = 1
+
+# Keepalive so a dead socket (e.g. after the container was frozen) is noticed quickly
+PING_INTERVAL = 10
+PING_TIMEOUT = 10
+
+
+class Waiter:
+    def __init__(self, future):
+        self.future = future
+        self.count = 0
+
+
+class SignatureSubscriptions:
+    """
+    Long lived signatureSubscribe multiplexer.
+
+    :param wss_url: Websocket url
+    :param commitment: Commitment to wait for ("confirmed" by default)
+    """
+
+    def __init__(self, wss_url, commitment="confirmed"):
+        self.wss_url = wss_url
+        self.config = RpcSignatureSubscribeConfig(commitment=COMMITMENT_LEVELS[commitment])
+        self.websocket = None
+        self.task = None
+        self.request_ids = itertools.count(1)
+        self.requests = {}
+        self.subscriptions = {}
+        self.waiters = {}
+
+    def start(self):
+        """Starts the connection task on the running loop (once)."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                async with connect(self.wss_url, ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT) as websocket:
+                    self.websocket = websocket
+                    self.requests.clear()
+                    self.subscriptions.clear()
+                    for signature in list(self.waiters):
+                        await self.subscribe(signature)
+                    if self.waiters:
+                        logger.info(f"Websocket connected. Resubscribed {len(self.waiters)} signatures")
+                    while True:
+                        try:
+                            msgs = await websocket.recv()
+                        except SubscriptionError as err:
+                            self.fail(err.subscription.id, err)
+                            continue
+                        for msg in msgs:
+                            self.dispatch(msg)
+            except Exception as err:
+                logger.info(f"Signature websocket dropped ({err!r}). Reconnecting..")
+            self.websocket = None
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def subscribe(self, signature):
+        request_id = next(self.request_ids)
+        self.requests[request_id] = signature
+        await self.websocket.send_data(SignatureSubscribe(signature, self.config, request_id))
+
+    async def unsubscribe(self, signature):
+        for subscription_id, subscribed in list(self.subscriptions.items()):
+            if subscribed == signature:
+                del self.subscriptions[subscription_id]
+                if self.websocket is not None:
+                    await self.websocket.send_data(SignatureUnsubscribe(subscription_id, next(self.request_ids)))
+
+    def dispatch(self, msg):
+        if isinstance(msg, SubscriptionResult):
+            signature = self.requests.pop(msg.id, None)
+            if signature is not None:
+                self.subscriptions[msg.result] = signature
+        elif isinstance(msg, SignatureNotification):
+            # Signature subscriptions end on the server after their notification
+            signature = self.subscriptions.pop(msg.subscription, None)
+            self.websocket.subscriptions.pop(msg.subscription, None)
+            waiter = self.waiters.get(signature)
+            if waiter is not None and not waiter.future.done():
+                waiter.future.set_result(msg.result.value)
+
+    def fail(self, request_id, err):
+        signature = self.requests.pop(request_id, None)
+        waiter = self.waiters.get(signature)
+        if waiter is not None and not waiter.future.done():
+            waiter.future.set_exception(err)
+
+    async def wait(self, signature):
+        """
+        Waits for the signature notification on the shared websocket.
+
+        :param signature: Transaction Signature
+        :return: Notification value (RpcSignatureResponse, check ``.err``)
+        """
+        self.start()
+        waiter = self.waiters.get(signature)
+        if waiter is None:
+            waiter = Waiter(asyncio.get_event_loop().create_future())
+            self.waiters[signature] = waiter
+            if self.websocket is not None:
+                try:
+                    await self.subscribe(signature)
+                except Exception as err:
+                    # The reconnect resubscribes everything still waiting
+                    logger.info(f"Subscribe failed ({err!r}). Waiting for reconnect..")
+        waiter.count += 1
+        try:
+            return await asyncio.shield(waiter.future)
+        finally:
+            waiter.count -= 1
+            if waiter.count == 0 and self.waiters.get(signature) is waiter:
+                del self.waiters[signature]
+                if not waiter.future.done():
+                    waiter.future.cancel()
+                    try:
+                        await self.unsubscribe(signature)
+                    except Exception:
+                        pass
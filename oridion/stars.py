@@ -0,0 +1,99 @@
+"""
+Pre-generated star ID / PDA pool.
+
+Star hops need two or three fresh star IDs and their [_ST_, id, _AR_] PDAs.
+The pool derives batches of (star_id, PDA, bump) on a background thread so
+a hop job only pops ready made entries. IDs are checked against the ones
+handed out recently so one container never reuses a star ID.
+"""
+import os
+import string
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from solders.pubkey import Pubkey
+
+logger = logging.getLogger()
+
+# Entries derived per refill, and the level at which a refill starts
+STAR_POOL_SIZE = int(os.environ.get('STAR_POOL_SIZE', '30'))
+STAR_POOL_LOW_WATER = int(os.environ.get('STAR_POOL_LOW_WATER', '10'))
+
+# Number of star IDs remembered for collision checks
+STAR_RECENT_IDS = 10000
+
+
+def id_generator(size=8, chars=string.ascii_uppercase + string.digits):
+    return ''.join(random.choice(chars) for _ in range(size))
+
+
+def star_seeds(star_id):
+    return [b"_ST_", star_id.encode(), b"_AR_"]
+
+
+class StarPool:
+    """
+    Pool of (star_id, PDA, bump) tuples. Starts filling as soon as it is created.
+
+    :param program_id: Oridion program Pubkey
+    :param size: Entries to keep ready
+    :param low_water: Start a background refill below this many entries
+    """
+
+    def __init__(self, program_id, size=STAR_POOL_SIZE, low_water=STAR_POOL_LOW_WATER):
+        self.program_id = program_id
+        self.size = size
+        self.low_water = low_water
+        self.stars = deque()
+        self.seen = set()
+        self.seen_order = deque()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.refilling = None
+        self.refill_in_background()
+
+    def reserve_id(self):
+        # New ID that has not been pooled or used recently
+        with self.lock:
+            while True:
+                star_id = id_generator()
+                if star_id not in self.seen:
+                    break
+            self.seen.add(star_id)
+            self.seen_order.append(star_id)
+            if len(self.seen_order) > STAR_RECENT_IDS:
+                self.seen.discard(self.seen_order.popleft())
+        return star_id
+
+    def derive(self, star_id):
+        pda, bump = Pubkey.find_program_address(star_seeds(star_id), self.program_id)
+        return (star_id, pda, bump)
+
+    def fill(self):
+        while len(self.stars) < self.size:
+            self.stars.append(self.derive(self.reserve_id()))
+
+    def refill_in_background(self):
+        if len(self.stars) < self.low_water and (self.refilling is None or self.refilling.done()):
+            self.refilling = self.executor.submit(self.fill)
+
+    def take(self):
+        """
+        :return: Tuple of (star_id, PDA, bump)
+        """
+        try:
+            star = self.stars.popleft()
+        except IndexError:
+            logger.info("Star pool empty. Deriving star PDA inline..")
+            star = self.derive(self.reserve_id())
+        self.refill_in_background()
+        return star
+
+    def take_many(self, count):
+        """
+        :param count: Number of stars
+        :return: List of (star_id, PDA, bump) tuples with distinct IDs
+        """
+        return [self.take() for _ in range(count)]
@@ -0,0 +1,120 @@
+"""
+Batched signature status tracker.
+
+Every job in a container that waits on a signature registers it here instead
+of polling on its own. One background tick per interval reads the statuses
+of all pending signatures with getSignatureStatuses (up to 256 per call) and
+the block height once, then hands the results to every waiting job. The tick
+only runs while something is waiting.
+"""
+import os
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger()
+
+# Seconds between status ticks
+TRACKER_INTERVAL = float(os.environ.get('TRACKER_INTERVAL', '1'))
+
+# getSignatureStatuses accepts at most 256 signatures per call
+MAX_SIGNATURES_PER_CALL = 256
+
+
+class SignatureTracker:
+    """
+    :param rpc_pool: RpcPool used for the status and block height reads
+    :param interval: Seconds between ticks
+    """
+
+    def __init__(self, rpc_pool, interval=TRACKER_INTERVAL):
+        self.rpc_pool = rpc_pool
+        self.interval = interval
+        self.waiters = {}
+        self.height = None
+        self.height_at = 0.0
+        self.height_inflight = None
+        self.task = None
+        self.height_listeners = []
+
+    def add_height_listener(self, fn):
+        """
+        Registers fn(height) to be called with every block height read.
+
+        :param fn: Callable taking the block height (e.g. BlockhashCache.observe_block_height)
+        """
+        self.height_listeners.append(fn)
+
+    def start(self):
+        """Starts the tick task on the running loop if it is not running."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while self.waiters:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception as err:
+                logger.info(f"Signature tracker tick failed ({err!r})")
+
+    async def tick(self):
+        waiters = self.waiters
+        self.waiters = {}
+        signatures = list(waiters)
+        chunks = [
+            signatures[i:i + MAX_SIGNATURES_PER_CALL] for i in range(0, len(signatures), MAX_SIGNATURES_PER_CALL)
+        ]
+        results = await asyncio.gather(
+            self.read_block_height(), *[self.read_statuses(chunk) for chunk in chunks], return_exceptions=True
+        )
+        for chunk, statuses in zip(chunks, results[1:]):
+            for i, signature in enumerate(chunk):
+                for future in waiters[signature]:
+                    if future.done():
+                        continue
+                    if isinstance(statuses, Exception):
+                        future.set_exception(statuses)
+                    else:
+                        future.set_result(statuses[i])
+
+    async def read_statuses(self, signatures):
+        return (await self.rpc_pool.call("get_signature_statuses", signatures)).value
+
+    async def read_block_height(self):
+        # Concurrent callers share one request
+        if self.height_inflight is None or self.height_inflight.done():
+            self.height_inflight = asyncio.ensure_future(self.fetch_block_height())
+        return await asyncio.shield(self.height_inflight)
+
+    async def fetch_block_height(self):
+        self.height = (await self.rpc_pool.hedged_call("get_block_height")).value
+        self.height_at = time.monotonic()
+        for fn in self.height_listeners:
+            fn(self.height)
+        return self.height
+
+    async def block_height(self):
+        """
+        Block height shared by every job, read at most once per interval.
+
+        :return: Block height
+        :raises RpcPoolError: If it could not be read from any RPC
+        """
+        if self.height is not None and time.monotonic() - self.height_at < self.interval:
+            return self.height
+        return await self.read_block_height()
+
+    async def next_status(self, signature):
+        """
+        Waits for the next tick that includes the signature.
+
+        :param signature: Transaction Signature
+        :return: TransactionStatus or None if the RPC has not seen it
+        :raises RpcPoolError: If the status read failed on every RPC
+        """
+        future = asyncio.get_event_loop().create_future()
+        self.waiters.setdefault(signature, []).append(future)
+        self.start()
+        return await future
+
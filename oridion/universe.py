@@ -0,0 +1,164 @@
+"""
+Per container cache of the decoded Universe account.
+
+The lambdas only read fee fields and the planet list from the Universe, so
+the decoded account is kept for the lifetime of the container. It is kept
+fresh by an accountSubscribe on the Universe address. When no subscription
+is live, a TTL decides when to read the account again. A subscription only
+counts as live while the event loop keeps receiving from it. After a freeze,
+or any gap longer than UNIVERSE_HEARTBEAT, the TTL applies again until the
+next notification or heartbeat. Updates are only applied if they come from a
+slot at least as new as the cached one, so a lagging RPC can never roll the
+cache back.
+"""
+import os
+import time
+import asyncio
+import logging
+from solana.rpc.commitment import Confirmed
+from solana.rpc.websocket_api import connect
+from solders.rpc.responses import AccountNotification
+from anchor.accounts import Universe
+
+logger = logging.getLogger()
+
+# Without a live subscription, re-read the Universe after this many seconds
+UNIVERSE_TTL = float(os.environ.get('UNIVERSE_TTL', '15'))
+
+# Even with a live subscription, re-read after this many seconds. A frozen
+# container can hold a dead socket that has not noticed it is dead yet.
+UNIVERSE_MAX_AGE = float(os.environ.get('UNIVERSE_MAX_AGE', '300'))
+
+# Seconds between heartbeats of the subscription loop. A longer gap means the
+# loop was idle (e.g. the container was frozen), so the TTL applies again
+UNIVERSE_HEARTBEAT = float(os.environ.get('UNIVERSE_HEARTBEAT', '1'))
+
+# Seconds to wait before reconnecting a dropped subscription
+UNIVERSE_RECONNECT_DELAY = 2
+
+
+class UniverseCache:
+    """
+    Universe account cache.
+
+    :param rpc_pool: RpcPool used for reads
+    :param address: Universe account Pubkey
+    :param wss_url: Websocket url for accountSubscribe, None for TTL only
+    :param ttl: Seconds a read stays fresh without a subscription
+    """
+
+    def __init__(self, rpc_pool, address, wss_url=None, ttl=UNIVERSE_TTL):
+        self.rpc_pool = rpc_pool
+        self.address = address
+        self.wss_url = wss_url
+        self.ttl = ttl
+        self.universe = None
+        self.planets = frozenset()
+        self.slot = 0
+        self.fetched_at = 0.0
+        self.subscribed = False
+        self.alive_at = 0.0
+        self.inflight = None
+        self.task = None
+        self.listeners = []
+
+    def add_listener(self, fn):
+        """
+        Registers fn(planets) to be called whenever the planet list changes.
+
+        :param fn: Callable taking the planet frozenset
+        """
+        self.listeners.append(fn)
+        if self.universe is not None:
+            fn(self.planets)
+
+    def fresh(self):
+        if self.universe is None:
+            return False
+        now = time.monotonic()
+        age = now - self.fetched_at
+        if self.subscribed and now - self.alive_at < 2 * UNIVERSE_HEARTBEAT:
+            return age < UNIVERSE_MAX_AGE
+        return age < self.ttl
+
+    def update(self, data, slot):
+        """
+        Decodes and stores account data seen at ``slot``.
+
+        :param data: Raw account data
+        :param slot: Slot the data was read or notified at
+        """
+        self.fetched_at = time.monotonic()
+        if slot < self.slot:
+            return
+        universe = Universe.decode(data)
+        planets = frozenset(universe.p)
+        changed = self.universe is None or planets != self.planets
+        self.universe = universe
+        self.planets = planets
+        self.slot = slot
+        if changed:
+            for fn in self.listeners:
+                fn(planets)
+
+    async def refresh(self):
+        resp = await self.rpc_pool.hedged_call("get_account_info", self.address, Confirmed)
+        if resp.value is None:
+            raise ValueError("Universe account not found")
+        self.update(resp.value.data, resp.context.slot)
+        return self.universe
+
+    async def fetch(self):
+        # Concurrent callers share one request
+        if self.inflight is None or self.inflight.done():
+            self.inflight = asyncio.ensure_future(self.refresh())
+        return await asyncio.shield(self.inflight)
+
+    def start(self):
+        """Starts the accountSubscribe task on the running loop (once)."""
+        if self.wss_url and (self.task is None or self.task.done()):
+            self.task = asyncio.ensure_future(self.subscribe_loop())
+
+    async def subscribe_loop(self):
+        while True:
+            try:
+                async with connect(self.wss_url) as websocket:
+                    await websocket.account_subscribe(self.address, Confirmed, "base64")
+                    await websocket.recv()
+                    # Read once more so nothing between the last read and the subscription is missed
+                    await self.fetch()
+                    self.subscribed = True
+                    self.alive_at = time.monotonic()
+                    logger.info("Subscribed to Universe account")
+                    while True:
+                        try:
+                            msgs = await asyncio.wait_for(websocket.recv(), UNIVERSE_HEARTBEAT)
+                        except asyncio.TimeoutError:
+                            msgs = []
+                        self.alive_at = time.monotonic()
+                        for msg in msgs:
+                            if isinstance(msg, AccountNotification):
+                                self.update(msg.result.value.data, msg.result.context.slot)
+                                logger.info(f"Universe updated at slot {self.slot}")
+            except Exception as err:
+                logger.info(f"Universe subscription dropped ({err!r}). Reconnecting..")
+            self.subscribed = False
+            await asyncio.sleep(UNIVERSE_RECONNECT_DELAY)
+
+    async def get(self):
+        """
+        Returns the decoded Universe, reading it only when the cache is not fresh.
+        A stale copy is returned if the read fails.
+
+        :return: Universe or False if it was never read
+        """
+        self.start()
+        if not self.fresh():
+            try:
+                await self.fetch()
+            except Exception as err:
+                logger.info(f"Universe fetch failed ({err!r})")
+                if self.universe is None:
+                    return False
+                logger.info("Using stale Universe")
+        return self.universe
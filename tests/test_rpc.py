@@ -0,0 +1,30 @@
+from oridion.rpc import RpcPool
+
+
+def test_devnet_pool_only_has_devnet_urls(monkeypatch):
+    monkeypatch.setenv("MAINNET_ENV", "https://mainnet.example.com")
+    monkeypatch.setenv("BACKUP_RPC", "https://backup.mainnet.example.com")
+    monkeypatch.setenv("RPC_ENDPOINTS", "https://extra.mainnet.example.com")
+    monkeypatch.setenv("DEVNET_ENV", "https://devnet.example.com")
+    monkeypatch.setenv("DEVNET_ENDPOINTS", "https://backup.devnet.example.com")
+
+    pool = RpcPool.from_env("DEVNET_ENV")
+
+    assert [endpoint.url for endpoint in pool.endpoints] == [
+        "https://devnet.example.com",
+        "https://backup.devnet.example.com",
+    ]
+
+
+def test_mainnet_pool_keeps_backup_and_extra_urls(monkeypatch):
+    monkeypatch.setenv("MAINNET_ENV", "https://mainnet.example.com")
+    monkeypatch.setenv("BACKUP_RPC", "https://backup.mainnet.example.com")
+    monkeypatch.setenv("RPC_ENDPOINTS", "https://extra.mainnet.example.com")
+
+    pool = RpcPool.from_env()
+
+    assert [endpoint.url for endpoint in pool.endpoints] == [
+        "https://mainnet.example.com",
+        "https://backup.mainnet.example.com",
+        "https://extra.mainnet.example.com",
+    ]